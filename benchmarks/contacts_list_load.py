@@ -0,0 +1,88 @@
+"""
+Load benchmark for GET /api/contacts.
+
+Drives the application in-process (one event loop, the same as a single uvicorn worker)
+with many concurrent requests and prints requests/second and latency percentiles.
+The database configured by SQLALCHEMY_DATABASE_URL is used as is, so seed it first.
+Authentication and the rate limiter are overridden, only the handler and the database
+layer are measured.
+
+Run it on the commit before the async database layer and on the current one to compare:
+
+    python benchmarks/contacts_list_load.py --requests 2000 --concurrency 50 --limit 50
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+
+from main import app  # noqa: E402
+from src.conf.config import settings  # noqa: E402
+from src.database.models import User  # noqa: E402
+from src.services.auth import auth_service  # noqa: E402
+
+
+def override_dependencies():
+    """
+    The override_dependencies function replaces authentication with a fixed user and turns rate limiting off.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    app.dependency_overrides[auth_service.get_current_user] = lambda: User(id=1, email="bench@example.com")
+    settings.rate_limit_enabled = False
+
+
+async def run(total: int, concurrency: int, limit: int):
+    """
+    The run function fires total requests with at most concurrency of them in flight.
+
+    :param total: int: Number of requests to send
+    :param concurrency: int: Number of requests in flight at the same time
+    :param limit: int: Page size requested from the endpoint
+    :return: Elapsed seconds and the list of per-request latencies
+    :doc-author: Trelent
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get("/api/contacts/", params={"limit": limit})
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    override_dependencies()
+    elapsed, latencies = asyncio.run(run(args.requests, args.concurrency, args.limit))
+    latencies.sort()
+    print(f"requests:    {args.requests} (concurrency {args.concurrency}, limit {args.limit})")
+    print(f"elapsed:     {elapsed:.2f} s")
+    print(f"throughput:  {args.requests / elapsed:.1f} req/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"latency p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Offset vs keyset pagination benchmark for the contacts repository.
+
+Seeds a SQLite database (or the one given with --url) with --rows contacts and times
+fetching one page at increasing depths with get_contacts (LIMIT/OFFSET) and with
+get_contacts_after (keyset), ordered by id and by (last_name, id).
+
+    python benchmarks/contacts_pagination.py --rows 1000000 --limit 50
+"""
+import argparse
+import asyncio
+import random
+import string
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert, select  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+
+from src.database.models import Base, Contact, User  # noqa: E402
+from src.repository import contacts as repository_contacts  # noqa: E402
+
+OWNER = User(id=1)
+
+
+async def seed(engine, rows: int):
+    """
+    The seed function recreates the schema and inserts rows random contacts of OWNER in batches.
+
+    :param engine: AsyncEngine: The engine to seed
+    :param rows: int: Number of contacts to insert
+    :return: None
+    :doc-author: Trelent
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"id": OWNER.id, "username": "bench", "email": "bench@example.com",
+                                            "password": "-", "confirmed": True}])
+        batch = []
+        for i in range(rows):
+            batch.append({
+                "first_name": "Name",
+                "last_name": "".join(random.choices(string.ascii_lowercase, k=8)),
+                "email": f"contact{i}@example.com",
+                "phone": "+380123456789",
+                "birthday": datetime(1990, 1, 1),
+                "user_id": OWNER.id,
+            })
+            if len(batch) == 10000:
+                await conn.execute(insert(Contact), batch)
+                batch = []
+        if batch:
+            await conn.execute(insert(Contact), batch)
+
+
+async def timed(coro_factory, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await coro_factory()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+async def run(url: str, rows: int, limit: int, reseed: bool):
+    engine = create_async_engine(url)
+    if reseed:
+        print(f"seeding {rows} contacts...")
+        await seed(engine, rows)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with session_factory() as db:
+        print(f"{'depth':>10} {'offset/id':>12} {'keyset/id':>12} {'offset/name':>12} {'keyset/name':>12}  (ms)")
+        depth = 0
+        while depth < rows:
+            # Sort values of the row just before the page, as they would come from a cursor.
+            after_name = (await db.execute(
+                select(Contact.last_name, Contact.id).where(Contact.user_id == OWNER.id)
+                .order_by(Contact.last_name, Contact.id).offset(max(depth - 1, 0)).limit(1))).one()
+
+            async def offset_by_name():
+                stmt = (select(Contact).where(Contact.user_id == OWNER.id).order_by(Contact.last_name, Contact.id)
+                        .limit(limit).offset(depth))
+                return (await db.execute(stmt)).scalars().all()
+
+            by_name = list(after_name)
+            results = [
+                await timed(lambda: repository_contacts.get_contacts(limit, depth, OWNER, db)),
+                await timed(lambda: repository_contacts.get_contacts_after(limit, "id", [depth], OWNER, db)),
+                await timed(offset_by_name),
+                await timed(lambda: repository_contacts.get_contacts_after(limit, "last_name", by_name, OWNER, db)),
+            ]
+            db.expunge_all()
+            print(f"{depth:>10} " + " ".join(f"{value:>12.2f}" for value in results))
+            depth = depth * 10 if depth else 1000
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="sqlite+aiosqlite:///./pagination_bench.db")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the contacts already in the database")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.rows, args.limit, not args.no_seed))
+
+
+if __name__ == "__main__":
+    main()
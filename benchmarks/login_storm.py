@@ -0,0 +1,110 @@
+"""
+Latency of GET /api/contacts during a concurrent login storm.
+
+Runs the application in-process on a temporary SQLite database with one confirmed user,
+keeps --logins login requests in flight and measures GET /api/contacts latency meanwhile.
+With --blocking bcrypt runs on the event loop, as it did before the worker pool, which gives
+the baseline to compare against.
+
+    python benchmarks/login_storm.py --logins 8 --reads 100
+    python benchmarks/login_storm.py --logins 8 --reads 100 --blocking
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+
+from main import app  # noqa: E402
+from src.conf.config import settings  # noqa: E402
+from src.database.db import get_db  # noqa: E402
+from src.database.models import Base, User  # noqa: E402
+from src.services.auth import auth_service  # noqa: E402
+from src.services.password import PasswordHasher  # noqa: E402
+
+EMAIL, PASSWORD = "storm@example.com", "12345678"
+
+
+async def prepare(url: str):
+    """
+    The prepare function creates the schema, the confirmed user and overrides the database,
+    authentication and rate limiting dependencies of the application.
+
+    :param url: str: Database url
+    :return: The engine
+    :doc-author: Trelent
+    """
+    engine = create_async_engine(url)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_factory() as db:
+        db.add(User(username="storm", email=EMAIL, password=auth_service.get_password_hash(PASSWORD), confirmed=True))
+        await db.commit()
+
+    async def override_get_db():
+        async with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[auth_service.get_current_user] = lambda: User(id=1, email=EMAIL)
+    settings.rate_limit_enabled = False
+    return engine
+
+
+async def run(logins: int, reads: int):
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def storm():
+            while not stop.is_set():
+                response = await client.post("/api/auth/login", data={"username": EMAIL, "password": PASSWORD})
+                response.raise_for_status()
+
+        workers = [asyncio.create_task(storm()) for _ in range(logins)]
+        await asyncio.sleep(0.5)
+        for _ in range(reads):
+            started = time.perf_counter()
+            response = await client.get("/api/contacts/")
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+        stop.set()
+        await asyncio.gather(*workers)
+    return sorted(latencies)
+
+
+async def main_async(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = await prepare(f"sqlite+aiosqlite:///{tmp}/storm.db")
+        if args.blocking:
+            async def inline(self, fn, *fn_args):
+                return fn(*fn_args)
+            PasswordHasher._run = inline
+        latencies = await run(args.logins, args.reads)
+        await engine.dispose()
+    mode = "bcrypt on the event loop" if args.blocking else "bcrypt in the worker pool"
+    print(f"{mode}: {args.logins} concurrent logins, {args.reads} reads")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1000:.1f} ms")
+    print(f"latency p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print(f"latency max: {latencies[-1] * 1000:.1f} ms")
+    print(f"hasher: {auth_service.hasher.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=20, help="login requests kept in flight")
+    parser.add_argument("--reads", type=int, default=100, help="GET /api/contacts requests to measure")
+    parser.add_argument("--blocking", action="store_true", help="hash on the event loop (baseline)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Throughput of the mail dispatcher against a local SMTP stand-in.
+
+Queues --messages confirmation emails and measures how long it takes to deliver them all.
+With --per-message every message opens its own connection, as send_email did before the
+dispatcher, which gives the baseline to compare against. --latency adds a delay to every
+new connection to approximate a TLS handshake and login against a remote server.
+
+    python benchmarks/mail_throughput.py --messages 500
+    python benchmarks/mail_throughput.py --messages 500 --per-message
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src.services.email import MailDispatcher, build_confirmation_email  # noqa: E402
+from tests.smtp_server import SMTPStub  # noqa: E402
+
+
+class SlowHandshakeStub(SMTPStub):
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    async def _handle(self, reader, writer):
+        await asyncio.sleep(self.latency)
+        await super()._handle(reader, writer)
+
+
+async def main(args):
+    server = await SlowHandshakeStub(args.latency).start()
+    dispatcher = MailDispatcher(hostname=server.host, port=server.port, use_tls=False,
+                                pool_size=args.pool_size, batch_size=args.batch_size, retry_backoff=0)
+    messages = [build_confirmation_email(f"user{i}@example.com", f"user{i}", "http://localhost:8000/")
+                for i in range(args.messages)]
+
+    started = time.perf_counter()
+    if args.per_message:
+        # Previous behaviour: a new connection for every message, --pool-size sends at a time.
+        semaphore = asyncio.Semaphore(args.pool_size)
+
+        async def send(message):
+            async with semaphore:
+                smtp = await dispatcher._deliver(None, message)
+                if smtp is not None:
+                    await smtp.quit()
+
+        await asyncio.gather(*(send(message) for message in messages))
+    else:
+        for message in messages:
+            await dispatcher.enqueue(message)
+        await dispatcher.stop()
+    elapsed = time.perf_counter() - started
+    await server.stop()
+
+    print(f"mode: {'per-message' if args.per_message else 'dispatcher'}")
+    print(f"delivered: {len(server.messages)} of {args.messages}, connections: {server.connections}")
+    print(f"elapsed: {elapsed:.2f}s, throughput: {len(server.messages) / elapsed:.0f} messages/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every new connection")
+    parser.add_argument("--per-message", action="store_true")
+    asyncio.run(main(parser.parse_args()))
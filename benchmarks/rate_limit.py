@@ -0,0 +1,70 @@
+"""
+Cost of a rate limit check.
+
+Times RateLimiter.hit for a user-limited route, which draws from the route and the user policy
+at once: against the local buckets (the fallback when Redis is down) and, with --redis,
+against Redis with one script call per check. --concurrency checks are kept in flight.
+
+    python benchmarks/rate_limit.py --checks 20000
+    python benchmarks/rate_limit.py --checks 20000 --redis --concurrency 50
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import redis.asyncio as redis  # noqa: E402
+
+from src.conf.config import settings  # noqa: E402
+from src.services.rate_limit import RateLimiter  # noqa: E402
+
+# High enough that no check is limited, a limited check costs the same
+POLICIES = {"contacts_list": "1000000000/1", "user": "1000000000/1"}
+
+
+async def measure(limiter: RateLimiter, checks: int, concurrency: int, users: int) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await limiter.hit(f"user:{i % users}", ["contacts_list", "user"])
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(checks)))
+    return latencies
+
+
+def report(name: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<8} mean {statistics.mean(latencies) * 1e6:8.1f} us   p99 {p99 * 1e6:8.1f} us")
+
+
+async def main(args):
+    report("local", await measure(RateLimiter(POLICIES), args.checks, args.concurrency, args.users))
+    if args.redis:
+        client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0,
+                             max_connections=args.concurrency)
+        limiter = RateLimiter(POLICIES, redis_client=client, prefix="ratelimit-bench")
+        await measure(limiter, args.concurrency, args.concurrency, args.users)  # loads the script, opens connections
+        latencies = await measure(limiter, args.checks, args.concurrency, args.users)
+        await client.close()
+        if limiter.stats["redis_errors"]:
+            print(f"Redis failed, the checks used the local buckets: {limiter.stats}")
+            return
+        report("redis", latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--users", type=int, default=1000, help="distinct users the checks are spread over")
+    parser.add_argument("--redis", action="store_true", help="also measure against REDIS_HOST:REDIS_PORT")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,65 @@
+"""
+Serialization micro-benchmarks for a page of contacts.
+
+Builds --size Contact rows in memory and times turning them into the JSON body of GET /api/contacts:
+
+    response_model    what FastAPI does for a response_model: validation, jsonable_encoder, json.dumps
+    orjson_response   the same validation and jsonable_encoder, rendered by ORJSONResponse
+    dump_json         validation from attributes and dump_json, both in pydantic-core
+    orm_to_json       the rows dumped straight to bytes with orjson, as the contacts routes do
+
+    python benchmarks/serialization.py --size 500 --number 200
+"""
+import argparse
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from src.database.models import Contact  # noqa: E402
+from src.schemas import ContactResponse  # noqa: E402
+from src.services.serialization import orm_to_json  # noqa: E402
+
+
+def make_contacts(size: int) -> list[Contact]:
+    now = datetime.now()
+    return [Contact(id=i, first_name=f"Name{i}", last_name="Petrenko", email=f"contact{i}@example.com",
+                    phone="+380123456789", birthday=datetime(1990, 1, 1), created_at=now, updated_at=now)
+            for i in range(1, size + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=500, help="contacts per page")
+    parser.add_argument("--number", type=int, default=100, help="serializations per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    contacts = make_contacts(args.size)
+    adapter = TypeAdapter(List[ContactResponse])
+    cases = {
+        "response_model": lambda: JSONResponse(
+            jsonable_encoder(adapter.validate_python(contacts, from_attributes=True))).body,
+        "orjson_response": lambda: ORJSONResponse(
+            jsonable_encoder(adapter.validate_python(contacts, from_attributes=True))).body,
+        "dump_json": lambda: adapter.dump_json(adapter.validate_python(contacts, from_attributes=True)),
+        "orm_to_json": lambda: orm_to_json(ContactResponse, contacts),
+    }
+    expected = cases["response_model"]()
+    print(f"{args.size} contacts, {len(expected)} bytes")
+    print(f"{'case':<16} {'ms/page':>10} {'pages/s':>10}")
+    for name, case in cases.items():
+        assert case() == expected, name
+        best = min(timeit.repeat(case, number=args.number, repeat=args.repeat)) / args.number
+        print(f"{name:<16} {best * 1000:>10.3f} {1 / best:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Access token verifications per second.
+
+For HS256 with SECRET_KEY and for freshly generated RS256 and ES256 keys, times:
+
+    jose_decode   jwt.decode with the key as text, as get_current_user did before TokenVerifier
+    decode        TokenVerifier.decode, the key parsed once and picked by kid
+    verify        TokenVerifier.verify with --tokens distinct tokens that were verified before,
+                  the claims come from the cache and no signature is checked
+
+    python benchmarks/token_verify.py --number 2000
+"""
+import argparse
+import sys
+import tempfile
+import time
+import timeit
+from itertools import cycle
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec, rsa  # noqa: E402
+from jose import jwt  # noqa: E402
+
+from src.conf.config import settings  # noqa: E402
+from src.services.tokens import TokenVerifier, load_keys  # noqa: E402
+
+PRIVATE_KEYS = {
+    "RS256": lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    "ES256": lambda: ec.generate_private_key(ec.SECP256R1()),
+}
+
+
+def make_verifier(algorithm: str, keys_dir: str) -> tuple[TokenVerifier, str]:
+    # The verifier signs with a new key of algorithm, the text of the key is what jwt.decode gets
+    if algorithm == "HS256":
+        return TokenVerifier(load_keys(settings.secret_key, "HS256", "", "")), settings.secret_key
+    key = PRIVATE_KEYS[algorithm]()
+    Path(keys_dir, f"{algorithm}.pem").write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    verifier = TokenVerifier(load_keys("", "HS256", keys_dir, algorithm), active_kid=algorithm)
+    Path(keys_dir, f"{algorithm}.pem").unlink()
+    return verifier, public_pem
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=1000, help="verifications per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best one is reported")
+    parser.add_argument("--tokens", type=int, default=1000, help="distinct tokens in the cache")
+    args = parser.parse_args()
+
+    print(f"{'algorithm':<10} {'case':<12} {'us/token':>10} {'tokens/s':>10}")
+    with tempfile.TemporaryDirectory() as keys_dir:
+        for algorithm in ["HS256", "RS256", "ES256"]:
+            verifier, key_text = make_verifier(algorithm, keys_dir)
+            exp = int(time.time()) + 3600
+            tokens = [verifier.sign({"sub": f"user{i}@example.com", "scope": "access_token", "exp": exp})
+                      for i in range(args.tokens)]
+            for token in tokens:
+                verifier.verify(token, "access_token")
+            token, cached = tokens[0], cycle(tokens)
+            cases = {
+                "jose_decode": lambda: jwt.decode(token, key_text, algorithms=[algorithm]),
+                "decode": lambda: verifier.decode(token),
+                "verify": lambda: verifier.verify(next(cached), "access_token"),
+            }
+            for name, case in cases.items():
+                best = min(timeit.repeat(case, number=args.number, repeat=args.repeat)) / args.number
+                print(f"{algorithm:<10} {name:<12} {best * 1e6:>10.1f} {1 / best:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,55 @@
+import asyncio
 import time
+from contextlib import asynccontextmanager
 
-import redis.asyncio as redis
 from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from fastapi_limiter import FastAPILimiter
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.database.db import get_db
-from src.routes import contacts, auth, users
+from src.database.redis_pool import redis_pool
+from src.routes import contacts, auth, users, admin
 from src.conf.config import settings
+from src.services.cloud_image import MediaFiles
+from src.services.email import mail_dispatcher
+from src.services.jobs import MemoryJobQueue, create_worker, job_queue
+from src.services.metrics import request_metrics, request_timings, server_timing
+from src.services.query_inspector import query_inspector
+from src.services.revocation import revocation_list
+from src.services import tasks  # noqa: F401 registers the job handlers
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    The lifespan function opens the shared Redis pool and starts the revocation list sync, the mail dispatcher
+    (and the job worker when jobs are queued in memory) before the first request, and stops them in reverse order
+    on shutdown.
 
-@app.on_event("startup")
-async def startup():
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
-    await FastAPILimiter.init(r)
+    :param app: FastAPI: The application
+    :return: None
+    :doc-author: Trelent
+    """
+    await redis_pool.open()
+    revocation_list.start()
+    mail_dispatcher.start()
+    worker = None
+    if isinstance(job_queue, MemoryJobQueue):
+        # Nobody else can see an in-memory queue, so the jobs run in this process
+        worker = create_worker(job_queue)
+        worker_task = asyncio.create_task(worker.run())
+    yield
+    if worker is not None:
+        worker.stop()
+        await worker_task
+    await mail_dispatcher.stop()
+    await revocation_list.stop()
+    await redis_pool.close()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 
 app.add_middleware(
@@ -27,28 +58,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset",
+                    "Retry-After", "Server-Timing"],
 )
 
 
 @app.middleware("http")
 async def custom_middleware(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    during = time.time() - start_time
-    response.headers['performance'] = str(during)
+    # The database, Redis and bcrypt add their time to timings while the request runs
+    timings = {}
+    token = request_timings.set(timings)
+    query_log = query_inspector.start_request()
+    start_time = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    during = time.perf_counter() - start_time
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    request_metrics.observe(request.method, route_path, response.status_code, during, timings)
+    query_inspector.finish_request(query_log, f"{request.method} {route_path}")
+    response.headers['Server-Timing'] = server_timing(timings, during)
+    # Set by the rate limit dependencies, also for routes that return a Response of their own
+    response.headers.update(getattr(request.state, "rate_limit_headers", {}))
     return response
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root():
     return {"message": "User contacts"}
 
 
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = await db.execute(text("SELECT 1"))
+        result = result.fetchone()
         if result is None:
             raise HTTPException(status_code=500, detail="Database is not configured correctly")
         return {"message": "Welcome to FastAPI!"}
@@ -60,3 +112,7 @@ def healthchecker(db: Session = Depends(get_db)):
 app.include_router(auth.router, prefix='/api')
 app.include_router(contacts.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
+app.include_router(admin.router, prefix='/api')
+
+if settings.avatar_storage == 'local':
+    app.mount(settings.avatar_base_url, MediaFiles(directory=settings.avatar_local_dir, check_dir=False), name='media')
@@ -0,0 +1,35 @@
+"""Contacts search indexes
+
+Revision ID: 0b1fcd2de458
+Revises: 5060ec6fe3cb
+Create Date: 2026-10-18 11:47:09.113562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b1fcd2de458'
+down_revision = '5060ec6fe3cb'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = ('first_name', 'last_name', 'email', 'phone')
+
+
+def upgrade() -> None:
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    if postgresql:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in SEARCH_COLUMNS:
+        if postgresql:
+            op.create_index(f'ix_contacts_{column}_search', 'contacts', [sa.text(f'lower({column}) gin_trgm_ops')],
+                            unique=False, postgresql_using='gin')
+        else:
+            op.create_index(f'ix_contacts_{column}_search', 'contacts', [sa.text(f'lower({column})')], unique=False)
+
+
+def downgrade() -> None:
+    for column in SEARCH_COLUMNS:
+        op.drop_index(f'ix_contacts_{column}_search', table_name='contacts')
@@ -0,0 +1,30 @@
+"""Contacts birthday month-day column
+
+Revision ID: 5060ec6fe3cb
+Revises: 30b8f7db8304
+Create Date: 2026-10-18 11:04:52.781930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5060ec6fe3cb'
+down_revision = '30b8f7db8304'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('birthday_md', sa.SmallInteger(), nullable=True))
+    op.execute(
+        "UPDATE contacts SET birthday_md = EXTRACT(MONTH FROM birthday) * 100 + EXTRACT(DAY FROM birthday) "
+        "WHERE birthday IS NOT NULL"
+    )
+    op.create_index(op.f('ix_contacts_birthday_md'), 'contacts', ['birthday_md'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_contacts_birthday_md'), table_name='contacts')
+    op.drop_column('contacts', 'birthday_md')
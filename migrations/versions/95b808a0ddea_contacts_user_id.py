@@ -0,0 +1,53 @@
+"""Contacts owner column and per-user indexes
+
+Contacts created before ownership existed are given to the first registered user (the lowest users.id),
+the account of the single-user deployments this upgrades. When there are contacts but no users the upgrade
+stops with an error instead of deleting them: create the owner account first, then run it again.
+
+Revision ID: 95b808a0ddea
+Revises: 0b1fcd2de458
+Create Date: 2026-10-18 14:02:31.408117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '95b808a0ddea'
+down_revision = '0b1fcd2de458'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    if (connection.execute(sa.text("SELECT count(*) FROM contacts")).scalar()
+            and not connection.execute(sa.text("SELECT count(*) FROM users")).scalar()):
+        raise RuntimeError("contacts exist but there is no user to own them: create a user, then run the upgrade again")
+    op.add_column('contacts', sa.Column('user_id', sa.Integer(), nullable=True))
+    # Contacts created before ownership existed go to the first registered user, see the module docstring
+    op.execute("UPDATE contacts SET user_id = (SELECT min(id) FROM users) WHERE user_id IS NULL")
+    op.alter_column('contacts', 'user_id', nullable=False)
+    op.create_foreign_key('contacts_user_id_fkey', 'contacts', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+
+    op.drop_constraint('contacts_email_key', 'contacts', type_='unique')
+    op.drop_index('ix_contacts_last_name_id', table_name='contacts')
+    op.drop_index('ix_contacts_birthday_md', table_name='contacts')
+    op.create_index('ix_contacts_user_id_id', 'contacts', ['user_id', 'id'], unique=False)
+    op.create_index('ix_contacts_user_id_email', 'contacts', ['user_id', 'email'], unique=True)
+    op.create_index('ix_contacts_user_id_last_name', 'contacts', ['user_id', 'last_name', 'id'], unique=False)
+    op.create_index('ix_contacts_user_id_birthday_md', 'contacts', ['user_id', 'birthday_md'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_birthday_md', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_last_name', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_email', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_id', table_name='contacts')
+    op.create_index('ix_contacts_birthday_md', 'contacts', ['birthday_md'], unique=False)
+    op.create_index('ix_contacts_last_name_id', 'contacts', ['last_name', 'id'], unique=False)
+    op.create_unique_constraint('contacts_email_key', 'contacts', ['email'])
+
+    op.drop_constraint('contacts_user_id_fkey', 'contacts', type_='foreignkey')
+    op.drop_column('contacts', 'user_id')
@@ -0,0 +1,25 @@
+"""Drop users.refresh_token, refresh tokens are kept in Redis
+
+Revision ID: c41e9d27a8f5
+Revises: 95b808a0ddea
+Create Date: 2026-10-18 16:40:12.731925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e9d27a8f5'
+down_revision = '95b808a0ddea'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_column('users', 'refresh_token')
+
+
+def downgrade() -> None:
+    # Stored tokens are not brought back, users log in again
+    op.add_column('users', sa.Column('refresh_token', sa.String(length=255), nullable=True))
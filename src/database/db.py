@@ -1,26 +1,119 @@
-import configparser
-import pathlib
-
 from fastapi import HTTPException, status
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 
 from src.conf.config import settings
+from src.services.metrics import instrument_engine
+from src.services.query_inspector import query_inspector
 
 
 URI = settings.sqlalchemy_database_url
 
-engine = create_engine(URI, echo=True)
-DBSession = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+def engine_options(uri: str) -> dict:
+    """
+    The engine_options function builds the keyword arguments for create_async_engine from the settings.
+    Pool sizing options are only passed to drivers that use a queue pool (SQLite uses NullPool).
+
+    :param uri: str: The database url the engine is created for
+    :return: A dictionary of engine keyword arguments
+    :doc-author: Trelent
+    """
+    options = {
+        "echo": settings.sqlalchemy_echo,
+        "pool_pre_ping": settings.sqlalchemy_pool_pre_ping,
+        "pool_recycle": settings.sqlalchemy_pool_recycle,
+    }
+    if make_url(uri).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=settings.sqlalchemy_pool_size,
+            max_overflow=settings.sqlalchemy_max_overflow,
+            pool_timeout=settings.sqlalchemy_pool_timeout,
+        )
+    return options
+
+
+def unicode_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def register_sqlite_functions(engine: Engine) -> None:
+    """
+    The register_sqlite_functions function adds unicode_lower to the SQLite connections of engine.
+    The built-in lower() of SQLite only folds ASCII letters, unicode_lower folds like str.lower,
+    so that searches for Cyrillic names are case-insensitive too.
+
+    :param engine: Engine: A sync engine, engine.sync_engine for an async one
+    :return: None
+    :doc-author: Trelent
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _register(dbapi_connection, connection_record):
+        dbapi_connection.create_function("unicode_lower", 1, unicode_lower, deterministic=True)
+
+
+engine = create_async_engine(URI, **engine_options(URI))
+DBSession = async_sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
+
+pool_counters = {"connects": 0, "checkouts": 0, "timeouts": 0}
+instrument_engine(engine.sync_engine)
+register_sqlite_functions(engine.sync_engine)
+if settings.query_inspector:
+    query_inspector.inspect_engine(engine.sync_engine)
+
+
+@event.listens_for(engine.sync_engine.pool, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_counters["connects"] += 1
+
+
+@event.listens_for(engine.sync_engine.pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_counters["checkouts"] += 1
+
+
+def pool_status() -> dict:
+    """
+    The pool_status function returns live statistics of the engine connection pool.
+    timeouts counts checkouts that waited pool_timeout seconds for a free connection and gave up.
+
+    :return: A dictionary with the pool configuration, current usage and counters
+    :doc-author: Trelent
+    """
+    pool = engine.sync_engine.pool
+    stats = {"pool": type(pool).__name__, **pool_counters}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            size=pool.size(),
+            max_overflow=settings.sqlalchemy_max_overflow,
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    return stats
+
+
+async def get_db():
+    """
+    The get_db function is a dependency that yields an AsyncSession bound to the async engine.
+    The session is rolled back on SQLAlchemy errors and always closed when the request is finished.
 
-def get_db():
-    db = DBSession()
+    :return: An async database session
+    :doc-author: Trelent
+    """
+    db: AsyncSession = DBSession()
     try:
         yield db
+    except PoolTimeoutError:
+        pool_counters["timeouts"] += 1
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database is busy")
     except SQLAlchemyError as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
     finally:
-        db.close()
+        await db.close()
@@ -1,19 +1,58 @@
-from sqlalchemy import Column, Integer, String, DateTime, func, Boolean
-from sqlalchemy.orm import declarative_base
+from datetime import date
+
+from sqlalchemy import Column, Integer, SmallInteger, String, DateTime, func, Boolean, Index, ForeignKey
+from sqlalchemy.orm import declarative_base, relationship, validates
 
 Base = declarative_base()
 
 
+def birthday_key(birthday: date | None) -> int | None:
+    """
+    The birthday_key function maps a birthday to its month-day number (month * 100 + day),
+    e.g. 14 February becomes 214, so birthdays of any year can be compared and indexed.
+
+    :param birthday: date | None: The birthday or None
+    :return: The month-day number or None
+    :doc-author: Trelent
+    """
+    return birthday.month * 100 + birthday.day if birthday else None
+
+
 class Contact(Base):
     __tablename__ = "contacts"
     id = Column(Integer, primary_key=True, index=True)
     first_name = Column(String)
     last_name = Column(String)
-    email = Column(String, unique=True)
+    email = Column(String)
     phone = Column(String)
     birthday = Column(DateTime)
+    birthday_md = Column(SmallInteger)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    user = relationship('User', backref='contacts')
+
+    __table_args__ = (
+        # Every query is scoped to one owner, so user_id leads all the indexes used by the contacts routes.
+        Index('ix_contacts_user_id_id', 'user_id', 'id'),
+        Index('ix_contacts_user_id_email', 'user_id', 'email', unique=True),
+        Index('ix_contacts_user_id_last_name', 'user_id', 'last_name', 'id'),
+        Index('ix_contacts_user_id_birthday_md', 'user_id', 'birthday_md'),
+        # Search indexes: trigram GIN on PostgreSQL, plain expression indexes on SQLite.
+        Index('ix_contacts_first_name_search', func.lower(first_name).label('first_name_lower'),
+              postgresql_using='gin', postgresql_ops={'first_name_lower': 'gin_trgm_ops'}),
+        Index('ix_contacts_last_name_search', func.lower(last_name).label('last_name_lower'),
+              postgresql_using='gin', postgresql_ops={'last_name_lower': 'gin_trgm_ops'}),
+        Index('ix_contacts_email_search', func.lower(email).label('email_lower'),
+              postgresql_using='gin', postgresql_ops={'email_lower': 'gin_trgm_ops'}),
+        Index('ix_contacts_phone_search', func.lower(phone).label('phone_lower'),
+              postgresql_using='gin', postgresql_ops={'phone_lower': 'gin_trgm_ops'}),
+    )
+
+    @validates('birthday')
+    def _set_birthday_md(self, key, birthday):
+        self.birthday_md = birthday_key(birthday)
+        return birthday
 
 
 class User(Base):
@@ -22,6 +61,5 @@ class User(Base):
     username = Column(String(50))
     email = Column(String(150), nullable=False, unique=True)
     password = Column(String(255), nullable=False)
-    refresh_token = Column(String(255), nullable=True)
     avatar = Column(String(255), nullable=True)
     confirmed = Column(Boolean, default=False)
@@ -0,0 +1,122 @@
+import logging
+import time
+from typing import Protocol
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.metrics import record
+
+logger = logging.getLogger(__name__)
+
+
+class UsesRedis(Protocol):
+    def set_redis(self, client: redis.Redis | None) -> None:
+        ...
+
+
+class TimedConnection(redis.Connection):
+    """
+    Connection that records the time spent waiting for every reply in the timings of the request.
+    Sending is not timed, the wait covers the round-trip and the work of the server.
+    """
+
+    async def read_response(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().read_response(*args, **kwargs)
+        finally:
+            record("redis", time.perf_counter() - started)
+
+
+class RedisPool:
+    """
+    The Redis connection pool of the process, shared by every component that talks to Redis.
+
+    Components are attached at import time and receive the client when the pool is opened
+    by the application lifespan (or worker.py), and None again when it is closed.
+    Connections idle for more than redis_health_check_interval seconds are checked with PING before use.
+    """
+
+    def __init__(self):
+        self.pool: redis.ConnectionPool | None = None
+        self.client: redis.Redis | None = None
+        self.components: list[UsesRedis] = []
+
+    def attach(self, component: UsesRedis) -> None:
+        self.components.append(component)
+        if self.client is not None:
+            component.set_redis(self.client)
+
+    async def open(self) -> redis.Redis:
+        """
+        The open function creates the connection pool from the settings, checks that Redis answers
+        and hands the client to the attached components.
+            An unreachable Redis is logged and not raised: the caches and the rate limiter work without it
+            and the pool connects as soon as Redis is back.
+
+        :param self: Represent the instance of the class
+        :return: The shared client
+        :doc-author: Trelent
+        """
+        self.pool = redis.ConnectionPool(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=0,
+            connection_class=TimedConnection,
+            max_connections=settings.redis_max_connections,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_connect_timeout,
+            health_check_interval=settings.redis_health_check_interval,
+        )
+        self.client = redis.Redis(connection_pool=self.pool)
+        if not await self.ping():
+            logger.warning("Redis at %s:%s is not available", settings.redis_host, settings.redis_port)
+        for component in self.components:
+            component.set_redis(self.client)
+        return self.client
+
+    async def ping(self) -> bool:
+        if self.client is None:
+            return False
+        try:
+            return bool(await self.client.ping())
+        except (RedisError, OSError):
+            return False
+
+    async def close(self) -> None:
+        """
+        The close function detaches the components and closes every connection of the pool.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        for component in self.components:
+            component.set_redis(None)
+        if self.client is not None:
+            await self.client.close()
+            await self.pool.disconnect()
+        self.client = self.pool = None
+
+    def status(self) -> dict:
+        """
+        The status function returns the configuration and the current usage of the pool.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the pool statistics
+        :doc-author: Trelent
+        """
+        if self.pool is None:
+            return {"open": False}
+        return {
+            "open": True,
+            "max_connections": self.pool.max_connections,
+            "created": self.pool._created_connections,
+            "in_use": len(self.pool._in_use_connections),
+            "idle": len(self.pool._available_connections),
+        }
+
+
+redis_pool = RedisPool()
@@ -1,158 +1,455 @@
 from datetime import date, timedelta
+from typing import AsyncIterator, Sequence
 
-from sqlalchemy import and_, extract
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, delete, insert, or_, select, tuple_, func, update as sa_update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Contact
+from src.database.models import Contact, User, birthday_key
 from src.schemas import ContactModel
+from src.services.cache import contact_cache
 
+SORT_COLUMNS = {
+    "id": (Contact.id,),
+    "last_name": (Contact.last_name, Contact.id),
+}
 
-async def get_contacts(limit: int, offset: int, db: Session):
+EXPORT_COLUMNS = (Contact.id, Contact.first_name, Contact.last_name, Contact.email, Contact.phone, Contact.birthday,
+                  Contact.created_at, Contact.updated_at)
+
+# Dialects whose insert() has on_conflict_do_nothing / on_conflict_do_update with the same arguments
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+# The conflict target is the unique ix_contacts_user_id_email index
+UPSERT_CONFLICT = (Contact.user_id, Contact.email)
+UPSERT_COLUMNS = ("first_name", "last_name", "phone", "birthday", "birthday_md")
+# Create / update rounds of the upsert fallback before it reports a conflict
+UPSERT_ATTEMPTS = 3
+
+SEARCH_COLUMNS = {
+    "first_name": Contact.first_name,
+    "last_name": Contact.last_name,
+    "email": Contact.email,
+    "phone": Contact.phone,
+}
+
+
+def contact_values(body: ContactModel, user: User) -> dict:
+    # Bulk and RETURNING statements bypass the ORM validators, so birthday_md is filled in here
+    return dict(body.model_dump(), birthday_md=birthday_key(body.birthday), user_id=user.id)
+
+
+def upsert_insert(db: AsyncSession):
+    # SQLite has RETURNING since 3.35; older versions and other databases use the fallbacks
+    dialect = db.get_bind().dialect
+    return UPSERT_INSERTS.get(dialect.name) if dialect.insert_returning else None
+
+
+async def get_contacts(limit: int, offset: int, user: User, db: AsyncSession):
     """
     The get_contacts function returns a list of contacts from the database.
 
     :param limit: int: Limit the number of contacts returned
     :param offset: int: Specify how many contacts to skip before returning the result
-    :param db: Session: Pass in the database session to the function
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass in the database session to the function
     :return: A list of contacts in the database
     :doc-author: Trelent
     """
-    contacts = db.query(Contact).limit(limit).offset(offset).all()
-    return contacts
+    stmt = select(Contact).filter_by(user_id=user.id).order_by(Contact.id).limit(limit).offset(offset)
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
+
+
+async def get_contacts_after(limit: int, sort_by: str, after: list | None, user: User, db: AsyncSession):
+    """
+    The get_contacts_after function returns a page of contacts using keyset pagination.
+    Rows are ordered by the columns of SORT_COLUMNS[sort_by] and the page starts right after the row
+    whose sort values are given in after, so every page costs one index range scan whatever its depth.
+
+    :param limit: int: Limit the number of contacts returned
+    :param sort_by: str: Key of SORT_COLUMNS to order the contacts by
+    :param after: list | None: Sort values of the last contact of the previous page, None for the first page
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass in the database session to the function
+    :return: A list of contacts
+    :doc-author: Trelent
+    """
+    columns = SORT_COLUMNS[sort_by]
+    stmt = select(Contact).filter_by(user_id=user.id).order_by(*columns).limit(limit)
+    if after is not None:
+        stmt = stmt.where(tuple_(*columns) > tuple_(*after))
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
 
 
-async def get_contact_by_id(contact_id: int, db: Session):
+async def stream_contacts(batch_size: int, user: User, db: AsyncSession) -> AsyncIterator[Sequence[Row]]:
+    """
+    The stream_contacts function reads all contacts of the user ordered by id through a server-side cursor,
+    batch_size rows at a time, so only one batch is held in memory.
+
+    :param batch_size: int: Number of rows fetched per round-trip
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass in the database session to the function
+    :return: An async iterator of row batches with the EXPORT_COLUMNS
+    :doc-author: Trelent
+    """
+    stmt = (select(*EXPORT_COLUMNS).filter_by(user_id=user.id).order_by(Contact.id)
+            .execution_options(yield_per=batch_size))
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def get_contact_by_id(contact_id: int, user: User, db: AsyncSession):
     """
     The get_contact_by_id function returns a contact object from the database based on its id.
         Args:
             contact_id (int): The id of the desired contact.
-            db (Session): A connection to the database.
+            db (AsyncSession): A connection to the database.
 
     :param contact_id: int: Specify the id of the contact we want to retrieve
-    :param db: Session: Pass the database session to the function
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass the database session to the function
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter_by(id=contact_id).first()
-    return contact
+    stmt = select(Contact).filter_by(id=contact_id, user_id=user.id)
+    contact = await db.execute(stmt)
+    return contact.scalar_one_or_none()
 
 
-async def get_contact_by_email(email: str, db: Session):
+async def get_contact_by_email(email: str, user: User, db: AsyncSession):
     """
     The get_contact_by_email function returns a contact object from the database based on the email address provided.
         Args:
             email (str): The email address of the contact to be retrieved.
-            db (Session): A connection to our database, which is used for querying and updating data.
+            db (AsyncSession): A connection to our database, which is used for querying and updating data.
 
     :param email: str: Filter the database for a specific email address
-    :param db: Session: Pass the database session to the function
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass the database session to the function
     :return: The first contact in the database whose email matches the given email
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter_by(email=email).first()
+    stmt = select(Contact).filter_by(email=email, user_id=user.id)
+    contact = await db.execute(stmt)
+    return contact.scalar_one_or_none()
+
+
+async def create(body: ContactModel, user: User, db: AsyncSession):
+    """
+    The create function creates a new contact in the database with a single
+    INSERT ... ON CONFLICT DO NOTHING RETURNING statement.
+        The unique index on the owner and the email decides whether the email is taken,
+        so two concurrent requests cannot both create it.
+
+    :param body: ContactModel: Get the data from the request body
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The contact object, None if the user already has a contact with this email
+    :doc-author: Trelent
+    """
+    insert_ = upsert_insert(db)
+    if insert_ is not None:
+        stmt = (insert_(Contact).values(**contact_values(body, user))
+                .on_conflict_do_nothing(index_elements=UPSERT_CONFLICT).returning(Contact))
+        result = await db.execute(stmt)
+        contact = result.scalar_one_or_none()
+        await db.commit()
+    else:
+        contact = Contact(**body.model_dump(), user_id=user.id)
+        db.add(contact)
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            return None
+        await db.refresh(contact)
+    if contact is not None:
+        await contact_cache.invalidate(user.id)
     return contact
 
 
-async def create(body: ContactModel, db: Session):
+async def upsert(body: ContactModel, user: User, db: AsyncSession):
     """
-    The create function creates a new contact in the database.
-        It takes a ContactModel object as input and returns the newly created contact.
+    The upsert function creates the contact or, when the user already has a contact with this email,
+    updates it, with a single INSERT ... ON CONFLICT DO UPDATE RETURNING statement.
 
     :param body: ContactModel: Get the data from the request body
-    :param db: Session: Access the database
-    :return: The contact object
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The created or updated contact object, None if it kept being removed and recreated concurrently
     :doc-author: Trelent
     """
-    contact = Contact(**body.dict())
-    db.add(contact)
-    db.commit()
-    db.refresh(contact)
+    insert_ = upsert_insert(db)
+    if insert_ is None:
+        # The contact can be removed between the statements, then the insert is tried again
+        for _ in range(UPSERT_ATTEMPTS):
+            contact = await create(body, user, db)
+            if contact is not None:
+                return contact
+            existing = await get_contact_by_email(body.email, user, db)
+            if existing is not None:
+                contact = await update(existing.id, body, user, db)
+                if contact is not None:
+                    return contact
+        return None
+    stmt = insert_(Contact).values(**contact_values(body, user))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=UPSERT_CONFLICT,
+        set_={**{name: stmt.excluded[name] for name in UPSERT_COLUMNS}, "updated_at": func.now()},
+    ).returning(Contact)
+    result = await db.execute(stmt)
+    contact = result.scalar_one()
+    await db.commit()
+    await contact_cache.invalidate(user.id, [contact.id])
     return contact
 
 
-async def update(contact_id: int, body: ContactModel, db: Session):
+async def get_existing_emails(emails: list[str], user: User, db: AsyncSession) -> set[str]:
+    """
+    The get_existing_emails function checks a whole batch of emails with one query.
+
+    :param emails: list[str]: The emails to look up
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The emails that already belong to a contact of the user
+    :doc-author: Trelent
     """
-    The update function updates a contact in the database.
+    stmt = select(Contact.email).where(Contact.user_id == user.id, Contact.email.in_(emails))
+    result = await db.execute(stmt)
+    return set(result.scalars().all())
+
+
+async def create_many(bodies: list[ContactModel], user: User, db: AsyncSession) -> int:
+    """
+    The create_many function inserts a batch of contacts with a multi-row INSERT and commits them.
+        Unlike create, the rows are not loaded back into the session.
+
+    :param bodies: list[ContactModel]: The validated contacts
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The number of inserted contacts
+    :doc-author: Trelent
+    """
+    rows = [contact_values(body, user) for body in bodies]
+    await db.execute(insert(Contact), rows)
+    await db.commit()
+    await contact_cache.invalidate(user.id)
+    return len(rows)
+
+
+async def update(contact_id: int, body: ContactModel, user: User, db: AsyncSession):
+    """
+    The update function updates a contact in the database with a single UPDATE ... RETURNING statement,
+    without loading the contact first.
         Args:
             contact_id (int): The id of the contact to update.
             body (ContactModel): The updated information for the specified contact.
 
     :param contact_id: int: Get the contact by id
     :param body: ContactModel: Get the data from the request body
-    :param db: Session: Get the database session
-    :return: The updated contact object
-    :doc-author: Trelent
-    """
-    contact = await get_contact_by_id(contact_id, db)
-    if contact:
-        contact.first_name = body.first_name
-        contact.last_name = body.last_name
-        contact.email = body.email
-        contact.phone = body.phone
-        contact.birthday = body.birthday
-        db.commit()
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Get the database session
+    :return: The updated contact object, None if there is no such contact
+    :doc-author: Trelent
+    """
+    if db.get_bind().dialect.update_returning:
+        stmt = (sa_update(Contact).where(Contact.id == contact_id, Contact.user_id == user.id)
+                .values(**contact_values(body, user)).returning(Contact))
+        result = await db.execute(stmt)
+        contact = result.scalar_one_or_none()
+        await db.commit()
+    else:
+        contact = await get_contact_by_id(contact_id, user, db)
+        if contact is None:
+            return None
+        for name, value in body.model_dump().items():
+            setattr(contact, name, value)
+        await db.commit()
+        await db.refresh(contact)
+    if contact is not None:
+        await contact_cache.invalidate(user.id, [contact_id])
     return contact
 
 
-async def remove(contact_id: int, db: Session):
+async def remove(contact_id: int, user: User, db: AsyncSession):
     """
-    The remove function removes a contact from the database.
+    The remove function removes a contact from the database with a single DELETE ... RETURNING statement.
         Args:
             contact_id (int): The id of the contact to be removed.
-            db (Session): A connection to the database.
+            db (AsyncSession): A connection to the database.
 
     :param contact_id: int: Specify the id of the contact to be deleted
-    :param db: Session: Pass the database session object to the function
-    :return: The contact that was removed
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass the database session object to the function
+    :return: The contact that was removed, None if there is no such contact
     :doc-author: Trelent
     """
-    contact = await get_contact_by_id(contact_id, db)
-    if contact:
-        db.delete(contact)
-        db.commit()
+    stmt = delete(Contact).where(Contact.id == contact_id, Contact.user_id == user.id).returning(Contact)
+    result = await db.execute(stmt)
+    contact = result.scalar_one_or_none()
+    await db.commit()
+    if contact is not None:
+        await contact_cache.invalidate(user.id, [contact_id])
     return contact
 
 
-async def find_contact_by_firstname(contact_firstname: str, db: Session):
+async def get_existing_ids(contact_ids: list[int], user: User, db: AsyncSession) -> set[int]:
+    """
+    The get_existing_ids function checks a whole batch of contact ids with one query.
+
+    :param contact_ids: list[int]: The ids to look up
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The ids that belong to a contact of the user
+    :doc-author: Trelent
+    """
+    result = await db.execute(select(Contact.id).where(Contact.user_id == user.id, Contact.id.in_(contact_ids)))
+    return set(result.scalars().all())
+
+
+async def get_email_owners(emails: list[str], user: User, db: AsyncSession) -> dict[str, int]:
+    """
+    The get_email_owners function finds the contacts that use any of the emails with one query.
+
+    :param emails: list[str]: The emails to look up
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: A dictionary of email to contact id
+    :doc-author: Trelent
+    """
+    stmt = select(Contact.email, Contact.id).where(Contact.user_id == user.id, Contact.email.in_(emails))
+    result = await db.execute(stmt)
+    return dict(result.tuples().all())
+
+
+async def apply_batch(creates: list[ContactModel], updates: dict[int, ContactModel], deletes: list[int],
+                      user: User, db: AsyncSession) -> list[int]:
+    """
+    The apply_batch function runs one DELETE, one bulk UPDATE by primary key and one multi-row INSERT
+    in a single transaction. The operations must already be checked, see get_existing_ids and get_email_owners.
+
+    :param creates: list[ContactModel]: Contacts to insert
+    :param updates: dict[int, ContactModel]: New data by contact id
+    :param deletes: list[int]: Ids of the contacts to delete
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The ids of the created contacts, in the order of creates
+    :doc-author: Trelent
+    """
+    # Deletes go first, so their emails can be reused by the updates and creates of the same batch
+    if deletes:
+        await db.execute(delete(Contact).where(Contact.user_id == user.id, Contact.id.in_(deletes)))
+    if updates:
+        await db.execute(sa_update(Contact), [dict(contact_values(body, user), id=contact_id)
+                                              for contact_id, body in updates.items()])
+    created = []
+    if creates:
+        stmt = insert(Contact).returning(Contact.id, sort_by_parameter_order=True)
+        result = await db.execute(stmt, [contact_values(body, user) for body in creates])
+        created = list(result.scalars().all())
+    await db.commit()
+    await contact_cache.invalidate(user.id, [*updates, *deletes])
+    return created
+
+
+async def find_contact_by_firstname(contact_firstname: str, user: User, db: AsyncSession):
     """
     The find_contact_by_firstname function takes in a contact_firstname and db as parameters.
     It then queries the database for all contacts with that first name, and returns them.
 
     :param contact_firstname: str: Specify the first name of a contact
-    :param db: Session: Pass the database session to the function
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of contacts
     :doc-author: Trelent
     """
-    contacts = db.query(Contact).filter_by(first_name=contact_firstname).all()
-    return contacts
+    stmt = select(Contact).filter_by(first_name=contact_firstname, user_id=user.id)
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
 
 
-async def find_contact_by_lastname(contact_lastname: str, db: Session):
+async def find_contact_by_lastname(contact_lastname: str, user: User, db: AsyncSession):
     """
     The find_contact_by_lastname function takes in a contact_lastname and db as parameters.
     It then queries the database for all contacts with that last name, and returns them.
 
     :param contact_lastname: str: Filter the database by last name
-    :param db: Session: Pass the database session to the function
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of contact objects
     :doc-author: Trelent
     """
-    contacts = db.query(Contact).filter_by(last_name=contact_lastname).all()
-    return contacts
+    stmt = select(Contact).filter_by(last_name=contact_lastname, user_id=user.id)
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
+
 
+async def search_contacts(query: str, fields: list[str], fuzzy: bool, limit: int, user: User, db: AsyncSession):
+    """
+    The search_contacts function finds contacts whose fields start with the query, case-insensitively.
+        With fuzzy set, contacts similar to the query are found as well: on PostgreSQL by pg_trgm similarity
+        (ordered from the most similar), on other databases by substring match.
+        Every condition is written against lower(column), so it is served by the ix_contacts_*_search indexes.
 
-async def get_birthday(db: Session):
+    :param query: str: Text to search for
+    :param fields: list[str]: Keys of SEARCH_COLUMNS to search in
+    :param fuzzy: bool: Also match contacts that are similar to the query
+    :param limit: int: Limit the number of contacts returned
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list of contacts
+    :doc-author: Trelent
     """
-    The get_birthday function returns a list of contacts whose birthday is within the next week.
+    query = query.lower()
+    columns = [func.lower(SEARCH_COLUMNS[field]) for field in fields]
+    stmt = select(Contact).filter_by(user_id=user.id).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        conditions = [column.startswith(query, autoescape=True) for column in columns]
+        if fuzzy:
+            conditions += [column.op("%")(query) for column in columns]
+            similarity = [func.similarity(column, query) for column in columns]
+            stmt = stmt.order_by((func.greatest(*similarity) if len(similarity) > 1 else similarity[0]).desc())
+    elif db.get_bind().dialect.name == "sqlite" and not query.isascii():
+        # lower() and LIKE of SQLite only fold ASCII, unicode_lower folds like query.lower() above.
+        # The expression indexes do not apply, the contacts of the owner are scanned.
+        columns = [func.unicode_lower(SEARCH_COLUMNS[field]) for field in fields]
+        conditions = [column.contains(query, autoescape=True) if fuzzy else column.startswith(query, autoescape=True)
+                      for column in columns]
+    elif fuzzy:
+        conditions = [column.contains(query, autoescape=True) for column in columns]
+    else:
+        # A range on lower(column) instead of LIKE lets SQLite use the expression index.
+        upper = query[:-1] + chr(ord(query[-1]) + 1)
+        conditions = [(column >= query) & (column < upper) for column in columns]
+    stmt = stmt.where(or_(*conditions)).order_by(Contact.last_name, Contact.id)
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
 
 
-    :param db: Session: Pass the database session into the function
-    :return: A list of contacts with a birthday in the next 7 days
+async def get_birthday(days: int, user: User, db: AsyncSession):
+    """
+    The get_birthday function returns a list of contacts whose birthday is within the next days days,
+    ordered by the upcoming birthday. It filters on the indexed birthday_md column, so windows that
+    cross the end of a month or of a year are handled as two ranges of month-day numbers.
+
+    :param days: int: Size of the window in days after today
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Pass the database session into the function
+    :return: A list of contacts with a birthday in the next days days
     :doc-author: Trelent
     """
     today = date.today()
-    next_week = today + timedelta(days=7)
-    contacts = db.query(Contact).filter(and_(extract('day', Contact.birthday) >= today.day,
-                                             extract('day', Contact.birthday) <= next_week.day,
-                                             extract('month', Contact.birthday) == today.month)).all()
-    return contacts
+    start = birthday_key(today)
+    stmt = select(Contact).where(Contact.user_id == user.id, Contact.birthday_md.is_not(None))
+    if days < 365:
+        end = birthday_key(today + timedelta(days=days))
+        if start <= end:
+            stmt = stmt.where(Contact.birthday_md.between(start, end))
+        else:
+            stmt = stmt.where(or_(Contact.birthday_md >= start, Contact.birthday_md <= end))
+    stmt = stmt.order_by(Contact.birthday_md < start, Contact.birthday_md)
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
@@ -0,0 +1,121 @@
+from fastapi import APIRouter, Depends
+
+from src.database.db import pool_status
+from src.database.models import User
+from src.database.redis_pool import redis_pool
+from src.services.auth import auth_service
+from src.services.cache import contact_cache, user_cache
+from src.services.jobs import job_queue
+from src.services.password import password_hasher
+from src.services.rate_limit import rate_limiter
+from src.services.revocation import revocation_list
+from src.services.tokens import token_verifier
+
+# Every endpoint depends on get_current_admin, only users listed in admin_emails get an answer
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/pool")
+async def get_pool_status(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_pool_status function returns live statistics of the database connection pool:
+    pool size, checked out and idle connections, overflow in use and checkout counters.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the pool statistics
+    :doc-author: Trelent
+    """
+    return pool_status()
+
+
+@router.get("/redis")
+async def get_redis_status(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_redis_status function checks that Redis answers and returns the usage of the shared Redis pool:
+    its size and the connections created, in use and idle.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the pool statistics
+    :doc-author: Trelent
+    """
+    return dict(redis_pool.status(), available=await redis_pool.ping())
+
+
+@router.get("/password_hasher")
+async def get_password_hasher_stats(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_password_hasher_stats function returns the queue metrics of the bcrypt worker pool.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the worker pool statistics
+    :doc-author: Trelent
+    """
+    return password_hasher.stats()
+
+
+@router.get("/jobs")
+async def get_job_queue_metrics(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_job_queue_metrics function returns the depth of the job queue (pending, delayed,
+    processing and dead-lettered jobs) and the enqueued, done, retried and dead counters.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the job queue metrics
+    :doc-author: Trelent
+    """
+    return await job_queue.metrics()
+
+
+@router.get("/cache")
+async def get_cache_stats(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_cache_stats function returns the hit and miss counters of the user cache
+    and of the contact response cache.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the statistics of both caches
+    :doc-author: Trelent
+    """
+    return {
+        "users": {"hits": user_cache.local.hits, "misses": user_cache.local.misses, "size": len(user_cache.local)},
+        "contacts": contact_cache.metrics(),
+    }
+
+
+@router.get("/rate_limit")
+async def get_rate_limit_stats(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_rate_limit_stats function returns the allowed and limited request counters of the rate limiter,
+    how often it fell back to the local buckets and whether Redis is currently used.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the rate limiter statistics
+    :doc-author: Trelent
+    """
+    return rate_limiter.metrics()
+
+
+@router.get("/tokens")
+async def get_token_stats(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_token_stats function returns the hit and miss counters of the verified token cache,
+    the accepted key ids and the key id new tokens are signed with.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the token verifier statistics
+    :doc-author: Trelent
+    """
+    return token_verifier.metrics()
+
+
+@router.get("/revocations")
+async def get_revocation_stats(current_user: User = Depends(auth_service.get_current_admin)):
+    """
+    The get_revocation_stats function returns the counters of the revocation list: checks, Bloom filter hits,
+    exact checks in Redis and revoked tokens, and the size of the filter.
+
+    :param current_user: User: Check if the user is an administrator
+    :return: A dictionary with the revocation list statistics
+    :doc-author: Trelent
+    """
+    return revocation_list.metrics()
@@ -1,64 +1,120 @@
+import logging
 from typing import List
 
-from fastapi import Depends, HTTPException, status, APIRouter, Security, BackgroundTasks, Request
+from fastapi import Depends, HTTPException, status, APIRouter, Security, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 from src.database.db import get_db
+from src.database.models import User
 from src.repository import users as repository_users
 from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
 from src.services.auth import auth_service
-from src.services.email import send_email
+from src.services.jobs import job_queue
+from src.services.rate_limit import RateLimit
+from src.services.refresh_tokens import refresh_token_store
+from src.services.revocation import revocation_list, revoke_sessions
 
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=['auth'])
+limit_by_address = [Depends(RateLimit('auth'))]
 security = HTTPBearer()
 
 
-@router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def revoke_session(sid: str) -> None:
+    """
+    The revoke_session function rejects the access tokens of the session from now on.
+    When Redis fails, this worker rejects them already but the others would not:
+    the client gets 503 Service Unavailable and has to try again.
+
+    :param sid: str: The session id
+    :return: None
+    :doc-author: Trelent
+    """
+    try:
+        await revocation_list.revoke([f"sid:{sid}"])
+    except (RedisError, OSError) as err:
+        logger.warning("Revocation of session %s failed: %s", sid, err)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Session could not be revoked, try again later")
+
+
+@router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED, dependencies=limit_by_address)
+async def signup(body: UserModel, request: Request, db: AsyncSession = Depends(get_db)):
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.hasher.hash(body.password)
     new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
+    try:
+        await job_queue.enqueue("send_email", email=new_user.email, username=new_user.username,
+                                host=str(request.base_url))
+    except Exception as err:
+        # The account is already committed, the user can ask for the email again with /request_email
+        logger.error("Queueing the confirmation email of %s failed: %r", new_user.email, err)
     return new_user
 
 
-@router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/login", response_model=TokenModel, dependencies=limit_by_address)
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     user = await repository_users.get_user_by_email(body.username, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email is not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    valid, new_hash = await auth_service.hasher.verify_and_update(body.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
-    # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    if new_hash is not None:
+        # The hash was made with an outdated bcrypt cost, store it with the current one
+        await repository_users.update_password(user, new_hash, db)
+    # Generate JWT, every login is a new session of the user
+    sid, jti = await refresh_token_store.create(user.email)
+    access_token = await auth_service.create_access_token(data={"sub": user.email, "sid": sid})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email, "sid": sid, "jti": jti})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
-@router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+@router.get('/refresh_token', response_model=TokenModel, dependencies=limit_by_address)
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security)):
+    email, sid, jti = await auth_service.decode_refresh_token(credentials.credentials)
+    # A refresh token can be used once; using it again revokes its session
+    next_jti = await refresh_token_store.rotate(email, sid, jti)
+    if next_jti is None:
+        # A replayed token means the session may be stolen: its access tokens stop working as with logout.
+        # For a session that is already revoked or expired this changes nothing
+        await revoke_session(sid)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    access_token = await auth_service.create_access_token(data={"sub": email, "sid": sid})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": email, "sid": sid, "jti": next_jti})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
+@router.post('/logout')
+async def logout(credentials: HTTPAuthorizationCredentials = Security(security)):
+    email, sid, _ = await auth_service.decode_refresh_token(credentials.credentials)
+    await refresh_token_store.revoke(email, sid)
+    # The access tokens of the session stop working too, not only after they expire
+    await revoke_session(sid)
+    return {"message": "Logged out"}
+
+
+@router.post('/logout_all')
+async def logout_all(current_user: User = Depends(auth_service.get_current_user)):
+    try:
+        revoked = await revoke_sessions(current_user.email)
+    except (RedisError, OSError) as err:
+        logger.warning("Revocation of the sessions of %s failed: %s", current_user.email, err)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Sessions could not be revoked, try again later")
+    return {"message": "All sessions are revoked", "sessions": revoked}
+
+
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     email = auth_service.get_email_from_token(token)
     user = await repository_users.get_user_by_email(email, db)
     if user is None:
@@ -69,12 +125,12 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     return {"message": "Email confirmed"}
 
 
-@router.post('/request_email')
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+@router.post('/request_email', dependencies=limit_by_address)
+async def request_email(body: RequestEmail, request: Request,
+                        db: AsyncSession = Depends(get_db)):
     user = await repository_users.get_user_by_email(body.email, db)
     if user:
         if user.confirmed:
             return {"message": "Your email is already confirmed"}
-        background_tasks.add_task(send_email, user.email, user.username, request.base_url)
+        await job_queue.enqueue("send_email", email=user.email, username=user.username, host=str(request.base_url))
     return {"message": "Check your email for confirmation."}
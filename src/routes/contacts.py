@@ -1,57 +1,176 @@
-from typing import List
+from datetime import date, datetime, time, timedelta
+from typing import List, Literal
 
-from fastapi import Depends, Query, Path, HTTPException, status, APIRouter
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from fastapi import Depends, Query, Path, HTTPException, status, APIRouter, Request, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import User
 from src.repository import contacts as repository_contacts
-from src.schemas import ContactResponse, ContactModel
+from src.schemas import ContactResponse, ContactModel, ContactImportResponse, ContactBatchModel, \
+    ContactBatchResponse
+from src.conf.config import settings
 from src.services.auth import auth_service
+from src.services.cache import CachedResponse, contact_cache
+from src.services.pagination import encode_cursor, decode_cursor
+from src.services.rate_limit import UserRateLimit
+from src.services.serialization import orm_response
+from src.services import contacts_batch, contacts_io
 
 router = APIRouter(prefix="/contacts", tags=['contacts'])
+limit_writes = [Depends(UserRateLimit('contacts_write'))]
 
 
-@router.get("/", response_model=List[ContactResponse], dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def get_contacts(limit: int = Query(10, le=500), offset: int = 0, db: Session = Depends(get_db),
+@router.get("/", response_model=List[ContactResponse], dependencies=[Depends(UserRateLimit('contacts_list'))])
+async def get_contacts(request: Request, limit: int = Query(10, ge=1, le=500), offset: int = 0,
+                       paginate: Literal['offset', 'cursor'] = 'offset', cursor: str | None = None,
+                       sort_by: Literal['id', 'last_name'] = 'id', db: AsyncSession = Depends(get_db),
                        current_user: User = Depends(auth_service.get_current_user)):
     """
-    The get_contacts function returns a list of contacts.
+    The get_contacts function returns a list of contacts of the current user.
+        In the default offset mode the page is selected with limit and offset.
+        In cursor mode (paginate=cursor, or any request carrying a cursor) the page starts after the cursor
+        and the token for the next page is returned in the X-Next-Cursor header, which is absent on the last page.
+        Pages are served from contact_cache with an ETag, a matching If-None-Match gets 304 Not Modified.
 
+    :param request: Request: Read the If-None-Match header
     :param limit: int: Limit the number of contacts returned
     :param le: Limit the maximum number of contacts returned
     :param offset: int: Specify the number of records to skip before returning results
-    :param db: Session: Get a database session
+    :param paginate: str: Pagination mode, offset or cursor
+    :param cursor: str: Opaque token returned in X-Next-Cursor by the previous page
+    :param sort_by: str: Order contacts by id or by last_name in cursor mode
+    :param db: AsyncSession: Get a database session
     :param current_user: User: Get the user_id of the current user
     :return: A list of contacts
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_contacts(limit, offset, db)
-    return contacts
+    async def load():
+        if paginate == 'offset' and cursor is None:
+            contacts = await repository_contacts.get_contacts(limit, offset, current_user, db)
+            return CachedResponse.from_model(ContactResponse, contacts)
+
+        order, after = sort_by, None
+        if cursor is not None:
+            order, after = decode_cursor(cursor, repository_contacts.SORT_COLUMNS)
+        contacts = await repository_contacts.get_contacts_after(limit + 1, order, after, current_user, db)
+        headers = {}
+        if len(contacts) > limit:
+            contacts = contacts[:limit]
+            last = contacts[-1]
+            values = [getattr(last, column.key) for column in repository_contacts.SORT_COLUMNS[order]]
+            headers['X-Next-Cursor'] = encode_cursor(order, values)
+        return CachedResponse.from_model(ContactResponse, contacts, headers)
+
+    key = f"list:{paginate}:{sort_by}:{cursor}:{limit}:{offset}"
+    return await contact_cache.get_or_load(request, current_user.id, key, load, collection=True)
+
+
+@router.get("/birthday", response_model=List[ContactResponse])
+async def contacts_birthday(request: Request, days: int = Query(settings.birthday_window_days, ge=0, le=366),
+                            db: AsyncSession = Depends(get_db),
+                            current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The contacts_birthday function returns a list of contacts with birthdays in the next days days.
+        The function is called by sending a GET request to /contacts/birthday.
+        The list is computed once per day and kept in contact_cache until midnight or the next change of contacts.
+
+    :param request: Request: Read the If-None-Match header
+    :param days: int: Size of the window in days, birthday_window_days from the settings by default
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Get the current user
+    :return: A list of contacts that have a birthday in the next days days
+    :doc-author: Trelent
+    """
+    async def load():
+        contacts = await repository_contacts.get_birthday(days, current_user, db)
+        return CachedResponse.from_model(ContactResponse, contacts)
+
+    today = date.today()
+    until_midnight = datetime.combine(today + timedelta(days=1), time()) - datetime.now()
+    return await contact_cache.get_or_load(request, current_user.id, f"birthday:{today.isoformat()}:{days}",
+                                           load, collection=True, ttl=max(int(until_midnight.total_seconds()), 1))
+
+
+@router.get("/search", response_model=List[ContactResponse])
+async def search_contacts(q: str = Query(min_length=1, max_length=100),
+                          fields: List[Literal['first_name', 'last_name', 'email', 'phone']] = Query(None),
+                          fuzzy: bool = False, limit: int = Query(20, ge=1, le=100),
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The search_contacts function searches contacts by first name, last name, email and phone.
+        By default contacts whose field starts with q (case-insensitive) are returned,
+        with fuzzy=true similar values match as well.
+
+    :param q: str: Text to search for
+    :param fields: List[str]: Fields to search in, all of them by default
+    :param fuzzy: bool: Also return contacts similar to q
+    :param limit: int: Limit the number of contacts returned
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Check if the user is authenticated
+    :return: A list of matching contacts
+    :doc-author: Trelent
+    """
+    fields = fields or list(repository_contacts.SEARCH_COLUMNS)
+    contacts = await repository_contacts.search_contacts(q, fields, fuzzy, limit, current_user, db)
+    return orm_response(ContactResponse, contacts)
+
+
+@router.get("/export", response_class=StreamingResponse,
+            responses={200: {"content": {"text/csv": {}, "application/x-ndjson": {}}}})
+async def export_contacts(format: Literal['csv', 'ndjson'] = 'csv', gzip: bool = False,
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The export_contacts function streams all contacts of the current user as a CSV or NDJSON file.
+        Rows are read from the database and sent in batches while the response is being written,
+        with gzip=true the body is sent with gzip content encoding.
+
+    :param format: str: csv or ndjson
+    :param gzip: bool: Compress the response
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the current user
+    :return: A streaming response with the file
+    :doc-author: Trelent
+    """
+    media_type = contacts_io.FORMATS[format][0]
+    headers = {"Content-Disposition": f'attachment; filename="contacts.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(contacts_io.export_contacts(format, gzip, current_user, db), media_type=media_type,
+                             headers=headers)
 
 
 @router.get("/{contact_id}", response_model=ContactResponse)
-async def get_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db),
+async def get_contact(request: Request, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
                       current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_contact function is a GET request that returns the contact with the given ID.
     If no such contact exists, it raises an HTTP 404 error.
+    The contact is served from contact_cache with an ETag, a matching If-None-Match gets 304 Not Modified.
 
+    :param request: Request: Read the If-None-Match header
     :param contact_id: int: Specify the contact id that is passed in the url
-    :param db: Session: Pass in the database session object
+    :param db: AsyncSession: Pass in the database session object
     :param current_user: User: Get the current user from the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.get_contact_by_id(contact_id, db)
-    if contact is None:
+    async def load():
+        contact = await repository_contacts.get_contact_by_id(contact_id, current_user, db)
+        return CachedResponse.from_model(ContactResponse, contact) if contact is not None else None
+
+    response = await contact_cache.get_or_load(request, current_user.id, f"contact:{contact_id}", load)
+    if response is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
-    return contact
+    return response
 
 
-@router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED)
-async def create_contact(body: ContactModel, db: Session = Depends(get_db),
+@router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED, dependencies=limit_writes)
+async def create_contact(body: ContactModel, db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_contact function creates a new contact in the database.
@@ -59,20 +178,76 @@ async def create_contact(body: ContactModel, db: Session = Depends(get_db),
         The function returns the newly created contact object.
 
     :param body: ContactModel: Get the data from the request body
-    :param db: Session: Pass the database session to the repository
+    :param db: AsyncSession: Pass the database session to the repository
     :param current_user: User: Get the current user
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.get_contact_by_email(body.email, db)
-    if contact:
+    contact = await repository_contacts.create(body, current_user, db)
+    if contact is None:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email is existed!")
-    contact = await repository_contacts.create(body, db)
     return contact
 
 
-@router.put("/{contact_id}", response_model=ContactResponse)
-async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: Session = Depends(get_db),
+@router.put("/", response_model=ContactResponse, dependencies=limit_writes)
+async def upsert_contact(body: ContactModel, db: AsyncSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The upsert_contact function creates a contact, or updates the contact of the user that has the same email,
+    in one statement. Clients that sync contacts by email do not have to look up the id first.
+
+    :param body: ContactModel: Get the data from the request body
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the current user
+    :return: The created or updated contact
+    :doc-author: Trelent
+    """
+    contact = await repository_contacts.upsert(body, current_user, db)
+    if contact is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Contact was changed concurrently")
+    return contact
+
+
+@router.post("/import", response_model=ContactImportResponse, dependencies=limit_writes)
+async def import_contacts(file: UploadFile = File(), format: Literal['csv', 'ndjson'] | None = None,
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The import_contacts function creates contacts in bulk from an uploaded CSV or NDJSON file.
+        The file is read and inserted in batches, rows that are invalid or whose email already exists
+        are skipped and reported with their row number.
+
+    :param file: UploadFile: CSV with a header row or NDJSON, one contact per row
+    :param format: str: csv or ndjson, guessed from the file name or content type when omitted
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the current user
+    :return: The number of imported and failed rows and the errors
+    :doc-author: Trelent
+    """
+    fmt = format or contacts_io.detect_format(file.filename, file.content_type)
+    return await contacts_io.import_contacts(file.file, fmt, current_user, db)
+
+
+@router.post("/batch", response_model=ContactBatchResponse, dependencies=limit_writes)
+async def batch_contacts(body: ContactBatchModel, db: AsyncSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The batch_contacts function creates, updates and deletes many contacts in one request and one transaction.
+        Every operation gets its own result with the status code it would have had as a single request:
+        201 with the new id, 200, 204, or 404 / 409 with the reason it was skipped.
+
+    :param body: ContactBatchModel: Up to contacts_batch_max_operations operations
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the current user
+    :return: The results in the order of the operations
+    :doc-author: Trelent
+    """
+    results = await contacts_batch.run_batch(body.operations, current_user, db)
+    return {"results": results}
+
+
+@router.put("/{contact_id}", response_model=ContactResponse, dependencies=limit_writes)
+async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_contact function updates a contact in the database.
@@ -81,19 +256,24 @@ async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: S
 
     :param body: ContactModel: Define the data that will be sent in the request body
     :param contact_id: int: Specify the id of the contact to be updated
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user
     :return: A contactmodel object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.update(contact_id, body, db)
+    try:
+        contact = await repository_contacts.update(contact_id, body, current_user, db)
+    except IntegrityError:
+        # Another contact of the user has this email
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email is existed!")
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return contact
 
 
-@router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db),
+@router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=limit_writes)
+async def delete_contact(contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The delete_contact function deletes a contact from the database.
@@ -101,70 +281,55 @@ async def delete_contact(contact_id: int = Path(ge=1), db: Session = Depends(get
         It also takes in two dependencies: db and current_user.
             - db is used to access our database session, so that we can make changes to it (in this case deleting).
             - current_user is used for authentication purposes; only users who are logged into their account can delete contacts.
+        Contacts of other users are not found.
 
     :param contact_id: int: Specify the contact id to be deleted
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the database
     :return: The deleted contact
     :doc-author: Trelent
     """
-    contact = await repository_contacts.remove(contact_id, db)
+    contact = await repository_contacts.remove(contact_id, current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return contact
 
 
-@router.get("/birthday", response_model=List[ContactResponse])
-async def contacts_birthday(db: Session = Depends(get_db),
-                            current_user: User = Depends(auth_service.get_current_user)):
-    """
-    The contacts_birthday function returns a list of contacts with birthdays in the current month.
-        The function is called by sending a GET request to /contacts/birthday.
-
-    :param db: Session: Access the database
-    :param current_user: User: Get the current user
-    :return: A list of contacts that have a birthday in the next week
-    :doc-author: Trelent
-    """
-    contacts = await repository_contacts.get_birthday(db)
-    if contacts is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
-    return contacts
-
-
-@router.get("/find/{contact_firstname}", response_model=List[ContactResponse])
-async def find_contact_by_firstname(contact_firstname: str, db: Session = Depends(get_db),
+@router.get("/find/{contact_firstname}", response_model=List[ContactResponse], deprecated=True)
+async def find_contact_by_firstname(contact_firstname: str, db: AsyncSession = Depends(get_db),
                                     current_user: User = Depends(auth_service.get_current_user)):
     """
     The find_contact_by_firstname function is used to find a contact by their first name.
         The function takes in the contact's first name as an argument and returns the contact object if found.
+        Deprecated in favour of /contacts/search.
 
     :param contact_firstname: str: Specify the firstname of the contact to be found
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Check if the user is authenticated
     :return: A contact with the given firstname
     :doc-author: Trelent
     """
-    contact = await repository_contacts.find_contact_by_firstname(contact_firstname, db)
+    contact = await repository_contacts.find_contact_by_firstname(contact_firstname, current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return contact
 
 
-@router.get("/find/{contact_lastname}", response_model=List[ContactResponse])
-async def find_contact_by_lastname(contact_lastname: str, db: Session = Depends(get_db),
+@router.get("/find/lastname/{contact_lastname}", response_model=List[ContactResponse], deprecated=True)
+async def find_contact_by_lastname(contact_lastname: str, db: AsyncSession = Depends(get_db),
                                    current_user: User = Depends(auth_service.get_current_user)):
     """
     The find_contact_by_lastname function is used to find a contact by their last name.
         The function takes in the contact's last name as an argument and returns the contact object if found.
+        Deprecated in favour of /contacts/search.
 
     :param contact_lastname: str: Specify the lastname of the contact we want to find
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Check if the user is authenticated
     :return: A single contact by lastname
     :doc-author: Trelent
     """
-    contact = await repository_contacts.find_contact_by_lastname(contact_lastname, db)
+    contact = await repository_contacts.find_contact_by_lastname(contact_lastname, current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return contact
@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
+import base64
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
 from src.conf.config import settings
-from src.schemas import UserResponse
+from src.schemas import UserResponse, AvatarJobResponse
 from src.services.cloud_image import CloudImage
+from src.services.jobs import job_queue
+from src.services.rate_limit import UserRateLimit
+from src.services.tasks import avatar_job
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -25,20 +33,53 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
     return current_user
 
 
-@router.patch('/avatar', response_model=UserResponse)
-async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+@router.patch('/avatar', response_model=UserResponse, dependencies=[Depends(UserRateLimit('avatar'))],
+              responses={status.HTTP_202_ACCEPTED: {"model": AvatarJobResponse}})
+async def update_avatar_user(file: UploadFile = File(), background: bool = False,
+                             current_user: User = Depends(auth_service.get_current_user),
+                             db: AsyncSession = Depends(get_db)):
     """
     The update_avatar_user function updates the avatar of a user.
+        The image is checked against the allowed content types and size limit, then stored
+        in the configured storage backend off the event loop.
+        With background=true the upload is queued for the job worker and the function answers 202
+        with a job id right away, the job status is available at /users/avatar/jobs/{job_id}.
 
     :param file: UploadFile: Get the file that is uploaded by the user
+    :param background: bool: Return a job id instead of waiting for the upload
     :param current_user: User: Get the current user from the database
-    :param db: Session: Get the database session
-    :return: The updated user
+    :param db: AsyncSession: Get the database session
+    :return: The updated user, or the job in background mode
     :doc-author: Trelent
     """
+    spool = await CloudImage.read_upload(file)
     public_id = CloudImage.generate_name_avatar(current_user.email)
-    r = CloudImage.upload(file.file, public_id)
-    src_url = CloudImage.get_url_for_avatar(public_id, r)
+    if background:
+        with spool:
+            data = base64.b64encode(await run_in_threadpool(spool.read)).decode()
+        job = avatar_job(uuid.uuid4().hex, current_user.email)
+        await job_queue.set_status(job["job_id"], job)
+        await job_queue.enqueue("upload_avatar", job_id=job["job_id"], email=current_user.email,
+                                public_id=public_id, content_type=file.content_type, data=data)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED,
+                            content=AvatarJobResponse(**job).model_dump())
+    src_url = await CloudImage.upload_async(spool, public_id, file.content_type)
     user = await repository_users.update_avatar(current_user.email, src_url, db)
     return user
+
+
+@router.get('/avatar/jobs/{job_id}', response_model=AvatarJobResponse)
+async def get_avatar_job(job_id: str, current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_avatar_job function returns the status of a background avatar upload:
+    pending, done (with the avatar url) or failed (with the error).
+
+    :param job_id: str: The job id returned by update_avatar_user
+    :param current_user: User: Get the current user from the database
+    :return: The job
+    :doc-author: Trelent
+    """
+    job = await job_queue.get_status(job_id)
+    if job is None or job["email"] != current_user.email:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return job
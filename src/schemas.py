@@ -1,6 +1,9 @@
 from datetime import date, datetime
+from typing import List, Literal
 
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, model_validator
+
+from src.conf.config import settings
 
 
 class ContactModel(BaseModel):
@@ -20,8 +23,48 @@ class ContactResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ContactOperation(BaseModel):
+    op: Literal['create', 'update', 'delete']
+    id: int | None = Field(default=None, ge=1)
+    data: ContactModel | None = None
+
+    @model_validator(mode='after')
+    def check_fields(self):
+        if self.op != 'create' and self.id is None:
+            raise ValueError(f"id is required for {self.op}")
+        if self.op != 'delete' and self.data is None:
+            raise ValueError(f"data is required for {self.op}")
+        return self
+
+
+class ContactBatchModel(BaseModel):
+    operations: List[ContactOperation] = Field(min_length=1, max_length=settings.contacts_batch_max_operations)
+
+
+class ContactOperationResult(BaseModel):
+    index: int
+    op: str
+    id: int | None
+    status: int
+    detail: str | None = None
+
+
+class ContactBatchResponse(BaseModel):
+    results: List[ContactOperationResult]
+
+
+class ContactImportError(BaseModel):
+    row: int
+    detail: str
+
+
+class ContactImportResponse(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ContactImportError]
 
 
 class UserModel(BaseModel):
@@ -36,8 +79,7 @@ class UserResponse(BaseModel):
     email: str
     avatar: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class TokenModel(BaseModel):
@@ -48,3 +90,10 @@ class TokenModel(BaseModel):
 
 class RequestEmail(BaseModel):
     email: EmailStr
+
+
+class AvatarJobResponse(BaseModel):
+    job_id: str
+    status: str
+    avatar: str | None = None
+    detail: str | None = None
@@ -1,30 +1,32 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
-import redis as redis
 from fastapi import Depends, HTTPException, status
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer  # Bearer token
-from sqlalchemy.orm import Session
-from jose import JWTError, jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+from jose import JWTError
 
 from src.database.db import get_db
 from src.repository import users as repository_users
 from src.conf.config import settings
+from src.services.cache import user_cache
+from src.services.password import password_hasher
+from src.services.revocation import revocation_list
+from src.services.tokens import token_verifier
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    SECRET_KEY = settings.secret_key
-    ALGORITHM = settings.algorithm
+    hasher = password_hasher
+    pwd_context = password_hasher.context
+    tokens = token_verifier
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
 
     def verify_password(self, plain_password, hashed_password):
         """
         The verify_password function takes a plain-text password and hashed
         password as arguments. It then uses the pwd_context object to verify that the
         plain-text password matches the hashed one.
+        It blocks the caller, async code should use hasher.verify_and_update instead.
 
         :param self: Make the method a bound method, which means that it can be called on objects of this class
         :param plain_password: Pass in the password that the user enters
@@ -38,6 +40,7 @@ class Auth:
         """
         The get_password_hash function takes a password as input and returns the hash of that password.
         The hash is generated using the pwd_context object, which is an instance of Flask-Bcrypt's Bcrypt class.
+        It blocks the caller, async code should use hasher.hash instead.
 
         :param self: Represent the instance of the class
         :param password: str: Get the password from the user
@@ -50,9 +53,10 @@ class Auth:
         """
         The create_access_token function creates a new access token.
             Args:
-                data (dict): A dictionary containing the claims to be encoded in the JWT.
+                data (dict): A dictionary containing the claims to be encoded in the JWT,
+                    with the session id as sid for tokens that may be revoked with their session.
                 expires_delta (Optional[float]): An optional parameter specifying how long, in seconds,
-                    the access token should last before expiring. If not specified, it defaults to 15 minutes.
+                    the access token should last before expiring. If not specified, it defaults to access_token_ttl.
 
         :param self: Represent the instance of the class
         :param data: dict: Pass the data that will be encoded into the jwt
@@ -64,17 +68,18 @@ class Auth:
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
-            expire = datetime.utcnow() + timedelta(minutes=15)
+            expire = datetime.utcnow() + timedelta(seconds=settings.access_token_ttl)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
-        encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        encoded_access_token = self.tokens.sign(to_encode)
         return encoded_access_token
 
     async def create_refresh_token(self, data: dict, expires_delta: Optional[float] = None):
         """
         The create_refresh_token function creates a refresh token for the user.
             Args:
-                data (dict): A dictionary containing the user's id and username.
-                expires_delta (Optional[float]): The number of seconds until the token expires, defaults to None.
+                data (dict): The claims: the user's email as sub, the session id as sid and the token id as jti.
+                expires_delta (Optional[float]): The number of seconds until the token expires,
+                    refresh_token_ttl from the settings by default.
 
         :param self: Access the class variables
         :param data: dict: Pass in the user's id and username
@@ -86,20 +91,23 @@ class Auth:
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
-            expire = datetime.utcnow() + timedelta(days=7)
+            expire = datetime.utcnow() + timedelta(seconds=settings.refresh_token_ttl)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
-        encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        encoded_refresh_token = self.tokens.sign(to_encode)
         return encoded_refresh_token
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
         """
         The get_current_user function is a dependency that will be used in the
             protected endpoints. It takes a token as an argument and returns the user
             if it's valid, or raises an exception otherwise.
+            The claims of a known token come from the token_verifier cache and the user from user_cache,
+            so most requests skip both the signature check and the users query.
+            Tokens of a revoked session are rejected before they expire, see revocation_list.
 
         :param self: Make the function a method of the class
         :param token: str: Get the token from the authorization header
-        :param db: Session: Pass the database session to the function
+        :param db: AsyncSession: Pass the database session to the function
         :return: The user object if the token is valid
         :doc-author: Trelent
         """
@@ -110,39 +118,59 @@ class Auth:
             )
 
         try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload.get("scope") == "access_token":
-                email = payload.get("sub")
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
+            # Verify JWT, a token seen before is served from the claims cache
+            payload = self.tokens.verify(token, "access_token")
         except JWTError as e:
             raise credentials_exception
+        email = payload.get("sub")
+        if email is None:
+            raise credentials_exception
+        # Microseconds unless the Bloom filter reports the session
+        if payload.get("sid") and await revocation_list.is_revoked(f"sid:{payload['sid']}"):
+            raise credentials_exception
 
-        user = await repository_users.get_user_by_email(email, db)
+        user = await user_cache.get(email)
         if user is None:
-            raise credentials_exception
+            user = await repository_users.get_user_by_email(email, db)
+            if user is None:
+                raise credentials_exception
+            await user_cache.set(user)
         return user
 
+    async def get_current_admin(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+        """
+        The get_current_admin function is a dependency of the admin endpoints.
+        It returns the current user when the email of the user is listed in admin_emails,
+        otherwise it raises 403 Forbidden.
+
+        :param self: Make the function a method of the class
+        :param token: str: Get the token from the authorization header
+        :param db: AsyncSession: Pass the database session to the function
+        :return: The user object if the user is an administrator
+        :doc-author: Trelent
+        """
+        current_user = await self.get_current_user(token, db)
+        if current_user.email not in settings.admin_emails:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+        return current_user
+
     async def decode_refresh_token(self, refresh_token: str):
         """
         The decode_refresh_token function is used to decode the refresh token.
-        It takes a refresh_token as an argument and returns the email of the user if it's valid.
+        It takes a refresh_token as an argument and returns the email of the user, the session id
+        and the token id if it's valid.
         If not, it raises an HTTPException with status code 401 (UNAUTHORIZED) and detail 'Could not validate credentials'.
 
 
         :param self: Represent the instance of the class
         :param refresh_token: str: Pass the refresh token to the function
-        :return: The email of the user that is stored in the refresh token
+        :return: The email, session id and token id stored in the refresh token
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
+            payload = self.tokens.decode(refresh_token)
+            if payload['scope'] == 'refresh_token' and payload.get('sid') and payload.get('jti'):
+                return payload['sub'], payload['sid'], payload['jti']
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
@@ -150,8 +178,7 @@ class Auth:
     def create_email_token(self, data: dict):
         """
         The create_email_token function takes a dictionary of data and returns a token.
-        The token is encoded with the SECRET_KEY, which is stored in the .env file.
-        The algorithm used to encode the token is also stored in the .env file.
+        The token is signed by token_verifier with the active key from the .env file.
 
         :param self: Make the function a method of the class
         :param data: dict: Pass in the data that will be encoded into the token
@@ -161,13 +188,13 @@ class Auth:
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(days=7)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "email_token"})
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        token = self.tokens.sign(to_encode)
         return token
 
     def get_email_from_token(self, token: str):
         """
         The get_email_from_token function takes a token as an argument and returns the email associated with that token.
-        It does this by decoding the JWT using our SECRET_KEY and ALGORITHM, then checking to make sure that it has a scope of 'email_token'.
+        It does this by decoding the JWT with token_verifier, then checking to make sure that it has a scope of 'email_token'.
         If so, it returns the email address from the payload's sub field. If not, it raises an HTTPException with status code 401 (Unauthorized)
         and detail message &quot;Invalid scope for token&quot;. If there is any other error in decoding or validating the JWT, we raise another
         HTTPException with status code 422 (Unprocess
@@ -178,7 +205,7 @@ class Auth:
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.tokens.decode(token)
             if payload['scope'] == 'email_token':
                 email = payload['sub']
                 return email
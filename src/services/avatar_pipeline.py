@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import io
+from typing import BinaryIO
+
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+from src.conf.config import settings
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow is an optional dependency, install the "images" extra to use the pipeline
+    Image = None
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+DERIVATIVES_PREFIX = "avatars"
+
+
+def enabled() -> bool:
+    """
+    The enabled function tells if avatars are processed locally: the avatar_pipeline setting is on
+    and Pillow is installed.
+
+    :return: True if the pipeline is used
+    :doc-author: Trelent
+    """
+    return settings.avatar_pipeline and Image is not None
+
+
+def render_derivatives(data: bytes) -> list[tuple[str, bytes, str]]:
+    """
+    The render_derivatives function decodes the image, crops it to a centered square and encodes it
+    in every size of avatar_sizes and every format of avatar_formats.
+    Images of more than avatar_max_pixels pixels are rejected before they are decoded.
+    Keys are derived from the hash of the original image, so the same image always gets the same keys
+    and a stored derivative never changes.
+
+    :param data: bytes: The uploaded image
+    :return: A list of (key, encoded image, content type), the first one is the default avatar
+    :doc-author: Trelent
+    """
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Image is too large")
+    try:
+        # Only the header is read here: the size is checked before any pixel is decoded
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if width * height > settings.avatar_max_pixels:
+            raise too_large
+        # JPEG decodes at a reduced scale that still covers the largest derivative, other formats ignore it
+        largest = max(settings.avatar_sizes)
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    except Image.DecompressionBombError:
+        raise too_large
+    except (UnidentifiedImageError, OSError):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Invalid image")
+
+    derivatives = []
+    for size in settings.avatar_sizes:
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        for name in settings.avatar_formats:
+            pil_format, content_type = FORMATS[name]
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, pil_format, quality=settings.avatar_quality)
+            derivatives.append((f"{DERIVATIVES_PREFIX}/{digest}/{size}.{name}", buffer.getvalue(), content_type))
+    return derivatives
+
+
+async def store(file: BinaryIO, storage) -> str:
+    """
+    The store function renders the derivatives off the event loop and saves them concurrently
+    in the storage backend.
+
+    :param file: BinaryIO: The uploaded image, already checked by CloudImage.read_upload
+    :param storage: StorageBackend: Where the derivatives are saved
+    :return: The url of the default avatar (first size, first format)
+    :doc-author: Trelent
+    """
+    data = await run_in_threadpool(file.read)
+    derivatives = await run_in_threadpool(render_derivatives, data)
+    urls = await asyncio.gather(*(storage.save(key, io.BytesIO(content), content_type)
+                                  for key, content, content_type in derivatives))
+    return urls[0]
@@ -0,0 +1,387 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Hashable
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from fastapi import Request, Response, status
+from pydantic import BaseModel
+
+from src.conf.config import settings
+from src.database.models import User
+from src.database.redis_pool import redis_pool
+from src.services.serialization import orm_to_json
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries also expire ttl seconds after they were stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default=None):
+        """
+        The get function returns the cached value for key and marks it as recently used.
+        Expired entries are dropped and reported as a miss.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The cache key
+        :param default: The value returned on a miss
+        :return: The cached value or default
+        :doc-author: Trelent
+        """
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """
+        The set function stores value under key, evicting the least recently used entry when the cache is full.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The cache key
+        :param value: Any: The value to store
+        :param ttl: float | None: Override the default time to live in seconds
+        :return: None
+        :doc-author: Trelent
+        """
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Columns of users that are never cached; get_current_user does not need them
+SECRET_COLUMNS = frozenset({"password"})
+
+
+class UserCache:
+    """
+    Cache of authenticated users keyed by email.
+
+    The first tier is an in-process TTLCache, the optional second tier is Redis, shared by all workers.
+    Users are stored as plain column dictionaries and returned as detached User objects.
+    An invalidation only clears the local tier of the current worker, so other workers may serve
+    a stale user for at most user_cache_ttl seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, redis_client: redis.Redis | None = None):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize, ttl)
+        self.redis = redis_client
+
+    def set_redis(self, client: redis.Redis | None) -> None:
+        self.redis = client
+
+    @staticmethod
+    def _key(email: str) -> str:
+        return f"user:{email}"
+
+    @staticmethod
+    def _dump(user: User) -> dict:
+        # The Redis tier is shared, secrets such as the password hash stay in the database
+        return {column.name: getattr(user, column.name) for column in User.__table__.columns
+                if column.name not in SECRET_COLUMNS}
+
+    async def get(self, email: str) -> User | None:
+        """
+        The get function looks the user up in the local tier, then in Redis.
+        A Redis hit is copied into the local tier.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: A detached user object or None on a miss
+        :doc-author: Trelent
+        """
+        data = self.local.get(email)
+        if data is None and self.redis is not None:
+            try:
+                raw = await self.redis.get(self._key(email))
+            except RedisError as err:
+                logger.warning("Redis cache unavailable: %s", err)
+                raw = None
+            if raw is not None:
+                data = json.loads(raw)
+                self.local.set(email, data)
+        return User(**data) if data is not None else None
+
+    async def set(self, user: User) -> None:
+        """
+        The set function stores the user in both tiers.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user loaded from the database
+        :return: None
+        :doc-author: Trelent
+        """
+        data = self._dump(user)
+        self.local.set(user.email, data)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._key(user.email), json.dumps(data), ex=self.ttl)
+            except RedisError as err:
+                logger.warning("Redis cache unavailable: %s", err)
+
+    async def invalidate(self, email: str) -> None:
+        """
+        The invalidate function removes the user from both tiers after the user row was changed.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the changed user
+        :return: None
+        :doc-author: Trelent
+        """
+        self.local.delete(email)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(self._key(email))
+            except RedisError as err:
+                logger.warning("Redis cache unavailable: %s", err)
+
+
+user_cache = UserCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+if settings.user_cache_redis:
+    redis_pool.attach(user_cache)
+
+
+@dataclass
+class CachedResponse:
+    body: str
+    etag: str
+    headers: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_body(cls, body: str, headers: dict[str, str] | None = None) -> "CachedResponse":
+        return cls(body, f'"{hashlib.sha256(body.encode()).hexdigest()[:32]}"', headers or {})
+
+    @classmethod
+    def from_model(cls, model: type[BaseModel], data, headers: dict[str, str] | None = None) -> "CachedResponse":
+        """
+        The from_model function serializes the rows returned by the repository with orm_to_json,
+        to the body a response_model of model would produce.
+
+        :param model: type[BaseModel]: The response model of a row, for example ContactResponse
+        :param data: A row or a list of rows returned by the repository
+        :param headers: dict[str, str] | None: Extra response headers to cache with the body
+        :return: The entry
+        :doc-author: Trelent
+        """
+        return cls.from_body(orm_to_json(model, data).decode(), headers)
+
+    def to_response(self, request: Request) -> Response:
+        """
+        The to_response function answers 304 Not Modified when the If-None-Match header of the request
+        matches the ETag of the entry, otherwise it sends the cached JSON body.
+
+        :param self: Represent the instance of the class
+        :param request: Request: The current request
+        :return: The response
+        :doc-author: Trelent
+        """
+        headers = dict(self.headers, ETag=self.etag)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or self.etag in
+                              [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class ContactCache:
+    """
+    Cache of serialized contact responses with ETags, in front of the contacts repository.
+
+    Like UserCache it has an in-process TTLCache tier and an optional Redis tier. Entries are kept per owner.
+    Single contacts are cached under their id and invalidated one by one when they are updated or removed;
+    a contact loaded while a write of its owner was in progress is served but not stored.
+    With Redis they are only kept there, since a deletion cannot reach the local tiers of other workers.
+    Lists depend on every contact of the owner, so their keys carry a per-owner generation number that every
+    write of that owner increments; entries of older generations are never read again and age out.
+    With Redis the generation is shared by all workers, without it other workers may serve a stale contact
+    or list for at most contact_cache_ttl seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, redis_client: redis.Redis | None = None):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize, ttl)
+        self.redis = redis_client
+        self.local_generations: dict[int, int] = {}
+        self.stats = {"hits": 0, "redis_hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    def set_redis(self, client: redis.Redis | None) -> None:
+        self.redis = client
+
+    async def generation(self, user_id: int) -> int:
+        if self.redis is not None:
+            try:
+                return int(await self.redis.get(f"contacts:generation:{user_id}") or 0)
+            except RedisError as err:
+                logger.warning("Redis cache unavailable: %s", err)
+        return self.local_generations.get(user_id, 0)
+
+    def _local(self, collection: bool) -> bool:
+        # Generation keys change on every write; the key of a single contact does not
+        return collection or self.redis is None
+
+    async def _key(self, user_id: int, key: str, collection: bool, generation: int | None = None) -> str:
+        if collection:
+            if generation is None:
+                generation = await self.generation(user_id)
+            return f"contacts:{user_id}:{generation}:{key}"
+        return f"contacts:{user_id}:{key}"
+
+    async def get(self, user_id: int, key: str, collection: bool = False) -> CachedResponse | None:
+        """
+        The get function looks the entry up in the local tier, then in Redis.
+        A Redis hit is copied into the local tier.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :param key: str: The cache key, see the contacts routes
+        :param collection: bool: The entry depends on every contact of the owner, like a list
+        :return: The cached response or None on a miss
+        :doc-author: Trelent
+        """
+        return await self._get(await self._key(user_id, key, collection), self._local(collection))
+
+    async def _get(self, full_key: str, local: bool = True) -> CachedResponse | None:
+        entry = self.local.get(full_key) if local else None
+        if entry is not None:
+            self.stats["hits"] += 1
+            return entry
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(full_key)
+            except RedisError as err:
+                logger.warning("Redis cache unavailable: %s", err)
+                raw = None
+            if raw is not None:
+                entry = CachedResponse(**json.loads(raw))
+                if local:
+                    self.local.set(full_key, entry)
+                self.stats["redis_hits"] += 1
+                return entry
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, user_id: int, key: str, entry: CachedResponse, collection: bool = False,
+                  ttl: int | None = None) -> None:
+        """
+        The set function stores the entry in both tiers.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :param key: str: The cache key
+        :param entry: CachedResponse: The serialized response
+        :param collection: bool: The entry depends on every contact of the owner, like a list
+        :param ttl: int | None: Override contact_cache_ttl
+        :return: None
+        :doc-author: Trelent
+        """
+        await self._set(await self._key(user_id, key, collection), entry, ttl, self._local(collection))
+
+    async def _set(self, full_key: str, entry: CachedResponse, ttl: int | None = None, local: bool = True) -> None:
+        ttl = ttl or self.ttl
+        if local:
+            self.local.set(full_key, entry, ttl)
+        if self.redis is not None:
+            try:
+                await self.redis.set(full_key, json.dumps(asdict(entry)), ex=ttl)
+            except RedisError as err:
+                logger.warning("Redis cache unavailable: %s", err)
+
+    async def get_or_load(self, request: Request, user_id: int, key: str,
+                          load: Callable[[], Awaitable[CachedResponse | None]],
+                          collection: bool = False, ttl: int | None = None) -> Response | None:
+        """
+        The get_or_load function serves the entry from the cache, or calls load and caches its result.
+
+        :param self: Represent the instance of the class
+        :param request: Request: The current request, for If-None-Match
+        :param user_id: int: The owner of the contacts
+        :param key: str: The cache key
+        :param load: Coroutine function that reads the repository and serializes the response, None if not found
+        :param collection: bool: The entry depends on every contact of the owner, like a list
+        :param ttl: int | None: Override contact_cache_ttl
+        :return: The response, or None when load found nothing
+        :doc-author: Trelent
+        """
+        # The key is resolved before loading, so a write during the load moves readers to a new generation
+        # instead of having them read what was loaded before it
+        generation = await self.generation(user_id)
+        full_key = await self._key(user_id, key, collection, generation)
+        local = self._local(collection)
+        entry = await self._get(full_key, local)
+        if entry is None:
+            entry = await load()
+            if entry is None:
+                return None
+            # A single contact keeps its key across writes: when a write of the owner happened during the load,
+            # its invalidation may already be done and storing would bring back what it dropped
+            if collection or await self.generation(user_id) == generation:
+                await self._set(full_key, entry, ttl, local)
+        response = entry.to_response(request)
+        if response.status_code == status.HTTP_304_NOT_MODIFIED:
+            self.stats["not_modified"] += 1
+        return response
+
+    async def invalidate(self, user_id: int, contact_ids: list[int] = ()) -> None:
+        """
+        The invalidate function is called after contacts of the owner were written: it drops the entries
+        of the changed contacts and moves the lists of the owner to a new generation.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :param contact_ids: list[int]: Ids of updated or removed contacts, empty when contacts were only created
+        :return: None
+        :doc-author: Trelent
+        """
+        self.stats["invalidations"] += 1
+        self.local_generations[user_id] = self.local_generations.get(user_id, 0) + 1
+        keys = [f"contacts:{user_id}:contact:{contact_id}" for contact_id in contact_ids]
+        for key in keys:
+            self.local.delete(key)
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.incr(f"contacts:generation:{user_id}")
+                    if keys:
+                        pipe.delete(*keys)
+                    await pipe.execute()
+            except RedisError as err:
+                logger.warning("Redis cache unavailable: %s", err)
+
+    def metrics(self) -> dict:
+        return dict(self.stats, size=len(self.local))
+
+
+contact_cache = ContactCache(maxsize=settings.contact_cache_size, ttl=settings.contact_cache_ttl)
+if settings.contact_cache_redis:
+    redis_pool.attach(contact_cache)
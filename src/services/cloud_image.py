@@ -1,9 +1,100 @@
 import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO
 
 import cloudinary
 import cloudinary.uploader
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+from starlette.staticfiles import StaticFiles
 
 from src.conf.config import settings
+from src.services import avatar_pipeline
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StorageBackend(ABC):
+    """
+    Where uploaded avatars are stored. save is called with a file positioned at its start
+    and returns the public url of the stored file.
+    Keys with an extension are finished, content-addressed derivatives of avatar_pipeline:
+    they are stored as they are and never change.
+    """
+
+    @abstractmethod
+    async def save(self, key: str, file: BinaryIO, content_type: str) -> str:
+        ...
+
+
+class CloudinaryStorage(StorageBackend):
+    async def save(self, key: str, file: BinaryIO, content_type: str) -> str:
+        root, ext = os.path.splitext(key)
+        if ext:
+            r = await run_in_threadpool(cloudinary.uploader.upload, file, public_id=f'{root}_{ext[1:]}',
+                                        overwrite=True)
+            return r['secure_url']
+        r = await run_in_threadpool(CloudImage.upload, file, key)
+        return CloudImage.get_url_for_avatar(key, r)
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def _write(self, path: Path, file: BinaryIO) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}')
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(file, f, CHUNK_SIZE)
+        tmp_path.replace(path)
+
+    async def save(self, key: str, file: BinaryIO, content_type: str) -> str:
+        if os.path.splitext(key)[1]:
+            await run_in_threadpool(self._write, self.path(key), file)
+            return f'{self.base_url}/{key}'
+        key = f'{key}{mimetypes.guess_extension(content_type) or ""}'
+        await run_in_threadpool(self._write, self.path(key), file)
+        return f'{self.base_url}/{key}?v={int(time.time())}'
+
+
+class MediaFiles(StaticFiles):
+    """
+    Serves LocalStorage files. Derivatives under content-hashed keys never change,
+    so they are sent with a long-lived immutable Cache-Control header.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if self.get_path(scope).startswith(f"{avatar_pipeline.DERIVATIVES_PREFIX}{os.sep}"):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+def get_storage() -> StorageBackend:
+    """
+    The get_storage function returns the storage backend selected by the avatar_storage setting.
+
+    :return: A storage backend
+    :doc-author: Trelent
+    """
+    if settings.avatar_storage == 'local':
+        return LocalStorage(settings.avatar_local_dir, settings.avatar_base_url)
+    return CloudinaryStorage()
 
 
 class CloudImage:
@@ -13,6 +104,7 @@ class CloudImage:
         api_secret=settings.cloudinary_api_secret,
         secure=True
     )
+    storage = get_storage()
 
     @staticmethod
     def generate_name_avatar(email: str):
@@ -30,3 +122,51 @@ class CloudImage:
             .build_url(width=250, height=250, crop='fill', version=r.get('version'))
         return src_url
 
+    @staticmethod
+    async def read_upload(file: UploadFile) -> BinaryIO:
+        """
+        The read_upload function checks the content type and the declared size of the uploaded file,
+        then copies it chunk by chunk into a spooled temporary file, giving up as soon as
+        the avatar_max_bytes limit is exceeded.
+
+        :param file: UploadFile: The uploaded file
+        :return: A file object positioned at its start
+        :doc-author: Trelent
+        """
+        if file.content_type not in settings.avatar_content_types:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Unsupported image type")
+        too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File is too large")
+        if file.size is not None and file.size > settings.avatar_max_bytes:
+            raise too_large
+
+        spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        size = 0
+        while chunk := await file.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > settings.avatar_max_bytes:
+                spool.close()
+                raise too_large
+            spool.write(chunk)
+        spool.seek(0)
+        return spool
+
+    @classmethod
+    async def upload_async(cls, file: BinaryIO, public_id: str, content_type: str) -> str:
+        """
+        The upload_async function stores the avatar in the configured storage backend
+        without blocking the event loop and closes the file.
+        When avatar_pipeline is enabled, resized derivatives are stored instead of the original.
+
+        :param file: BinaryIO: The file returned by read_upload
+        :param public_id: str: The storage key, see generate_name_avatar
+        :param content_type: str: Content type of the image
+        :return: The url of the stored avatar
+        :doc-author: Trelent
+        """
+        try:
+            if avatar_pipeline.enabled():
+                return await avatar_pipeline.store(file, cls.storage)
+            return await cls.storage.save(public_id, file, content_type)
+        finally:
+            file.close()
+
@@ -0,0 +1,80 @@
+from fastapi import status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import User
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactOperation
+
+
+async def run_batch(operations: list[ContactOperation], user: User, db: AsyncSession) -> list[dict]:
+    """
+    The run_batch function checks a batch of create, update and delete operations with two queries
+    (existing ids and the owners of the emails), then applies the accepted ones with one statement
+    per kind of operation in a single transaction.
+        An operation is rejected with 404 when its contact does not exist or belongs to another user
+        and with 409 when its contact is already changed by an earlier operation of the batch or its email
+        belongs to another contact of the user that is not deleted by the batch. Rejected operations do not stop the others.
+
+    :param operations: list[ContactOperation]: The operations in request order
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: A result per operation, in request order, with the HTTP status it would have had alone
+    :doc-author: Trelent
+    """
+    results = [{"index": index, "op": operation.op, "id": operation.id, "status": None, "detail": None}
+               for index, operation in enumerate(operations)]
+
+    def reject(index: int, code: int, detail: str):
+        results[index].update(status=code, detail=detail)
+
+    def pending():
+        return [(index, operation) for index, operation in enumerate(operations) if results[index]["status"] is None]
+
+    changed: dict[int, int] = {}
+    for index, operation in enumerate(operations):
+        if operation.id is None:
+            continue
+        if operation.id in changed:
+            reject(index, status.HTTP_409_CONFLICT, f"Contact is already changed by operation {changed[operation.id]}")
+        else:
+            changed[operation.id] = index
+
+    if changed:
+        existing = await repository_contacts.get_existing_ids(list(changed), user, db)
+        for index, operation in pending():
+            if operation.id is not None and operation.id not in existing:
+                reject(index, status.HTTP_404_NOT_FOUND, "Not Found")
+
+    deleted = {operation.id for _, operation in pending() if operation.op == 'delete'}
+    # A delete may carry a body, but it claims no email
+    emails = [operation.data.email for _, operation in pending() if operation.op != 'delete']
+    owners = await repository_contacts.get_email_owners(emails, user, db) if emails else {}
+    claimed: dict[str, int] = {}
+    for index, operation in pending():
+        if operation.op == 'delete':
+            continue
+        email = operation.data.email
+        owner = owners.get(email)
+        if owner is not None and owner != operation.id and owner not in deleted:
+            reject(index, status.HTTP_409_CONFLICT, "Email is existed!")
+        elif email in claimed:
+            reject(index, status.HTTP_409_CONFLICT, f"Email is already used by operation {claimed[email]}")
+        else:
+            claimed[email] = index
+
+    accepted = pending()
+    creates = [(index, operation) for index, operation in accepted if operation.op == 'create']
+    updates = {operation.id: operation.data for _, operation in accepted if operation.op == 'update'}
+    deletes = [operation.id for _, operation in accepted if operation.op == 'delete']
+    if not accepted:
+        return results
+
+    created = await repository_contacts.apply_batch([operation.data for _, operation in creates], updates, deletes,
+                                                    user, db)
+    for (index, _), contact_id in zip(creates, created):
+        results[index].update(id=contact_id, status=status.HTTP_201_CREATED)
+    codes = {'update': status.HTTP_200_OK, 'delete': status.HTTP_204_NO_CONTENT}
+    for index, operation in accepted:
+        if operation.op in codes:
+            results[index]["status"] = codes[operation.op]
+    return results
@@ -0,0 +1,227 @@
+import codecs
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from itertools import islice
+from typing import AsyncIterator, BinaryIO, Iterator, Sequence
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from src.conf.config import settings
+from src.database.models import User
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactModel
+
+INVALID_ENCODING = "Invalid encoding: the file must be UTF-8"
+
+FORMATS = {
+    "csv": ("text/csv", (".csv",)),
+    "ndjson": ("application/x-ndjson", (".ndjson", ".jsonl")),
+}
+
+
+def detect_format(filename: str | None, content_type: str | None) -> str:
+    """
+    The detect_format function picks the import format from the extension of the file name,
+    falling back to its content type.
+
+    :param filename: str | None: Name of the uploaded file
+    :param content_type: str | None: Content type of the uploaded file
+    :return: csv or ndjson
+    :doc-author: Trelent
+    """
+    for name, (mime, extensions) in FORMATS.items():
+        if (filename or "").lower().endswith(extensions) or content_type == mime:
+            return name
+    raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Unsupported file format")
+
+
+def decode_lines(file: BinaryIO, invalid: list[int]) -> Iterator[str]:
+    """
+    The decode_lines function decodes the file line by line, so that bytes which are not UTF-8 only spoil
+    their own line: it is decoded with replacement characters and its number is appended to invalid.
+
+    :param file: BinaryIO: The uploaded file
+    :param invalid: list[int]: Receives the numbers of the lines that are not UTF-8
+    :return: An iterator of decoded lines, line endings included
+    :doc-author: Trelent
+    """
+    for number, line in enumerate(file, start=1):
+        if number == 1:
+            line = line.removeprefix(codecs.BOM_UTF8)
+        try:
+            yield line.decode("utf-8")
+        except UnicodeDecodeError:
+            invalid.append(number)
+            yield line.decode("utf-8", errors="replace")
+
+
+def read_rows(file: BinaryIO, fmt: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """
+    The read_rows function reads the file lazily, one record at a time.
+        CSV files need a header row with the ContactModel field names, NDJSON files hold one object per line.
+        Records that are not UTF-8 or not valid CSV or JSON are returned with the parse error.
+
+    :param file: BinaryIO: The uploaded file
+    :param fmt: str: csv or ndjson
+    :return: An iterator of (row number, record, parse error)
+    :doc-author: Trelent
+    """
+    invalid: list[int] = []
+    lines = decode_lines(file, invalid)
+    if fmt == "csv":
+        reader = csv.DictReader(lines, restkey="_extra")
+        number, last_line = 0, 0
+        while True:
+            try:
+                record, error = next(reader), None
+            except StopIteration:
+                return
+            except csv.Error as err:
+                record, error = None, f"Invalid CSV: {err}"
+            number += 1
+            # A record can span several lines; invalid only grows, its last entry is the latest bad line
+            if invalid and invalid[-1] > last_line:
+                record, error = None, INVALID_ENCODING
+            last_line = reader.line_num
+            yield number, record, error
+    for number, line in enumerate(lines, start=1):
+        if invalid and invalid[-1] == number:
+            yield number, None, INVALID_ENCODING
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except json.JSONDecodeError as err:
+            yield number, None, f"Invalid JSON: {err.msg}"
+
+
+def format_errors(err: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in err.errors())
+
+
+def next_batch(rows: Iterator[tuple[int, dict | None, str | None]], size: int) \
+        -> list[tuple[int, ContactModel | None, str | None]]:
+    """
+    The next_batch function reads up to size rows and validates them against ContactModel.
+        It is CPU bound (email validation dominates), so it runs in the thread pool.
+
+    :param rows: Iterator: Rows returned by read_rows
+    :param size: int: Maximum number of rows
+    :return: A list of (row number, contact, error), empty at the end of the file
+    :doc-author: Trelent
+    """
+    batch = []
+    for number, record, error in islice(rows, size):
+        if error is None:
+            try:
+                batch.append((number, ContactModel.model_validate(record), None))
+                continue
+            except ValidationError as err:
+                error = format_errors(err)
+        batch.append((number, None, error))
+    return batch
+
+
+async def import_contacts(file: BinaryIO, fmt: str, user: User, db: AsyncSession) -> dict:
+    """
+    The import_contacts function imports contacts from a CSV or NDJSON file in batches of
+    contacts_import_batch_size rows. Every batch is validated against ContactModel, checked for
+    existing emails with one query and inserted with one multi-row INSERT in its own transaction,
+    so memory use does not depend on the size of the file.
+        Rows that fail are reported with their row number, the first contacts_import_max_errors of them
+        with the reason.
+
+    :param file: BinaryIO: The uploaded file
+    :param fmt: str: csv or ndjson
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: A dictionary with the imported and failed counts and the errors
+    :doc-author: Trelent
+    """
+    result = {"imported": 0, "failed": 0, "errors": []}
+
+    def fail(number: int, detail: str):
+        result["failed"] += 1
+        if len(result["errors"]) < settings.contacts_import_max_errors:
+            result["errors"].append({"row": number, "detail": detail})
+
+    rows = read_rows(file, fmt)
+    while batch := await run_in_threadpool(next_batch, rows, settings.contacts_import_batch_size):
+        valid: dict[str, tuple[int, ContactModel]] = {}
+        for number, body, error in batch:
+            if error is not None:
+                fail(number, error)
+            elif body.email in valid:
+                fail(number, f"Duplicate email in row {valid[body.email][0]}")
+            else:
+                valid[body.email] = (number, body)
+
+        for email in await repository_contacts.get_existing_emails(list(valid), user, db):
+            fail(valid.pop(email)[0], "Email is existed!")
+        if valid:
+            bodies = [body for _, body in valid.values()]
+            result["imported"] += await repository_contacts.create_many(bodies, user, db)
+    return result
+
+
+def export_value(value):
+    # Birthdays are stored as datetimes, export them as dates so the file can be imported back
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def encode_rows(rows: Sequence[Row], fmt: str) -> bytes:
+    """
+    The encode_rows function serializes one batch of exported contacts.
+
+    :param rows: Sequence[Row]: Rows with the EXPORT_COLUMNS of the contacts repository
+    :param fmt: str: csv or ndjson
+    :return: The encoded batch
+    :doc-author: Trelent
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([export_value(value) for value in row] for row in rows)
+        return buffer.getvalue().encode()
+    return "".join(json.dumps({key: export_value(value) for key, value in row._mapping.items()}) + "\n"
+                   for row in rows).encode()
+
+
+async def export_contacts(fmt: str, compress: bool, user: User, db: AsyncSession) -> AsyncIterator[bytes]:
+    """
+    The export_contacts function streams all contacts of the user as CSV (with a header row) or NDJSON,
+    optionally gzip compressed. Contacts are read through a server-side cursor in batches of
+    contacts_export_batch_size rows and every batch is sent as soon as it is encoded,
+    so memory use does not depend on the number of contacts.
+
+    :param fmt: str: csv or ndjson
+    :param compress: bool: Compress the stream with gzip
+    :param user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: An async iterator of chunks of the file
+    :doc-author: Trelent
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def chunk(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor else data
+
+    if fmt == "csv":
+        yield chunk((",".join(column.key for column in repository_contacts.EXPORT_COLUMNS) + "\r\n").encode())
+    async for rows in repository_contacts.stream_contacts(settings.contacts_export_batch_size, user, db):
+        data = chunk(encode_rows(rows, fmt))
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
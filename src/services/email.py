@@ -1,25 +1,194 @@
+import asyncio
+import logging
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pydantic import EmailStr
 
 from src.services.auth import auth_service
 from src.conf.config import settings
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=EmailStr(settings.mail_from),
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Contacts App",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
+logger = logging.getLogger(__name__)
+
+templates = Environment(
+    loader=FileSystemLoader(Path(__file__).parent / 'templates'),
+    autoescape=select_autoescape(['html']),
 )
+# Compiled once at import time, every message only renders it.
+confirmation_template = templates.get_template('email_template.html')
+
+
+class MailDispatcher:
+    """
+    Sends queued messages over a small pool of persistent, authenticated SMTP connections.
+
+    Each of the pool_size workers owns one connection, takes up to batch_size queued messages at a time
+    and sends them one after another over that connection, so a burst of signups costs one TLS handshake
+    and login per worker instead of one per message. A failed message is retried with exponential backoff
+    on a fresh connection, up to max_retries times.
+    """
+
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = True, start_tls: bool = False, validate_certs: bool = True, pool_size: int = 2,
+                 batch_size: int = 20, max_retries: int = 3, retry_backoff: float = 1.0):
+        self.smtp_options = dict(hostname=hostname, port=port, username=username, password=password,
+                                 use_tls=use_tls, start_tls=start_tls, validate_certs=validate_certs)
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "connections": 0}
+
+    def start(self) -> None:
+        """
+        The start function creates the queue and the worker tasks on the running event loop.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._workers:
+            return
+        self.queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.pool_size)]
+
+    async def stop(self) -> None:
+        """
+        The stop function waits until the queued messages are sent, then stops the workers
+        and closes their connections.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if not self._workers:
+            return
+        await self.queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(self, message: EmailMessage) -> None:
+        """
+        The enqueue function queues the message for delivery and returns immediately.
+
+        :param self: Represent the instance of the class
+        :param message: EmailMessage: The message to send
+        :return: None
+        :doc-author: Trelent
+        """
+        self.start()
+        await self.queue.put((message, None))
+
+    async def send(self, message: EmailMessage) -> None:
+        """
+        The send function queues the message and waits until it is delivered over a pooled connection.
+        The last delivery error is raised when the message could not be sent after max_retries retries.
+
+        :param self: Represent the instance of the class
+        :param message: EmailMessage: The message to send
+        :return: None
+        :doc-author: Trelent
+        """
+        self.start()
+        delivered = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, delivered))
+        await delivered
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(**self.smtp_options)
+        await smtp.connect()
+        self.stats["connections"] += 1
+        return smtp
+
+    async def _deliver(self, smtp: aiosmtplib.SMTP | None, message: EmailMessage,
+                       delivered: asyncio.Future | None = None) -> aiosmtplib.SMTP | None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await self._connect()
+                await smtp.send_message(message)
+                self.stats["sent"] += 1
+                if delivered is not None and not delivered.done():
+                    delivered.set_result(None)
+                return smtp
+            except (aiosmtplib.SMTPException, OSError) as err:
+                if smtp is not None:
+                    smtp.close()
+                smtp = None
+                if attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    logger.error("Sending email to %s failed: %s", message["To"], err)
+                    if delivered is not None and not delivered.done():
+                        delivered.set_exception(err)
+                    return None
+                self.stats["retries"] += 1
+                logger.warning("Sending email to %s failed, retry %d: %s", message["To"], attempt + 1, err)
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            except Exception as err:
+                # A message that cannot be built or sent, such as a missing From header: retrying cannot help,
+                # and the worker must go on with the other messages
+                self.stats["failed"] += 1
+                logger.exception("Sending email to %s failed: %s", message["To"], err)
+                if delivered is not None and not delivered.done():
+                    delivered.set_exception(err)
+                return smtp
+
+    async def _worker(self) -> None:
+        smtp = None
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                for message, delivered in batch:
+                    try:
+                        smtp = await self._deliver(smtp, message, delivered)
+                    finally:
+                        self.queue.task_done()
+        finally:
+            if smtp is not None and smtp.is_connected:
+                smtp.close()
+
+
+mail_dispatcher = MailDispatcher(
+    hostname=settings.mail_server,
+    port=settings.mail_port,
+    username=settings.mail_username,
+    password=settings.mail_password,
+    use_tls=settings.mail_ssl_tls,
+    start_tls=settings.mail_starttls,
+    pool_size=settings.mail_pool_size,
+    batch_size=settings.mail_batch_size,
+    max_retries=settings.mail_max_retries,
+    retry_backoff=settings.mail_retry_backoff,
+)
+
+
+def build_confirmation_email(email: EmailStr, username: str, host: str) -> EmailMessage:
+    """
+    The build_confirmation_email function renders the confirmation email for the user.
+
+    :param email: EmailStr: The user's email address
+    :param username: str: The username used in the greeting
+    :param host: str: Base url of the application, used in the confirmation link
+    :return: The message
+    :doc-author: Trelent
+    """
+    token_verification = auth_service.create_email_token({"sub": email})
+    message = EmailMessage()
+    message["Subject"] = "Confirm your email "
+    message["From"] = formataddr(("Contacts App", settings.mail_from))
+    message["To"] = email
+    message.set_content(confirmation_template.render(host=host, username=username, token=token_verification),
+                        subtype="html")
+    return message
 
 
 async def send_email(email: EmailStr, username: str, host: str):
@@ -29,23 +198,13 @@ async def send_email(email: EmailStr, username: str, host: str):
             -email: EmailStr, the user's email address.
             -username: str, the username of the user who is registering for an account.  This will be used in a greeting message within the body of the email sent to them.
             -host: str, this is where we are hosting our application (i.e., localhost).  This will be used as part of a URL that they can click on within their browser.
+        The message is delivered by mail_dispatcher over a pooled SMTP connection, the function returns
+        once it was accepted by the server and raises if it could not be delivered.
 
     :param email: EmailStr: Validate the email address
     :param username: str: Pass the username of the user to be used in the email template
     :param host: str: Pass the hostname of the server to the template
-    :return: A coroutine that can be awaited
+    :return: None
     :doc-author: Trelent
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    await mail_dispatcher.send(build_confirmation_email(email, username, str(host)))
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict, Counter, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+import redis.asyncio as redis
+
+from src.conf.config import settings
+from src.database.db import DBSession
+from src.database.redis_pool import redis_pool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Task:
+    name: str
+    fn: Callable[..., Awaitable[Any]]
+    db: bool = False
+    concurrency: int | None = None
+    on_dead: Callable[..., Awaitable[Any]] | None = None
+
+
+TASKS: dict[str, Task] = {}
+
+
+def task(name: str, db: bool = False, concurrency: int | None = None,
+         on_dead: Callable[..., Awaitable[Any]] | None = None):
+    """
+    The task decorator registers a coroutine function as a job handler under name.
+    Handlers are called with the keyword arguments given to enqueue.
+
+    :param name: str: Name used to enqueue the job
+    :param db: bool: Pass a database session to the handler as the db argument
+    :param concurrency: int | None: At most this many jobs of the task run at the same time in a worker
+    :param on_dead: Coroutine called with the job and the error when the job is moved to the dead-letter queue
+    :return: The decorator
+    :doc-author: Trelent
+    """
+    def decorator(fn):
+        TASKS[name] = Task(name, fn, db, concurrency, on_dead)
+        return fn
+    return decorator
+
+
+def new_job(name: str, kwargs: dict) -> dict:
+    return {"id": uuid.uuid4().hex, "task": name, "kwargs": kwargs, "attempts": 0, "enqueued_at": time.time()}
+
+
+class MemoryJobQueue:
+    """
+    In-process job queue with the same interface as RedisJobQueue.
+
+    Jobs are lost on restart and only seen by workers of the same process; it is meant for tests
+    and single-process development, where main.py runs the worker next to the application.
+    """
+
+    def __init__(self, status_maxsize: int = 1000, dead_maxsize: int = 1000):
+        self.pending: deque[dict] = deque()
+        self.delayed: list[tuple[float, dict]] = []
+        self.processing: dict[str, dict] = {}
+        self.dead: deque[dict] = deque(maxlen=dead_maxsize)
+        self.stats = Counter()
+        self.status_maxsize = status_maxsize
+        self._status: OrderedDict[str, dict] = OrderedDict()
+
+    async def enqueue(self, name: str, **kwargs) -> str:
+        """
+        The enqueue function adds a job for the task name with the given keyword arguments.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of a registered task
+        :param kwargs: Arguments of the task, must be serializable to JSON
+        :return: The job id
+        :doc-author: Trelent
+        """
+        job = new_job(name, kwargs)
+        self.pending.append(job)
+        self.stats["enqueued"] += 1
+        return job["id"]
+
+    async def reserve(self) -> dict | None:
+        now = time.time()
+        for item in [item for item in self.delayed if item[0] <= now]:
+            self.delayed.remove(item)
+            self.pending.append(item[1])
+        if not self.pending:
+            return None
+        job = self.pending.popleft()
+        self.processing[job["id"]] = job
+        return job
+
+    async def ack(self, job: dict) -> None:
+        self.processing.pop(job["id"], None)
+
+    async def retry(self, job: dict, delay: float) -> None:
+        self.processing.pop(job["id"], None)
+        self.delayed.append((time.time() + delay, job))
+
+    async def dead_letter(self, job: dict, error: str) -> None:
+        self.processing.pop(job["id"], None)
+        self.dead.append(dict(job, error=error))
+
+    async def incr(self, name: str) -> None:
+        self.stats[name] += 1
+
+    async def set_status(self, job_id: str, status: dict) -> None:
+        self._status[job_id] = status
+        self._status.move_to_end(job_id)
+        while len(self._status) > self.status_maxsize:
+            self._status.popitem(last=False)
+
+    async def get_status(self, job_id: str) -> dict | None:
+        return self._status.get(job_id)
+
+    async def metrics(self) -> dict:
+        """
+        The metrics function returns the queue depth and the job counters.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with pending, delayed, processing and dead job counts and the counters
+        :doc-author: Trelent
+        """
+        return {"pending": len(self.pending), "delayed": len(self.delayed), "processing": len(self.processing),
+                "dead": len(self.dead), "stats": dict(self.stats)}
+
+
+# Moves due retries and jobs whose worker did not ack them in time back to pending,
+# then moves the oldest pending job to processing with a new visibility deadline.
+RESERVE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, id in ipairs(due) do
+    redis.call('ZREM', KEYS[3], id)
+    redis.call('LPUSH', KEYS[1], id)
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('RPUSH', KEYS[1], id)
+end
+local id = redis.call('RPOP', KEYS[1])
+if not id then
+    return nil
+end
+redis.call('ZADD', KEYS[2], ARGV[2], id)
+return redis.call('HGET', KEYS[4], id)
+"""
+
+
+class RedisJobQueue:
+    """
+    Durable job queue shared by the application and any number of worker processes.
+
+    Job bodies live in a hash, pending job ids in a list, and reserved job ids in a sorted set scored
+    by their visibility deadline: a job that is not acknowledged within visibility_timeout seconds,
+    because its worker died, is handed to another worker. Delivery is therefore at least once.
+    Retries wait in a sorted set scored by the time they become due; failed jobs end up in a capped
+    dead-letter list. create_job_queue attaches the queue to redis_pool, which hands it the client.
+    """
+
+    def __init__(self, client: redis.Redis | None = None, prefix: str = "jobs", visibility_timeout: float = 300,
+                 status_ttl: int = 86400, dead_maxsize: int = 1000):
+        self.visibility_timeout = visibility_timeout
+        self.status_ttl = status_ttl
+        self.dead_maxsize = dead_maxsize
+        self.keys = {name: f"{prefix}:{name}" for name in ("pending", "processing", "delayed", "data", "dead", "stats")}
+        self.prefix = prefix
+        self.set_redis(client)
+
+    def set_redis(self, client: redis.Redis | None) -> None:
+        self.redis = client
+        self._reserve = client.register_script(RESERVE_SCRIPT) if client is not None else None
+
+    async def enqueue(self, name: str, **kwargs) -> str:
+        """
+        The enqueue function stores a job for the task name with the given keyword arguments.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of a registered task
+        :param kwargs: Arguments of the task, must be serializable to JSON
+        :return: The job id
+        :doc-author: Trelent
+        """
+        job = new_job(name, kwargs)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.keys["data"], job["id"], json.dumps(job))
+            pipe.lpush(self.keys["pending"], job["id"])
+            pipe.hincrby(self.keys["stats"], "enqueued", 1)
+            await pipe.execute()
+        return job["id"]
+
+    async def reserve(self) -> dict | None:
+        now = time.time()
+        raw = await self._reserve(keys=[self.keys["pending"], self.keys["processing"], self.keys["delayed"],
+                                        self.keys["data"]],
+                                  args=[now, now + self.visibility_timeout])
+        return json.loads(raw) if raw else None
+
+    async def ack(self, job: dict) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.keys["processing"], job["id"])
+            pipe.hdel(self.keys["data"], job["id"])
+            await pipe.execute()
+
+    async def retry(self, job: dict, delay: float) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.keys["data"], job["id"], json.dumps(job))
+            pipe.zrem(self.keys["processing"], job["id"])
+            pipe.zadd(self.keys["delayed"], {job["id"]: time.time() + delay})
+            await pipe.execute()
+
+    async def dead_letter(self, job: dict, error: str) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.keys["processing"], job["id"])
+            pipe.hdel(self.keys["data"], job["id"])
+            pipe.lpush(self.keys["dead"], json.dumps(dict(job, error=error)))
+            pipe.ltrim(self.keys["dead"], 0, self.dead_maxsize - 1)
+            await pipe.execute()
+
+    async def incr(self, name: str) -> None:
+        await self.redis.hincrby(self.keys["stats"], name, 1)
+
+    async def set_status(self, job_id: str, status: dict) -> None:
+        await self.redis.set(f"{self.prefix}:status:{job_id}", json.dumps(status), ex=self.status_ttl)
+
+    async def get_status(self, job_id: str) -> dict | None:
+        raw = await self.redis.get(f"{self.prefix}:status:{job_id}")
+        return json.loads(raw) if raw else None
+
+    async def metrics(self) -> dict:
+        """
+        The metrics function returns the queue depth and the job counters.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with pending, delayed, processing and dead job counts and the counters
+        :doc-author: Trelent
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.llen(self.keys["pending"])
+            pipe.zcard(self.keys["delayed"])
+            pipe.zcard(self.keys["processing"])
+            pipe.llen(self.keys["dead"])
+            pipe.hgetall(self.keys["stats"])
+            pending, delayed, processing, dead, stats = await pipe.execute()
+        return {"pending": pending, "delayed": delayed, "processing": processing, "dead": dead,
+                "stats": {key.decode(): int(value) for key, value in stats.items()}}
+
+
+class Worker:
+    """
+    Runs jobs from a queue with at most concurrency jobs in flight.
+
+    A job whose handler raises is retried after retry_backoff * 2 ** attempts seconds; after max_retries
+    retries it is moved to the dead-letter queue and the on_dead hook of its task is called.
+    """
+
+    def __init__(self, queue, concurrency: int = 4, max_retries: int = 3, retry_backoff: float = 5.0,
+                 poll_interval: float = 0.5, session_factory=DBSession):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.session_factory = session_factory
+        self._limits: dict[str, asyncio.Semaphore] = {}
+        self._stopping = False
+        self._consumers: list[asyncio.Task] = []
+
+    async def _call(self, task: Task, kwargs: dict):
+        if task.db:
+            async with self.session_factory() as db:
+                return await task.fn(db=db, **kwargs)
+        return await task.fn(**kwargs)
+
+    async def process(self, job: dict) -> None:
+        """
+        The process function runs one reserved job and acknowledges, retries or dead-letters it.
+
+        :param self: Represent the instance of the class
+        :param job: dict: The job returned by the queue
+        :return: None
+        :doc-author: Trelent
+        """
+        task = TASKS.get(job["task"])
+        if task is None:
+            await self.queue.dead_letter(job, f"Unknown task {job['task']}")
+            await self.queue.incr("dead")
+            return
+        limit = None
+        if task.concurrency:
+            limit = self._limits.setdefault(task.name, asyncio.Semaphore(task.concurrency))
+            await limit.acquire()
+        try:
+            await self._call(task, job["kwargs"])
+        except Exception as err:
+            job["attempts"] += 1
+            if job["attempts"] > self.max_retries:
+                logger.error("Job %s (%s) failed permanently: %r", job["id"], job["task"], err)
+                await self.queue.dead_letter(job, repr(err))
+                await self.queue.incr("dead")
+                if task.on_dead is not None:
+                    await task.on_dead(job, err)
+            else:
+                logger.warning("Job %s (%s) failed, retry %d: %r", job["id"], job["task"], job["attempts"], err)
+                await self.queue.retry(job, self.retry_backoff * 2 ** (job["attempts"] - 1))
+                await self.queue.incr("retried")
+        else:
+            await self.queue.ack(job)
+            await self.queue.incr("done")
+        finally:
+            if limit is not None:
+                limit.release()
+
+    async def _consume(self) -> None:
+        while not self._stopping:
+            try:
+                job = await self.queue.reserve()
+            except Exception as err:
+                logger.error("Reserving a job failed: %r", err)
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await self.process(job)
+            except Exception as err:
+                # The queue failed to ack, retry or dead-letter the job, or on_dead raised: the job stays
+                # reserved and the visibility timeout redelivers it, this consumer goes on
+                logger.error("Processing job %s (%s) failed: %r", job["id"], job["task"], err)
+
+    async def run(self) -> None:
+        """
+        The run function processes jobs until stop is called, then waits for the jobs in flight.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self._stopping = False
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        await asyncio.gather(*self._consumers)
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    async def drain(self) -> int:
+        """
+        The drain function processes the jobs that are ready now and returns when none is left.
+
+        :param self: Represent the instance of the class
+        :return: The number of processed jobs
+        :doc-author: Trelent
+        """
+        processed = 0
+        while (job := await self.queue.reserve()) is not None:
+            await self.process(job)
+            processed += 1
+        return processed
+
+
+def create_job_queue():
+    """
+    The create_job_queue function returns the queue selected by the job_queue_backend setting.
+
+    :return: A RedisJobQueue or a MemoryJobQueue
+    :doc-author: Trelent
+    """
+    if settings.job_queue_backend == "memory":
+        return MemoryJobQueue()
+    queue = RedisJobQueue(visibility_timeout=settings.job_visibility_timeout)
+    redis_pool.attach(queue)
+    return queue
+
+
+def create_worker(queue) -> Worker:
+    return Worker(queue, concurrency=settings.job_worker_concurrency, max_retries=settings.job_max_retries,
+                  retry_backoff=settings.job_retry_backoff)
+
+
+job_queue = create_job_queue()
@@ -0,0 +1,171 @@
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets: request latency in seconds and database queries per request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Time spent in the dependencies by the current request: {"db": [calls, seconds], "redis": ..., "bcrypt": ...}.
+# custom_middleware in main.py sets it for every request; outside of requests nothing is recorded.
+request_timings: ContextVar[dict[str, list] | None] = ContextVar("request_timings", default=None)
+
+
+def record(dependency: str, seconds: float) -> None:
+    timings = request_timings.get()
+    if timings is not None:
+        totals = timings.setdefault(dependency, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    The instrument_engine function records the number and the duration of the queries of engine
+    for the request that runs them.
+
+    :param engine: Engine: A sync engine, engine.sync_engine for an async one
+    :return: None
+    :doc-author: Trelent
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record("db", time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # A failed statement gets no after_cursor_execute: its start must not stay on the pooled connection
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            record("db", time.perf_counter() - started.pop())
+
+
+ESCAPES = str.maketrans({"\\": r"\\", '"': r"\"", "\n": r"\n"})
+
+
+def _labels(names: tuple[str, ...], values: tuple, le: float | str | None = None) -> str:
+    pairs = [f'{name}="{str(value).translate(ESCAPES)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple, value: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.series.items():
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...], buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # Per label values: observations per bucket (not cumulative), sum and count
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, observations in zip(self.buckets, counts):
+                cumulative += observations
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labels, labels, '+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class RequestMetrics:
+    """
+    Per-route request metrics in the Prometheus text format.
+
+    Routes are labelled with their path template, so /api/contacts/{contact_id} is one series
+    however many contacts there are; requests that match no route are labelled unmatched.
+    """
+
+    def __init__(self):
+        self.duration = Histogram("http_request_duration_seconds", "Time until the response headers are sent.",
+                                  ("method", "route", "status"))
+        self.db_queries = Histogram("http_request_db_queries", "Database queries per request.",
+                                    ("method", "route"), QUERY_BUCKETS)
+        self.dependency_calls = Counter("http_request_dependency_calls_total",
+                                        "Database queries, Redis replies and bcrypt operations of requests.",
+                                        ("method", "route", "dependency"))
+        self.dependency_seconds = Counter("http_request_dependency_seconds_total",
+                                          "Time spent in the database, Redis and bcrypt by requests.",
+                                          ("method", "route", "dependency"))
+
+    def observe(self, method: str, route: str, status: int, seconds: float, timings: dict[str, list]) -> None:
+        """
+        The observe function adds a finished request to the metrics.
+
+        :param self: Represent the instance of the class
+        :param method: str: HTTP method
+        :param route: str: Path template of the route
+        :param status: int: Status code of the response
+        :param seconds: float: Duration of the request
+        :param timings: dict[str, list]: Calls and seconds per dependency, see request_timings
+        :return: None
+        :doc-author: Trelent
+        """
+        self.duration.observe((method, route, status), seconds)
+        self.db_queries.observe((method, route), timings.get("db", (0, 0.0))[0])
+        for dependency, (calls, spent) in timings.items():
+            self.dependency_calls.inc((method, route, dependency), calls)
+            self.dependency_seconds.inc((method, route, dependency), spent)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.duration, self.db_queries, self.dependency_calls, self.dependency_seconds):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def server_timing(timings: dict[str, list], total: float) -> str:
+    """
+    The server_timing function formats the timings of a request as a Server-Timing header,
+    durations in milliseconds as the header requires.
+
+    :param timings: dict[str, list]: Calls and seconds per dependency, see request_timings
+    :param total: float: Duration of the request in seconds
+    :return: The header value, for example db;dur=3.1;desc="2 calls", total;dur=5.4
+    :doc-author: Trelent
+    """
+    metrics = [f'{dependency};dur={spent * 1000:.2f};desc="{calls} calls"'
+               for dependency, (calls, spent) in timings.items()]
+    metrics.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(metrics)
+
+
+request_metrics = RequestMetrics()
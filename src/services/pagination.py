@@ -0,0 +1,54 @@
+import base64
+import json
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(sort_by: str, values: list) -> str:
+    """
+    The encode_cursor function packs the sort key and the sort values of the last row of a page
+    into an opaque url-safe token.
+
+    :param sort_by: str: Name of the sort key the page was ordered by
+    :param values: list: Values of the sort columns of the last row
+    :return: An opaque cursor token
+    :doc-author: Trelent
+    """
+    raw = json.dumps([sort_by, values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str, sort_columns: dict) -> tuple[str, list]:
+    """
+    The decode_cursor function unpacks a token made by encode_cursor and checks it against sort_columns:
+    the sort key must be one of its keys and every value must have the type of its column, or be None
+    if the column is nullable. The token comes from the client, so nothing unchecked reaches the query.
+    If the token is malformed, it raises an HTTPException with status code 400.
+
+    :param token: str: The cursor token received from the client
+    :param sort_columns: dict: Columns of every sort key, for example SORT_COLUMNS of the contacts repository
+    :return: The sort key and the sort values of the last row of the previous page
+    :doc-author: Trelent
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        sort_by, values = json.loads(raw)
+        if not isinstance(sort_by, str) or not isinstance(values, list):
+            raise ValueError(token)
+        columns = sort_columns.get(sort_by)
+        if columns is None or len(values) != len(columns):
+            raise ValueError(token)
+        for column, value in zip(columns, values):
+            if not _matches(column, value):
+                raise ValueError(token)
+        return sort_by, values
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _matches(column, value) -> bool:
+    if value is None:
+        return column.expression.nullable
+    python_type = column.type.python_type
+    # bool is an int to isinstance, but JSON true is not an id
+    return isinstance(value, python_type) and not (isinstance(value, bool) and python_type is not bool)
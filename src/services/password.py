@@ -0,0 +1,104 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from src.conf.config import settings
+from src.services.metrics import record
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification in a bounded thread pool, off the event loop.
+
+    bcrypt releases the GIL while it works, so threads give real parallelism here without
+    the pickling overhead of a process pool. At most workers operations run at the same time;
+    when max_pending operations are already running or waiting, new ones are rejected with 503.
+    """
+
+    def __init__(self, rounds: int, workers: int, max_pending: int):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many concurrent password operations")
+
+        def job():
+            started = time.perf_counter()
+            return started, fn(*args), time.perf_counter()
+
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            started, result, finished = await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.wait_time += started - submitted
+        self.run_time += finished - started
+        record("bcrypt", finished - submitted)
+        return result
+
+    async def hash(self, password: str) -> str:
+        """
+        The hash function returns the bcrypt hash of the password, computed in the worker pool.
+
+        :param self: Represent the instance of the class
+        :param password: str: The plain-text password
+        :return: The password hash
+        :doc-author: Trelent
+        """
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        The verify_and_update function checks the password against its hash in the worker pool.
+        If the password is valid but the hash was made with other settings (e.g. another bcrypt cost),
+        a new hash made with the current settings is returned as well, so the caller can store it.
+
+        :param self: Represent the instance of the class
+        :param password: str: The plain-text password
+        :param hashed_password: str: The stored hash
+        :return: A tuple of the verification result and the new hash or None
+        :doc-author: Trelent
+        """
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the queue metrics of the worker pool.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the pool size, running, queued, completed and rejected operations
+            and the average wait and run time in milliseconds
+        :doc-author: Trelent
+        """
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "running": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": self.wait_time / self.completed * 1000 if self.completed else 0.0,
+            "avg_run_ms": self.run_time / self.completed * 1000 if self.completed else 0.0,
+        }
+
+
+password_hasher = PasswordHasher(
+    rounds=settings.bcrypt_rounds,
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
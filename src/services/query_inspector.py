@@ -0,0 +1,255 @@
+import json
+import logging
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Placeholder lists such as IN (?, ?, ?) or VALUES ($1, $2) count as one shape whatever their length
+PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%s|\$\d+|:\w+|%\(\w+\)s)(?:\s*,\s*(?:\?|%s|\$\d+|:\w+|%\(\w+\)s))*\s*\)")
+NUMBERED_PLACEHOLDER = re.compile(r"\$\d+")
+SQLITE_SCAN = re.compile(r"^SCAN (\w+)$")
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE")
+
+
+def statement_shape(statement: str) -> str:
+    """
+    The statement_shape function normalizes a statement so that the executions of the same query
+    with other parameters, or with longer IN lists, compare equal.
+
+    :param statement: str: SQL as sent to the driver
+    :return: The normalized statement
+    :doc-author: Trelent
+    """
+    shape = " ".join(statement.split())
+    shape = NUMBERED_PLACEHOLDER.sub("?", shape)
+    return PLACEHOLDER_LIST.sub("(?)", shape)
+
+
+@dataclass
+class QueryRecord:
+    statement: str
+    shape: str
+    seconds: float
+    scans: list[str] = field(default_factory=list)
+
+
+@dataclass
+class QueryLog:
+    queries: list[QueryRecord] = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for query in self.queries:
+            counts[query.shape] = counts.get(query.shape, 0) + 1
+        return {shape: count for shape, count in counts.items() if count >= threshold}
+
+    def slow(self, threshold: float) -> list[QueryRecord]:
+        return [query for query in self.queries if query.seconds >= threshold]
+
+    def scans(self) -> list[QueryRecord]:
+        return [query for query in self.queries if query.scans]
+
+    def findings(self, repeat_threshold: int, slow_threshold: float) -> list[str]:
+        """
+        The findings function describes what is suspicious in the log: statements repeated
+        repeat_threshold times or more (an N+1 pattern), statements slower than slow_threshold seconds
+        and statements whose plan scans a whole table.
+
+        :param self: Represent the instance of the class
+        :param repeat_threshold: int: Executions of one shape that are reported
+        :param slow_threshold: float: Duration in seconds from which a statement is reported
+        :return: A list of messages, empty if nothing was found
+        :doc-author: Trelent
+        """
+        findings = [f"{count} x {shape}" for shape, count in self.repeated(repeat_threshold).items()]
+        findings += [f"slow {query.seconds * 1000:.1f} ms: {query.shape}" for query in self.slow(slow_threshold)]
+        seen = set()
+        for query in self.scans():
+            if query.shape not in seen:
+                seen.add(query.shape)
+                findings.append(f"full scan of {', '.join(query.scans)}: {query.shape}")
+        return findings
+
+    def report(self) -> str:
+        return "\n".join(f"{query.seconds * 1000:8.2f} ms  {query.shape}" for query in self.queries)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryInspector:
+    """
+    Development and test mode that records the statements run by a request or by a block of code.
+
+    Statement shapes are explained once per process (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL)
+    to find full table scans. Recording only happens while a log is active: a request when the
+    query_inspector setting is on, or a capture() / budget() block, which sees the statements of every
+    thread so that tests can wrap TestClient calls.
+    """
+
+    def __init__(self, enabled: bool, slow_ms: float, repeat_threshold: int, explain: bool = True):
+        self.enabled = enabled
+        self.slow_threshold = slow_ms / 1000
+        self.repeat_threshold = repeat_threshold
+        self.explain = explain
+        self.plans: dict[str, list[str]] = {}
+        self.captures: list[QueryLog] = []
+        self.current: ContextVar[QueryLog | None] = ContextVar("query_log", default=None)
+
+    def inspect_engine(self, engine: Engine) -> None:
+        """
+        The inspect_engine function records the statements of engine in the active logs.
+
+        :param self: Represent the instance of the class
+        :param engine: Engine: A sync engine, engine.sync_engine for an async one
+        :return: None
+        :doc-author: Trelent
+        """
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("inspected_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            seconds = time.perf_counter() - conn.info["inspected_started"].pop()
+            request_log = self.current.get()
+            if request_log is None and not self.captures:
+                return
+            shape = statement_shape(statement)
+            scans = self._scans(conn, shape, statement, parameters, executemany)
+            query = QueryRecord(statement, shape, seconds, scans)
+            for log in ([request_log] if request_log is not None else []) + self.captures:
+                log.queries.append(query)
+
+        @event.listens_for(engine, "handle_error")
+        def _handle_error(context):
+            # A failed statement gets no after_cursor_execute: its start must not stay on the pooled connection
+            started = context.connection.info.get("inspected_started") if context.connection is not None else None
+            if started:
+                started.pop()
+
+    def _scans(self, conn, shape: str, statement: str, parameters, executemany: bool) -> list[str]:
+        scans = self.plans.get(shape)
+        if scans is None:
+            scans = []
+            if self.explain and not executemany and shape.split(" ", 1)[0].upper() in EXPLAINABLE:
+                try:
+                    scans = explain_scans(conn, statement, parameters)
+                except Exception as err:
+                    logger.warning("EXPLAIN failed for %s: %s", shape, err)
+            self.plans[shape] = scans
+        return scans
+
+    def start_request(self) -> QueryLog | None:
+        if not self.enabled:
+            return None
+        log = QueryLog()
+        self.current.set(log)
+        return log
+
+    def finish_request(self, log: QueryLog | None, name: str) -> None:
+        if log is None:
+            return
+        self.current.set(None)
+        findings = log.findings(self.repeat_threshold, self.slow_threshold)
+        if findings:
+            logger.warning("%s ran %d queries:\n  %s", name, len(log), "\n  ".join(findings))
+
+    @contextmanager
+    def capture(self) -> Iterator[QueryLog]:
+        log = QueryLog()
+        self.captures.append(log)
+        try:
+            yield log
+        finally:
+            self.captures.remove(log)
+
+    @contextmanager
+    def budget(self, max_queries: int) -> Iterator[QueryLog]:
+        """
+        The budget function fails the block when it runs more than max_queries statements,
+        for example a test request to a route:
+
+            with query_inspector.budget(3):
+                client.get("/api/contacts/1", headers=headers)
+
+        :param self: Represent the instance of the class
+        :param max_queries: int: The number of statements allowed
+        :return: The log of the block
+        :doc-author: Trelent
+        """
+        with self.capture() as log:
+            yield log
+        if len(log) > max_queries:
+            raise QueryBudgetExceeded(f"{len(log)} queries, the budget is {max_queries}:\n{log.report()}")
+
+
+def explain_scans(conn, statement: str, parameters) -> list[str]:
+    """
+    The explain_scans function asks the database for the plan of statement and returns the tables
+    it reads completely. It uses a cursor of its own, the results of the explained statement are not touched.
+    On PostgreSQL the EXPLAIN runs under a savepoint, so when it fails the transaction of the request goes on.
+
+    :param conn: Connection: The connection that ran the statement
+    :param statement: str: SQL as sent to the driver
+    :param parameters: The parameters of the statement
+    :return: The names of the scanned tables
+    :doc-author: Trelent
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        rows = _run(conn, "EXPLAIN QUERY PLAN " + statement, parameters)
+        return [match.group(1) for *_, detail in rows if (match := SQLITE_SCAN.match(detail))]
+    if dialect == "postgresql":
+        rows = _run(conn, "EXPLAIN (FORMAT JSON) " + statement, parameters, savepoint=True)
+        plan = rows[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return list(_seq_scans(plan[0]["Plan"]))
+    return []
+
+
+def _run(conn, statement: str, parameters, savepoint: bool = False) -> list:
+    # A failed statement aborts the whole transaction on PostgreSQL, SQLite only fails the statement
+    cursor = conn.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT query_inspector_explain")
+        try:
+            cursor.execute(statement, parameters)
+            rows = cursor.fetchall()
+        except Exception:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT query_inspector_explain")
+            raise
+        finally:
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT query_inspector_explain")
+        return rows
+    finally:
+        cursor.close()
+
+
+def _seq_scans(plan: dict) -> Iterator[str]:
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from _seq_scans(child)
+
+
+query_inspector = QueryInspector(settings.query_inspector, settings.query_slow_ms, settings.query_repeat_threshold,
+                                 settings.query_explain)
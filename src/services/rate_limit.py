@@ -0,0 +1,232 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import redis.asyncio as redis
+from fastapi import Depends, HTTPException, Request, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.models import User
+from src.database.redis_pool import redis_pool
+from src.services.auth import auth_service
+
+logger = logging.getLogger(__name__)
+
+# Token buckets: a bucket holds up to limit tokens and refills at limit / period tokens per second,
+# every request takes one token. All buckets of a request are refilled, checked and, only if every
+# one of them has a token left, drawn from in a single round-trip. Redis time is used so that
+# workers with skewed clocks share the same buckets.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2 - 1])
+    local period = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local level = tonumber(bucket[1]) or limit
+    local ts = tonumber(bucket[2]) or now
+    tokens[i] = math.min(limit, level + math.max(now - ts, 0) * limit / period)
+    if tokens[i] < 1 then
+        allowed = 0
+    end
+end
+local result = {allowed}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2 - 1])
+    local period = tonumber(ARGV[i * 2])
+    if allowed == 1 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(period * 1000))
+    table.insert(result, tostring(tokens[i]))
+end
+return result
+"""
+
+
+def parse_policy(policy: str) -> tuple[int, float]:
+    """
+    The parse_policy function reads a policy of the rate_limits setting, written as times/seconds.
+
+    :param policy: str: For example 2/5 for two requests every five seconds
+    :return: The number of requests and the period in seconds
+    :doc-author: Trelent
+    """
+    times, seconds = policy.split("/")
+    times, seconds = int(times), float(seconds)
+    if times < 1 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit policy {policy}")
+    return times, seconds
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: float
+    retry_after: float
+
+    @classmethod
+    def from_tokens(cls, allowed: bool, buckets: list[tuple[int, float]], tokens: list[float]) -> "RateLimitResult":
+        # The bucket with the fewest tokens left is the one that limits the client, it is the one reported
+        (limit, period), level = min(zip(buckets, tokens), key=lambda bucket: bucket[1])
+        rate = limit / period
+        return cls(allowed, limit, max(int(level), 0), (limit - level) / rate, 0 if allowed else (1 - level) / rate)
+
+    def headers(self) -> dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(int(self.reset + 0.999)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(int(self.retry_after + 0.999))
+        return headers
+
+
+class LocalBuckets:
+    """
+    In-process token buckets with the same algorithm as TOKEN_BUCKET_SCRIPT.
+
+    They are used while Redis is unavailable. Every worker then counts on its own, so a client
+    may get up to the number of workers times its limit until Redis is back.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def hit(self, keys: list[str], buckets: list[tuple[int, float]]) -> RateLimitResult:
+        """
+        The hit function refills the buckets of keys and takes a token from each of them
+        if every one has a token left.
+
+        :param self: Represent the instance of the class
+        :param keys: list[str]: Keys of the buckets
+        :param buckets: list[tuple[int, float]]: Limit and period of every bucket
+        :return: The outcome for the most exhausted bucket
+        :doc-author: Trelent
+        """
+        now = time.monotonic()
+        tokens = []
+        for key, (limit, period) in zip(keys, buckets):
+            level, ts = self._buckets.get(key, (limit, now))
+            tokens.append(min(limit, level + (now - ts) * limit / period))
+        allowed = all(level >= 1 for level in tokens)
+        if allowed:
+            tokens = [level - 1 for level in tokens]
+        for key, level in zip(keys, tokens):
+            self._buckets[key] = (level, now)
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return RateLimitResult.from_tokens(allowed, buckets, tokens)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by all workers through Redis, with LocalBuckets as fallback.
+
+    Policies are named in the rate_limits setting. When Redis fails the limiter switches to the local
+    buckets and tries Redis again after retry_after seconds, so an outage costs one failed call
+    per worker and interval instead of one per request.
+    """
+
+    def __init__(self, policies: dict[str, str], redis_client: redis.Redis | None = None, retry_after: float = 5.0,
+                 prefix: str = "ratelimit"):
+        self.policies = {name: parse_policy(policy) for name, policy in policies.items()}
+        self.retry_after = retry_after
+        self.prefix = prefix
+        self.local = LocalBuckets()
+        self.redis_down_until = 0.0
+        self.stats = {"allowed": 0, "limited": 0, "fallback": 0, "redis_errors": 0}
+        self.set_redis(redis_client)
+
+    def set_redis(self, client: redis.Redis | None) -> None:
+        self.redis = client
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT) if client is not None else None
+
+    async def hit(self, identity: str, policies: list[str]) -> RateLimitResult:
+        """
+        The hit function takes a token from the bucket of identity for every policy,
+        in one Redis round-trip or from the local buckets.
+
+        :param self: Represent the instance of the class
+        :param identity: str: Who is limited, for example user:1 or ip:127.0.0.1
+        :param policies: list[str]: Names of policies from the rate_limits setting
+        :return: The outcome for the most exhausted bucket
+        :doc-author: Trelent
+        """
+        keys = [f"{self.prefix}:{policy}:{identity}" for policy in policies]
+        buckets = [self.policies[policy] for policy in policies]
+        result = None
+        if self._script is not None and time.monotonic() >= self.redis_down_until:
+            try:
+                reply = await self._script(keys=keys, args=[value for bucket in buckets for value in bucket])
+                tokens = [float(level) for level in reply[1:]]
+                result = RateLimitResult.from_tokens(bool(int(reply[0])), buckets, tokens)
+            except (RedisError, OSError) as err:
+                logger.warning("Rate limiting falls back to local buckets: %s", err)
+                self.stats["redis_errors"] += 1
+                self.redis_down_until = time.monotonic() + self.retry_after
+        if result is None:
+            self.stats["fallback"] += 1
+            result = self.local.hit(keys, buckets)
+        self.stats["allowed" if result.allowed else "limited"] += 1
+        return result
+
+    def metrics(self) -> dict:
+        redis_available = self.redis is not None and time.monotonic() >= self.redis_down_until
+        return dict(self.stats, local_buckets=len(self.local), redis_available=redis_available)
+
+
+rate_limiter = RateLimiter(settings.rate_limits, retry_after=settings.rate_limit_redis_retry)
+if settings.rate_limit_redis:
+    redis_pool.attach(rate_limiter)
+
+
+async def check_rate_limit(request: Request, identity: str, policies: list[str]) -> None:
+    result = await rate_limiter.hit(identity, policies)
+    # Routes may return a Response themselves, custom_middleware in main.py adds these to every response
+    request.state.rate_limit_headers = result.headers()
+    if not result.allowed:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests",
+                            headers=request.state.rate_limit_headers)
+
+
+class RateLimit:
+    """
+    Dependency that limits a route by client address with a policy of the rate_limits setting,
+    for routes used before the client is authenticated.
+    """
+
+    def __init__(self, policy: str):
+        self.policy = policy
+
+    async def __call__(self, request: Request):
+        if settings.rate_limit_enabled:
+            host = request.client.host if request.client else "unknown"
+            await check_rate_limit(request, f"ip:{host}", [self.policy])
+
+
+class UserRateLimit(RateLimit):
+    """
+    Dependency that limits a route per authenticated user with a policy of the rate_limits setting.
+    The same call also draws from the user policy, the budget of the user across all limited routes.
+    """
+
+    async def __call__(self, request: Request, current_user: User = Depends(auth_service.get_current_user)):
+        if settings.rate_limit_enabled:
+            await check_rate_limit(request, f"user:{current_user.id}", [self.policy, "user"])
@@ -0,0 +1,199 @@
+import logging
+import time
+import uuid
+
+import redis.asyncio as redis
+
+from src.conf.config import settings
+from src.database.redis_pool import redis_pool
+
+logger = logging.getLogger(__name__)
+
+# Every login opens a session. A session stores the id (jti) of the only refresh token that may still
+# be used; refreshing replaces it. A token of the session with another id was already used once, so it
+# was stolen or replayed: the session is revoked and whoever holds its current token has to log in again.
+ROTATE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'jti')
+if not current then
+    return 0
+end
+if current ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('SREM', KEYS[2], ARGV[4])
+    return -1
+end
+redis.call('HSET', KEYS[1], 'jti', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+# Session keys are built inside the script, which is fine for a single Redis node but not for a cluster
+REVOKE_ALL_SCRIPT = """
+local sessions = redis.call('SMEMBERS', KEYS[1])
+local revoked = {}
+for _, sid in ipairs(sessions) do
+    if redis.call('DEL', ARGV[1] .. sid) == 1 then
+        table.insert(revoked, sid)
+    end
+end
+redis.call('DEL', KEYS[1])
+return revoked
+"""
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex
+
+
+class MemoryRefreshTokenStore:
+    """
+    In-process refresh token store with the same interface as RedisRefreshTokenStore.
+
+    Sessions are lost on restart and not shared between workers; it is meant for tests
+    and single-process development.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.sessions: dict[str, tuple[str, str, float]] = {}
+        self.user_sessions: dict[str, set[str]] = {}
+
+    def _get(self, sid: str) -> tuple[str, str, float] | None:
+        session = self.sessions.get(sid)
+        if session is not None and session[2] <= time.monotonic():
+            self._drop(sid)
+            return None
+        return session
+
+    def _drop(self, sid: str) -> None:
+        email, _, _ = self.sessions.pop(sid)
+        self.user_sessions.get(email, set()).discard(sid)
+
+    async def create(self, email: str) -> tuple[str, str]:
+        """
+        The create function opens a session for a user who just logged in.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: The session id and the id of its first refresh token
+        :doc-author: Trelent
+        """
+        sid, jti = new_id(), new_id()
+        self.sessions[sid] = (email, jti, time.monotonic() + self.ttl)
+        self.user_sessions.setdefault(email, set()).add(sid)
+        return sid, jti
+
+    async def rotate(self, email: str, sid: str, jti: str) -> str | None:
+        """
+        The rotate function replaces the refresh token jti of the session sid with a new one.
+            It fails when the session was revoked or expired, and revokes the session when jti is not its
+            current token, because an older token of the session is being replayed.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :param sid: str: Session id from the refresh token
+        :param jti: str: Token id from the refresh token
+        :return: The id of the next refresh token, None if the token may not be used
+        :doc-author: Trelent
+        """
+        session = self._get(sid)
+        if session is None or session[0] != email:
+            return None
+        if session[1] != jti:
+            self._drop(sid)
+            logger.warning("Refresh token reuse for %s, session %s revoked", email, sid)
+            return None
+        next_jti = new_id()
+        self.sessions[sid] = (email, next_jti, time.monotonic() + self.ttl)
+        return next_jti
+
+    async def revoke(self, email: str, sid: str) -> None:
+        session = self._get(sid)
+        if session is not None and session[0] == email:
+            self._drop(sid)
+
+    async def revoke_all(self, email: str) -> list[str]:
+        """
+        The revoke_all function ends every session of the user, for example after a password leak.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: The ids of the revoked sessions
+        :doc-author: Trelent
+        """
+        sessions = [sid for sid in self.user_sessions.pop(email, set()) if self._get(sid) is not None]
+        for sid in sessions:
+            self.sessions.pop(sid, None)
+        return sessions
+
+
+class RedisRefreshTokenStore:
+    """
+    Refresh token store shared by all workers.
+
+    A session is a hash with the current token id that expires ttl seconds after its last refresh,
+    and every user has a set of session ids for revoke_all. Rotation and reuse detection run
+    in one script, so two concurrent refreshes with the same token cannot both succeed.
+    """
+
+    def __init__(self, ttl: int, client: redis.Redis | None = None, prefix: str = "refresh"):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.set_redis(client)
+
+    def set_redis(self, client: redis.Redis | None) -> None:
+        self.redis = client
+        self._rotate = client.register_script(ROTATE_SCRIPT) if client is not None else None
+        self._revoke_all = client.register_script(REVOKE_ALL_SCRIPT) if client is not None else None
+
+    def _session_key(self, sid: str) -> str:
+        return f"{self.prefix}:session:{sid}"
+
+    def _user_key(self, email: str) -> str:
+        return f"{self.prefix}:user:{email}"
+
+    async def create(self, email: str) -> tuple[str, str]:
+        sid, jti = new_id(), new_id()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._session_key(sid), mapping={"email": email, "jti": jti})
+            pipe.expire(self._session_key(sid), self.ttl)
+            pipe.sadd(self._user_key(email), sid)
+            pipe.expire(self._user_key(email), self.ttl)
+            await pipe.execute()
+        return sid, jti
+
+    async def rotate(self, email: str, sid: str, jti: str) -> str | None:
+        next_jti = new_id()
+        outcome = await self._rotate(keys=[self._session_key(sid), self._user_key(email)],
+                                     args=[jti, next_jti, self.ttl, sid])
+        if outcome == -1:
+            logger.warning("Refresh token reuse for %s, session %s revoked", email, sid)
+        return next_jti if outcome == 1 else None
+
+    async def revoke(self, email: str, sid: str) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._session_key(sid))
+            pipe.srem(self._user_key(email), sid)
+            await pipe.execute()
+
+    async def revoke_all(self, email: str) -> list[str]:
+        sessions = await self._revoke_all(keys=[self._user_key(email)], args=[f"{self.prefix}:session:"])
+        return [sid.decode() for sid in sessions]
+
+
+def create_refresh_token_store():
+    """
+    The create_refresh_token_store function returns the store selected by the refresh_token_store setting.
+
+    :return: A RedisRefreshTokenStore or a MemoryRefreshTokenStore
+    :doc-author: Trelent
+    """
+    if settings.refresh_token_store == "memory":
+        return MemoryRefreshTokenStore(settings.refresh_token_ttl)
+    store = RedisRefreshTokenStore(settings.refresh_token_ttl)
+    redis_pool.attach(store)
+    return store
+
+
+refresh_token_store = create_refresh_token_store()
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.redis_pool import redis_pool
+from src.services.refresh_tokens import refresh_token_store
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Set membership with no false negatives and about error_rate false positives at capacity items.
+
+    The positions of an item come from one blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        # Inlined and stopping at the first clear bit: this runs on every authenticated request
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size, bits = self.size, self.bits
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+class RevocationList:
+    """
+    Denylist of access tokens, checked on every authenticated request.
+
+    An entry names what is revoked, for example sid:<session id> for every access token of a session.
+    Entries are kept in Redis for ttl seconds, the lifetime of an access token, and every worker
+    mirrors their names in a Bloom filter that a background task rebuilds when the list changes.
+    A request only goes to Redis when the filter reports its entry, which is the case for revoked
+    tokens and for about revocation_error_rate of the others. Entries revoked by this worker are known
+    exactly without Redis; without Redis at all the list is local to the worker.
+    """
+
+    def __init__(self, ttl: int, capacity: int, error_rate: float = 0.001, sync_interval: float = 1.0,
+                 redis_client: redis.Redis | None = None, prefix: str = "revoked"):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.prefix = prefix
+        self.local: dict[str, float] = {}
+        self.filter = BloomFilter(capacity, error_rate)
+        self.version = None
+        self.synced_at = 0.0
+        self._task: asyncio.Task | None = None
+        self.stats = {"checks": 0, "filter_hits": 0, "redis_checks": 0, "revoked": 0, "syncs": 0}
+        self.set_redis(redis_client)
+
+    def set_redis(self, client: redis.Redis | None) -> None:
+        self.redis = client
+        self.version = None
+
+    def _key(self, entry: str) -> str:
+        return f"{self.prefix}:{entry}"
+
+    async def revoke(self, entries: list[str]) -> None:
+        """
+        The revoke function adds entries to the list for ttl seconds, for this worker at once
+        and for the others with their next sync.
+
+        :param self: Represent the instance of the class
+        :param entries: list[str]: Names of the revoked entries, for example sid:<session id>
+        :return: None
+        :doc-author: Trelent
+        """
+        expires_at = time.time() + self.ttl
+        for entry in entries:
+            self.local[entry] = expires_at
+            self.filter.add(entry)
+        if self.redis is None or not entries:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for entry in entries:
+                pipe.set(self._key(entry), 1, ex=self.ttl)
+            pipe.zadd(f"{self.prefix}:entries", {entry: expires_at for entry in entries})
+            pipe.zremrangebyscore(f"{self.prefix}:entries", "-inf", time.time())
+            pipe.incr(f"{self.prefix}:version")
+            await pipe.execute()
+
+    async def is_revoked(self, entry: str) -> bool:
+        """
+        The is_revoked function checks entry against the Bloom filter and, only when the filter reports it,
+        against the exact list.
+            A Redis failure after a filter hit counts as revoked: a false positive then rejects
+            a valid token, which is safer than accepting a revoked one.
+
+        :param self: Represent the instance of the class
+        :param entry: str: Name of the entry, for example sid:<session id>
+        :return: True if the entry is revoked
+        :doc-author: Trelent
+        """
+        self.stats["checks"] += 1
+        if entry not in self.filter:
+            return False
+        self.stats["filter_hits"] += 1
+        revoked = self.local.get(entry, 0) > time.time()
+        if not revoked and self.redis is not None:
+            self.stats["redis_checks"] += 1
+            try:
+                revoked = bool(await self.redis.exists(self._key(entry)))
+            except (RedisError, OSError) as err:
+                logger.warning("Revocation of %s could not be checked: %s", entry, err)
+                revoked = True
+        if revoked:
+            self.stats["revoked"] += 1
+        return revoked
+
+    async def sync(self) -> None:
+        """
+        The sync function rebuilds the Bloom filter from the entries in Redis and the local ones
+        when the list changed, and at least every ttl seconds so that expired entries leave the filter.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        now = time.time()
+        entries = set()
+        version = None
+        if self.redis is not None:
+            version = await self.redis.get(f"{self.prefix}:version")
+            if version == self.version and now - self.synced_at < self.ttl:
+                return
+            entries.update(entry.decode() for entry in
+                           await self.redis.zrangebyscore(f"{self.prefix}:entries", now, "+inf"))
+        elif now - self.synced_at < self.ttl:
+            return
+        # Read after the round-trips, entries revoked by this worker meanwhile must stay in the filter
+        self.local = {entry: expires_at for entry, expires_at in self.local.items() if expires_at > now}
+        entries.update(self.local)
+        bloom = BloomFilter(max(self.capacity, 2 * len(entries)), self.error_rate)
+        for entry in entries:
+            bloom.add(entry)
+        self.filter, self.version, self.synced_at = bloom, version, now
+        self.stats["syncs"] += 1
+
+    async def _sync_loop(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except (RedisError, OSError) as err:
+                logger.warning("Revocation list sync failed: %s", err)
+            await asyncio.sleep(self.sync_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def metrics(self) -> dict:
+        return dict(self.stats, entries=len(self.filter), local_entries=len(self.local),
+                    filter_bytes=len(self.filter.bits), redis=self.redis is not None)
+
+
+revocation_list = RevocationList(settings.access_token_ttl, settings.revocation_capacity,
+                                 settings.revocation_error_rate, settings.revocation_sync_interval)
+if settings.revocation_redis:
+    redis_pool.attach(revocation_list)
+
+
+async def revoke_sessions(email: str) -> int:
+    """
+    The revoke_sessions function ends every session of the user: their refresh tokens can no longer be used
+    and their access tokens are rejected from now on, not only when they expire.
+    It backs logout_all and the kill switch below, and is meant for a password change.
+
+    :param email: str: Email of the user
+    :return: The number of revoked sessions
+    :doc-author: Trelent
+    """
+    sessions = await refresh_token_store.revoke_all(email)
+    await revocation_list.revoke([f"sid:{sid}" for sid in sessions])
+    return len(sessions)
+
+
+async def kill_switch(emails: list[str]) -> None:
+    await redis_pool.open()
+    try:
+        for email in emails:
+            print(f"{email}: {await revoke_sessions(email)} sessions revoked")
+    finally:
+        await redis_pool.close()
+
+
+if __name__ == "__main__":
+    # python -m src.services.revocation user@example.com ...
+    import sys
+
+    asyncio.run(kill_switch(sys.argv[1:]))
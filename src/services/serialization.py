@@ -0,0 +1,45 @@
+from functools import lru_cache
+from typing import Any, Sequence
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+
+@lru_cache
+def model_fields(model: type[BaseModel]) -> tuple[str, ...]:
+    return tuple(model.model_fields)
+
+
+def orm_to_jsonable(model: type[BaseModel], data: Any) -> Any:
+    """
+    The orm_to_jsonable function reads the fields of a response model straight from ORM rows.
+        Rows come from the database and were validated when they were written, so unlike a response_model
+        they are not validated again (EmailStr validation alone costs more than the query of a page).
+        Only flat models whose fields are columns of JSON native, date or datetime types are supported.
+
+    :param model: type[BaseModel]: The response model, for example ContactResponse
+    :param data: Any: A row or a sequence of rows
+    :return: A dictionary or a list of dictionaries that orjson can serialize
+    :doc-author: Trelent
+    """
+    fields = model_fields(model)
+    if isinstance(data, Sequence):
+        return [{name: getattr(row, name) for name in fields} for row in data]
+    return {name: getattr(data, name) for name in fields}
+
+
+def orm_to_json(model: type[BaseModel], data: Any) -> bytes:
+    """
+    The orm_to_json function serializes ORM rows to the JSON body a response_model of model would produce.
+
+    :param model: type[BaseModel]: The response model
+    :param data: Any: A row or a sequence of rows
+    :return: The JSON body
+    :doc-author: Trelent
+    """
+    return orjson.dumps(orm_to_jsonable(model, data))
+
+
+def orm_response(model: type[BaseModel], data: Any, **kwargs) -> ORJSONResponse:
+    return ORJSONResponse(orm_to_jsonable(model, data), **kwargs)
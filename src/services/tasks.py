@@ -0,0 +1,65 @@
+import base64
+import io
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.repository import users as repository_users
+from src.services.cloud_image import CloudImage
+from src.services.email import send_email
+from src.services.jobs import task, job_queue
+
+
+def avatar_job(job_id: str, email: str, status: str = "pending", avatar: str | None = None,
+               detail: str | None = None) -> dict:
+    """
+    The avatar_job function builds the status record of a background avatar upload,
+    as returned by /users/avatar/jobs/{job_id}.
+
+    :param job_id: str: Id of the status record
+    :param email: str: Email of the user who uploaded the avatar
+    :param status: str: pending, done or failed
+    :param avatar: str | None: Url of the stored avatar once done
+    :param detail: str | None: The error once failed
+    :return: The status record
+    :doc-author: Trelent
+    """
+    return {"job_id": job_id, "email": email, "status": status, "avatar": avatar, "detail": detail}
+
+
+@task("send_email")
+async def send_email_task(email: str, username: str, host: str) -> None:
+    await send_email(email, username, host)
+
+
+async def upload_avatar_failed(job: dict, err: Exception) -> None:
+    kwargs = job["kwargs"]
+    await job_queue.set_status(kwargs["job_id"], avatar_job(kwargs["job_id"], kwargs["email"], "failed",
+                                                            detail=str(err)))
+
+
+@task("upload_avatar", db=True, concurrency=settings.avatar_job_concurrency, on_dead=upload_avatar_failed)
+async def upload_avatar_task(job_id: str, email: str, public_id: str, content_type: str, data: str,
+                             db: AsyncSession) -> None:
+    """
+    The upload_avatar_task function stores an avatar queued by update_avatar_user
+    and records the outcome under job_id.
+
+    :param job_id: str: Id of the status record created by the route
+    :param email: str: Email of the user
+    :param public_id: str: The storage key of the avatar
+    :param content_type: str: Content type of the image
+    :param data: str: The image, base64 encoded
+    :param db: AsyncSession: Session opened by the worker
+    :return: None
+    :doc-author: Trelent
+    """
+    try:
+        src_url = await CloudImage.upload_async(io.BytesIO(base64.b64decode(data)), public_id, content_type)
+    except HTTPException as err:
+        # The image itself was rejected, retrying will not help
+        await job_queue.set_status(job_id, avatar_job(job_id, email, "failed", detail=err.detail))
+        return
+    await repository_users.update_avatar(email, src_url, db)
+    await job_queue.set_status(job_id, avatar_job(job_id, email, "done", avatar=src_url))
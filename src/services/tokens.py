@@ -0,0 +1,149 @@
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
+
+from src.conf.config import settings
+from src.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Key rotation without downtime, every step is a rolling restart:
+#   1. put the public (or private) key of the new kid into JWT_KEYS_DIR on every instance, they accept it;
+#   2. set JWT_KEY_ID to the new kid where its private key is, new tokens are signed with it;
+#   3. remove the old key once the longest lived token signed with it (refresh_token_ttl) has expired.
+# SECRET_KEY verifies the tokens without a kid header, issued before the keys directory was used;
+# set it empty in the same way when they have expired.
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    kid: str | None
+    algorithm: str
+    verify_key: Key
+    sign_key: Key | None = None
+
+
+def load_keys(secret_key: str, algorithm: str, keys_dir: str, key_algorithm: str) -> list[SigningKey]:
+    """
+    The load_keys function builds the signing keys from the settings, parsing every key once.
+        The secret key is used for tokens without a kid header; every *.pem file of keys_dir is a key
+        whose kid is the file name without the extension. Files with a private key can sign,
+        files with a public key can only verify.
+
+    :param secret_key: str: The symmetric key, empty to disable it
+    :param algorithm: str: Algorithm of the symmetric key
+    :param keys_dir: str: Directory with the PEM keys, empty to use the secret key only
+    :param key_algorithm: str: Algorithm of the PEM keys, for example RS256 or ES256
+    :return: A list of keys
+    :doc-author: Trelent
+    """
+    keys = []
+    if secret_key:
+        secret = jwk.construct(secret_key, algorithm)
+        keys.append(SigningKey(None, algorithm, secret, secret))
+    if keys_dir:
+        for path in sorted(Path(keys_dir).glob("*.pem")):
+            key = jwk.construct(path.read_text(), key_algorithm)
+            if key.is_public():
+                keys.append(SigningKey(path.stem, key_algorithm, key))
+            else:
+                keys.append(SigningKey(path.stem, key_algorithm, key.public_key(), key))
+    return keys
+
+
+class TokenVerifier:
+    """
+    Signs and verifies the JWTs of the application.
+
+    The key of a token is picked by its kid header and only its own algorithm is accepted, so a token
+    cannot choose how it is verified. Access tokens that passed verification are cached with their claims
+    until they expire: a bearer token costs one signature check per worker, later requests with it
+    are a dictionary lookup. The cache is keyed by the whole token, signature included,
+    so a token that was altered in any way is a miss and is verified.
+    """
+
+    def __init__(self, keys: list[SigningKey], active_kid: str | None = None, cache_size: int = 4096):
+        self.cache = TTLCache(cache_size, 0)
+        self.set_keys(keys, active_kid)
+
+    def set_keys(self, keys: list[SigningKey], active_kid: str | None = None) -> None:
+        """
+        The set_keys function replaces the keys and drops the cached tokens,
+        which may have been verified with a key that is no longer accepted.
+
+        :param self: Represent the instance of the class
+        :param keys: list[SigningKey]: Every key that verifies tokens
+        :param active_kid: str | None: Kid of the key that signs new tokens, None for the secret key
+        :return: None
+        :doc-author: Trelent
+        """
+        keys = {key.kid: key for key in keys}
+        active = keys.get(active_kid)
+        if active is None or active.sign_key is None:
+            raise ValueError(f"No private key to sign tokens with kid {active_kid}")
+        self.keys = keys
+        self.active = active
+        self.cache.clear()
+        logger.info("Token keys %s, signing with %s", [kid for kid in keys if kid], active_kid or "secret key")
+
+    def sign(self, claims: dict) -> str:
+        headers = {"kid": self.active.kid} if self.active.kid is not None else None
+        return jwt.encode(claims, self.active.sign_key, algorithm=self.active.algorithm, headers=headers)
+
+    def decode(self, token: str) -> dict:
+        """
+        The decode function checks the signature and the expiration time of a token, without the cache.
+        It is meant for tokens used once, refresh and email tokens.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        # The header comes from the client: a list or an object as kid must not reach the dict lookup
+        if kid is not None and not isinstance(kid, str):
+            raise JWTError("Invalid key id")
+        key = self.keys.get(kid)
+        if key is None:
+            raise JWTError("Unknown signing key")
+        return jwt.decode(token, key.verify_key, algorithms=[key.algorithm], options={"require_exp": True})
+
+    def verify(self, token: str, scope: str) -> dict:
+        """
+        The verify function returns the claims of a token with the given scope, from the cache if it was
+        verified before.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :param scope: str: The scope the token must have
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        claims = self.cache.get(token)
+        if claims is None:
+            claims = self.decode(token)
+            self.cache.set(token, claims, ttl=claims["exp"] - time.time())
+        if claims.get("scope") != scope:
+            raise JWTError("Invalid scope for token")
+        return claims
+
+    def metrics(self) -> dict:
+        return {
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "size": len(self.cache),
+            "keys": [kid for kid in self.keys if kid is not None],
+            "active_kid": self.active.kid,
+        }
+
+
+token_verifier = TokenVerifier(
+    load_keys(settings.secret_key, settings.algorithm, settings.jwt_keys_dir, settings.jwt_key_algorithm),
+    active_kid=settings.jwt_key_id or None,
+    cache_size=settings.token_cache_size,
+)
@@ -1,20 +1,46 @@
+import asyncio
+import os
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+# Jobs are queued in memory and run explicitly by the tests, rate limits, sessions and revocations are kept in process
+os.environ.setdefault("JOB_QUEUE_BACKEND", "memory")
+os.environ.setdefault("RATE_LIMIT_REDIS", "false")
+os.environ.setdefault("REFRESH_TOKEN_STORE", "memory")
+os.environ.setdefault("REVOCATION_REDIS", "false")
 
-from main import app
-from src.database.models import Base
-from src.database.db import get_db
+from main import app  # noqa: E402
+from src.database.models import Base, User  # noqa: E402
+from src.database.db import get_db, register_sqlite_functions  # noqa: E402
+from src.services.auth import auth_service  # noqa: E402
+from src.services.cache import contact_cache, user_cache  # noqa: E402
+from src.services.metrics import instrument_engine  # noqa: E402
+from src.services.query_inspector import query_inspector  # noqa: E402
+from src.services.rate_limit import rate_limiter  # noqa: E402
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The application talks to the same database file through the async driver,
+# the sync session above is only used by tests to prepare and inspect data.
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                              bind=async_engine)
+instrument_engine(async_engine.sync_engine)
+register_sqlite_functions(async_engine.sync_engine)
+query_inspector.inspect_engine(async_engine.sync_engine)
+
 
 @pytest.fixture(scope="module")
 def session():
@@ -34,13 +60,17 @@ def session():
 def client(session):
     # Dependency override
 
-    def override_get_db():
+    async def override_get_db():
+        db = TestingAsyncSessionLocal()
         try:
-            yield session
+            yield db
         finally:
-            session.close()
+            await db.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    user_cache.local.clear()
+    contact_cache.local.clear()
+    rate_limiter.local.clear()
 
     yield TestClient(app)
 
@@ -49,3 +79,12 @@ def client(session):
 def user():
     return {"username": "deadpool", "email": "deadpool@example.com", "password": "12345678"}
 
+
+@pytest.fixture(scope="module")
+def headers(client, session, user):
+    current_user = User(username=user.get('username'), email=user.get('email'),
+                        password=auth_service.get_password_hash(user.get('password')), confirmed=True)
+    session.add(current_user)
+    session.commit()
+    access_token = asyncio.run(auth_service.create_access_token(data={"sub": user.get('email')}))
+    return {"Authorization": f"Bearer {access_token}"}
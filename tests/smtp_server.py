@@ -0,0 +1,59 @@
+import asyncio
+
+
+class SMTPStub:
+    """
+    Minimal plain-text SMTP server that accepts every message and keeps it in memory.
+    Only the commands aiosmtplib uses without TLS and authentication are understood.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fail_first: int = 0):
+        self.host = host
+        self.port = port
+        self.fail_first = fail_first
+        self.messages: list[bytes] = []
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 stub ESMTP")
+        try:
+            while line := await reader.readline():
+                command = line.decode().strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    await reply("250 stub")
+                elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                    await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = bytearray()
+                    while (chunk := await reader.readline()) not in (b".\r\n", b""):
+                        data += chunk
+                    if self.fail_first > 0:
+                        self.fail_first -= 1
+                        await reply("451 Try again later")
+                    else:
+                        self.messages.append(bytes(data))
+                        await reply("250 Queued")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Not implemented")
+        finally:
+            writer.close()
@@ -0,0 +1,24 @@
+import pytest
+
+from src.services.auth import auth_service
+
+ENDPOINTS = ["pool", "redis", "password_hasher", "jobs", "cache", "rate_limit", "tokens", "revocations"]
+
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+def test_admin_endpoints_forbidden_for_user(client, headers, endpoint):
+    response = client.get(f"/api/admin/{endpoint}", headers=headers)
+    assert response.status_code == 403, response.text
+    assert response.json()["detail"] == "Admin access required"
+
+
+def test_admin_endpoints_unauthorized(client):
+    response = client.get("/api/admin/cache")
+    assert response.status_code == 401, response.text
+
+
+def test_get_cache_stats_admin(client, headers, user, monkeypatch):
+    monkeypatch.setattr("src.services.auth.settings.admin_emails", [user["email"]])
+    response = client.get("/api/admin/cache", headers=headers)
+    assert response.status_code == 200, response.text
+    assert "contacts" in response.json()
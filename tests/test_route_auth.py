@@ -1,17 +1,24 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock
+
+from jose import jwt
+from redis.exceptions import RedisError
 
 from src.database.models import User
+from src.services.jobs import MemoryJobQueue
+from src.services.rate_limit import rate_limiter
 
 
 def test_create_user(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+    queue = MemoryJobQueue()
+    monkeypatch.setattr("src.routes.auth.job_queue", queue)
     response = client.post(
         "/api/auth/signup",
         json=user,
     )
     payload = response.json()
     assert payload["email"] == user.get("email")
+    assert [job["task"] for job in queue.pending] == ["send_email"]
+    assert queue.pending[0]["kwargs"]["email"] == user.get("email")
 
 
 def test_repeat_create_user(client, user):
@@ -24,6 +31,18 @@ def test_repeat_create_user(client, user):
     assert data["detail"] == "Account already exists"
 
 
+def test_create_user_queue_unavailable(client, session, monkeypatch):
+    queue = MemoryJobQueue()
+    monkeypatch.setattr(queue, "enqueue", AsyncMock(side_effect=RedisError("Connection refused")))
+    monkeypatch.setattr("src.routes.auth.job_queue", queue)
+    response = client.post(
+        "/api/auth/signup",
+        json={"username": "wolverine", "email": "wolverine@example.com", "password": "12345678"},
+    )
+    assert response.status_code == 201, response.text
+    assert session.query(User).filter(User.email == "wolverine@example.com").first() is not None
+
+
 def test_login_user_not_confirmed(client, user):
     response = client.post(
         "/api/auth/login",
@@ -65,3 +84,96 @@ def test_login_wrong_email(client, user):
     assert response.status_code == 401, response.text
     data = response.json()
     assert data["detail"] == "Invalid email"
+
+
+def test_login_rate_limited(client, user, monkeypatch):
+    monkeypatch.setitem(rate_limiter.policies, "auth", (1, 60))
+    rate_limiter.local.clear()
+    data = {"username": user.get('email'), "password": user.get('password')}
+    response = client.post("/api/auth/login", data=data)
+    assert response.status_code == 200, response.text
+    assert (response.headers["X-RateLimit-Limit"], response.headers["X-RateLimit-Remaining"]) == ("1", "0")
+    response = client.post("/api/auth/login", data=data)
+    assert response.status_code == 429, response.text
+    assert response.headers["Retry-After"] == "60"
+    rate_limiter.local.clear()
+
+
+def login(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def refresh(client, refresh_token):
+    return client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {refresh_token}"})
+
+
+def me(client, access_token):
+    return client.get("/api/users/me/", headers={"Authorization": f"Bearer {access_token}"})
+
+
+def test_malformed_key_id(client):
+    token = jwt.encode({"sub": "user@example.com", "scope": "access_token"}, "secret", algorithm="HS256",
+                       headers={"kid": ["x"]})
+    response = client.get("/api/contacts/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401, response.text
+
+
+def test_refresh_token_rotation(client, user):
+    rate_limiter.local.clear()
+    first = login(client, user)["refresh_token"]
+    response = refresh(client, first)
+    assert response.status_code == 200, response.text
+    second = response.json()["refresh_token"]
+    access_token = response.json()["access_token"]
+    assert second != first
+    assert client.get("/api/contacts/", headers={"Authorization": f"Bearer {access_token}"}).status_code == 200
+    # The first token was used already: replaying it revokes the session, the rotated token included
+    response = refresh(client, first)
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+    assert refresh(client, second).status_code == 401
+    # The access tokens of the session are revoked too
+    assert client.get("/api/contacts/", headers={"Authorization": f"Bearer {access_token}"}).status_code == 401
+
+
+def test_logout(client, user):
+    rate_limiter.local.clear()
+    tokens = login(client, user)
+    other = login(client, user)
+    response = client.post("/api/auth/logout", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 200, response.text
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+    assert me(client, tokens["access_token"]).status_code == 401
+    # Other sessions of the user are not affected
+    assert me(client, other["access_token"]).status_code == 200
+    assert refresh(client, other["refresh_token"]).status_code == 200
+
+
+def test_logout_revocation_unavailable(client, user, monkeypatch):
+    rate_limiter.local.clear()
+    tokens = login(client, user)
+    monkeypatch.setattr("src.routes.auth.revocation_list.revoke", AsyncMock(side_effect=RedisError("Timeout")))
+    response = client.post("/api/auth/logout", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 503, response.text
+    assert response.json()["detail"] == "Session could not be revoked, try again later"
+    # A replayed refresh token is not answered with new tokens either
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 503, response.text
+
+
+def test_logout_all(client, user):
+    rate_limiter.local.clear()
+    sessions = [login(client, user), login(client, user)]
+    response = client.post("/api/auth/logout_all",
+                           headers={"Authorization": f"Bearer {sessions[0]['access_token']}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["sessions"] >= 2
+    for tokens in sessions:
+        assert refresh(client, tokens["refresh_token"]).status_code == 401
+        assert me(client, tokens["access_token"]).status_code == 401
+    rate_limiter.local.clear()
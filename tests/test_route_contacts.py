@@ -0,0 +1,338 @@
+import asyncio
+import json
+from datetime import date, datetime
+
+import pytest
+
+from src.conf.config import settings
+from src.database.models import Contact, User
+from src.services.auth import auth_service
+from src.services.pagination import encode_cursor
+from src.services.query_inspector import query_inspector
+
+
+@pytest.fixture(scope="module", autouse=True)
+def no_rate_limit():
+    settings.rate_limit_enabled = False
+    yield
+    settings.rate_limit_enabled = True
+
+
+@pytest.fixture(scope="module", autouse=True)
+def contacts(session, headers, user):
+    owner = session.query(User).filter_by(email=user['email']).one()
+    for i, last_name in enumerate(['Shevchenko', 'Franko', 'Ukrainka', 'Kostenko', 'Franko']):
+        session.add(Contact(first_name=f'Name{i}', last_name=last_name, email=f'contact{i}@example.com',
+                            phone='+380123456789', birthday=datetime(1990, 1, i + 1), user=owner))
+    session.commit()
+
+
+def test_get_contacts_offset(client, headers):
+    response = client.get("/api/contacts/", params={"limit": 2, "offset": 1}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [contact["email"] for contact in data] == ["contact1@example.com", "contact2@example.com"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_contacts_cursor(client, headers):
+    emails = []
+    params = {"limit": 2, "paginate": "cursor", "sort_by": "last_name"}
+    while True:
+        response = client.get("/api/contacts/", params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        emails.extend(contact["email"] for contact in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params = {"limit": 2, "cursor": response.headers["X-Next-Cursor"]}
+    assert emails == ["contact1@example.com", "contact4@example.com", "contact3@example.com",
+                      "contact0@example.com", "contact2@example.com"]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    encode_cursor("email", ["contact1@example.com", 1]),
+    encode_cursor("id", [1, 2]),
+    encode_cursor("id", ["1"]),
+    encode_cursor("id", [None]),
+    encode_cursor("id", [True]),
+    encode_cursor("last_name", [{"a": 1}, 1]),
+    encode_cursor("last_name", ["Smith", 1.5]),
+])
+def test_get_contacts_invalid_cursor(client, headers, cursor):
+    response = client.get("/api/contacts/", params={"cursor": cursor}, headers=headers)
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_get_contact_etag(client, headers):
+    response = client.get("/api/contacts/2", headers=headers)
+    assert response.status_code == 200, response.text
+    etag = response.headers["etag"]
+    list_etag = client.get("/api/contacts/", headers=headers).headers["etag"]
+
+    response = client.get("/api/contacts/2", headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    body = {"first_name": "Name1", "last_name": "Franko", "email": "contact1@example.com",
+            "phone": "+380990000000", "birthday": "1990-01-02"}
+    assert client.put("/api/contacts/2", json=body, headers=headers).status_code == 200
+    response = client.get("/api/contacts/2", headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 200
+    assert response.json()["phone"] == "+380990000000"
+    assert response.headers["etag"] != etag
+    assert client.get("/api/contacts/", headers=headers).headers["etag"] != list_etag
+
+
+class FakeDate(date):
+    @classmethod
+    def today(cls):
+        return cls(2023, 12, 29)
+
+
+def test_contacts_birthday_across_new_year(client, headers, monkeypatch):
+    monkeypatch.setattr("src.repository.contacts.date", FakeDate)
+    response = client.get("/api/contacts/birthday", params={"days": 4}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()] == ["contact0@example.com", "contact1@example.com"]
+
+
+def test_search_contacts_prefix(client, headers):
+    response = client.get("/api/contacts/search", params={"q": "fra"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()] == ["contact1@example.com", "contact4@example.com"]
+
+
+def test_search_contacts_non_ascii(client, headers):
+    body = {"first_name": "Петро", "last_name": "Шевченко", "email": "petro@example.com", "birthday": "1990-06-01"}
+    contact_id = client.post("/api/contacts/", json=body, headers=headers).json()["id"]
+    for q, fuzzy in (("пет", False), ("ПЕТ", False), ("ченко", True)):
+        response = client.get("/api/contacts/search", params={"q": q, "fuzzy": fuzzy}, headers=headers)
+        assert response.status_code == 200, response.text
+        assert [contact["id"] for contact in response.json()] == [contact_id], q
+    assert client.delete(f"/api/contacts/{contact_id}", headers=headers).status_code == 204
+
+
+def test_search_contacts_fields(client, headers):
+    response = client.get("/api/contacts/search", params={"q": "CONTACT3", "fields": ["email"]}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()] == ["contact3@example.com"]
+    response = client.get("/api/contacts/search", params={"q": "contact3", "fields": ["last_name"]}, headers=headers)
+    assert response.json() == []
+
+
+def test_search_contacts_fuzzy(client, headers):
+    response = client.get("/api/contacts/search", params={"q": "krain", "fuzzy": True}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()] == ["contact2@example.com"]
+
+
+def test_import_contacts_csv(client, headers, session):
+    rows = [
+        "first_name,last_name,email,phone,birthday",
+        "Taras,Import,import0@example.com,+380501112233,1990-03-09",
+        "Lesia,Import,import1@example.com,+380501112234,1991-02-25",
+        "Ivan,Import,contact0@example.com,+380501112235,1992-08-27",
+        "Mykola,Import,import0@example.com,+380501112236,1993-05-01",
+        "X,Import,not-an-email,+380501112237,1994-01-01",
+    ]
+    response = client.post("/api/contacts/import", files={"file": ("contacts.csv", "\n".join(rows), "text/csv")},
+                           headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert (data["imported"], data["failed"]) == (2, 3)
+    assert [error["row"] for error in sorted(data["errors"], key=lambda error: error["row"])] == [3, 4, 5]
+    contact = session.query(Contact).filter(Contact.email == "import1@example.com").one()
+    assert contact.birthday_md == 225
+    session.query(Contact).filter(Contact.last_name == "Import").delete()
+    session.commit()
+
+
+def test_import_contacts_ndjson(client, headers, session):
+    lines = [
+        '{"first_name": "Taras", "last_name": "Import", "email": "import2@example.com", "birthday": "1990-03-09"}',
+        '{"first_name": "Lesia"',
+        '',
+        '{"first_name": "Lesia", "last_name": "Import", "email": "import3@example.com", "birthday": "1991-02-25"}',
+    ]
+    response = client.post("/api/contacts/import", params={"format": "ndjson"},
+                           files={"file": ("contacts.txt", "\n".join(lines), "text/plain")}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert (data["imported"], data["failed"]) == (2, 1)
+    assert data["errors"][0]["row"] == 2 and data["errors"][0]["detail"].startswith("Invalid JSON")
+    session.query(Contact).filter(Contact.last_name == "Import").delete()
+    session.commit()
+
+
+def test_import_contacts_not_utf8(client, headers, session):
+    rows = [
+        "first_name,last_name,email,phone,birthday",
+        "Taras,Import,import4@example.com,+380501112233,1990-03-09",
+        "José,Import,import5@example.com,+380501112234,1991-02-25",
+        "Lesia,Import,import6@example.com,+380501112235,1992-08-27",
+    ]
+    content = "\n".join(rows).encode("latin-1")
+    response = client.post("/api/contacts/import", files={"file": ("contacts.csv", content, "text/csv")},
+                           headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert (data["imported"], data["failed"]) == (2, 1)
+    assert data["errors"] == [{"row": 2, "detail": "Invalid encoding: the file must be UTF-8"}]
+    lines = ['{"first_name": "José", "last_name": "Import", "email": "import7@example.com", "birthday": "1990-03-09"}',
+             '{"first_name": "Ivan", "last_name": "Import", "email": "import7@example.com", "birthday": "1990-03-09"}']
+    response = client.post("/api/contacts/import", params={"format": "ndjson"},
+                           files={"file": ("contacts.txt", "\n".join(lines).encode("latin-1"), "text/plain")},
+                           headers=headers)
+    data = response.json()
+    assert (data["imported"], data["failed"]) == (1, 1)
+    assert data["errors"][0]["row"] == 1
+    session.query(Contact).filter(Contact.last_name == "Import").delete()
+    session.commit()
+
+
+def test_import_contacts_unsupported_format(client, headers):
+    response = client.post("/api/contacts/import", files={"file": ("contacts.xml", "<contacts/>", "text/xml")},
+                           headers=headers)
+    assert response.status_code == 415, response.text
+
+
+def test_export_contacts_csv(client, headers):
+    response = client.get("/api/contacts/export", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "id,first_name,last_name,email,phone,birthday,created_at,updated_at"
+    assert len(lines) == 6
+    assert lines[1].split(",")[3:6] == ["contact0@example.com", "+380123456789", "1990-01-01"]
+
+
+def test_export_contacts_ndjson_gzip(client, headers, monkeypatch):
+    monkeypatch.setattr("src.services.contacts_io.settings.contacts_export_batch_size", 2)
+    response = client.get("/api/contacts/export", params={"format": "ndjson", "gzip": True}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-encoding"] == "gzip"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["email"] for row in rows] == [f"contact{i}@example.com" for i in range(5)]
+    assert rows[0]["birthday"] == "1990-01-01"
+
+
+def test_batch_contacts(client, headers, session):
+    def data(i, email):
+        return {"first_name": f"Batch{i}", "last_name": "Batch", "email": email, "birthday": "1990-05-0" + str(i)}
+
+    response = client.post("/api/contacts/batch", headers=headers, json={"operations": [
+        {"op": "create", "data": data(1, "batch1@example.com")},
+        {"op": "create", "data": data(2, "contact1@example.com")},
+        {"op": "create", "data": data(3, "batch1@example.com")},
+        {"op": "update", "id": 3, "data": data(4, "batch4@example.com")},
+        {"op": "delete", "id": 3},
+        {"op": "delete", "id": 999},
+        {"op": "update", "id": 5, "data": data(5, "contact4@example.com")},
+    ]})
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [201, 409, 409, 200, 409, 404, 200]
+    created = session.get(Contact, results[0]["id"])
+    assert (created.email, created.birthday_md) == ("batch1@example.com", 501)
+    session.expire_all()
+    assert session.get(Contact, 3).email == "batch4@example.com"
+    assert session.get(Contact, 5).birthday_md == 505
+
+    response = client.post("/api/contacts/batch", headers=headers, json={"operations": [
+        {"op": "delete", "id": results[0]["id"]},
+        {"op": "update", "id": 3, "data": data(3, "contact2@example.com")},
+        {"op": "update", "id": 5, "data": data(5, "contact4@example.com")},
+    ]})
+    assert [result["status"] for result in response.json()["results"]] == [204, 200, 200]
+    session.expire_all()
+    assert session.get(Contact, results[0]["id"]) is None
+
+    # The body of a delete does not take part in the email checks
+    response = client.post("/api/contacts/batch", headers=headers, json={"operations": [
+        {"op": "create", "data": data(6, "batch6@example.com")},
+        {"op": "delete", "id": 3, "data": data(6, "batch6@example.com")},
+    ]})
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [201, 204]
+    session.expire_all()
+    assert session.get(Contact, 3) is None
+
+
+def test_batch_contacts_invalid(client, headers):
+    response = client.post("/api/contacts/batch", headers=headers, json={"operations": [{"op": "update", "id": 1}]})
+    assert response.status_code == 422, response.text
+    response = client.post("/api/contacts/batch", headers=headers, json={"operations": []})
+    assert response.status_code == 422, response.text
+
+
+def test_contacts_isolated_between_users(client, headers, session):
+    other = User(username="wolverine", email="wolverine@example.com",
+                 password=auth_service.get_password_hash("12345678"), confirmed=True)
+    session.add(other)
+    session.commit()
+    token = asyncio.run(auth_service.create_access_token(data={"sub": other.email}))
+    other_headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/api/contacts/", headers=other_headers).json() == []
+    assert client.get("/api/contacts/2", headers=other_headers).status_code == 404
+    assert client.delete("/api/contacts/2", headers=other_headers).status_code == 404
+    body = {"first_name": "Logan", "last_name": "Howlett", "email": "contact1@example.com",
+            "birthday": "1990-02-01"}
+    response = client.post("/api/contacts/", json=body, headers=other_headers)
+    assert response.status_code == 201, response.text
+    assert [contact["first_name"] for contact in client.get("/api/contacts/", headers=other_headers).json()] \
+        == ["Logan"]
+    assert client.get("/api/contacts/2", headers=headers).status_code == 200
+
+
+def test_query_budgets(client, headers):
+    body = {"first_name": "Budget", "last_name": "Queries", "email": "budget@example.com", "birthday": "1990-03-01"}
+    # The user and a single INSERT ... ON CONFLICT DO NOTHING RETURNING
+    with query_inspector.budget(2):
+        response = client.post("/api/contacts/", json=body, headers=headers)
+    assert response.status_code == 201, response.text
+    contact_id = response.json()["id"]
+    # One query per page, however many contacts it has
+    with query_inspector.budget(1):
+        assert client.get("/api/contacts/", params={"limit": 50}, headers=headers).status_code == 200
+    with query_inspector.budget(1):
+        assert client.get(f"/api/contacts/{contact_id}", headers=headers).status_code == 200
+    with query_inspector.budget(1):
+        assert client.put(f"/api/contacts/{contact_id}", json=dict(body, phone="+380990000001"),
+                          headers=headers).status_code == 200
+    with query_inspector.budget(1):
+        assert client.delete(f"/api/contacts/{contact_id}", headers=headers).status_code == 204
+
+
+def test_upsert_contact(client, headers):
+    body = {"first_name": "Upsert", "last_name": "Contact", "email": "upsert@example.com", "birthday": "1991-04-02"}
+    with query_inspector.budget(2):
+        response = client.put("/api/contacts/", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    created = response.json()
+    with query_inspector.budget(2):
+        response = client.put("/api/contacts/", json=dict(body, phone="+380990000002"), headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["id"] == created["id"]
+    assert data["phone"] == "+380990000002"
+    response = client.get(f"/api/contacts/{created['id']}", headers=headers)
+    assert response.json()["phone"] == "+380990000002"
+    assert client.delete(f"/api/contacts/{created['id']}", headers=headers).status_code == 204
+
+
+def test_update_contact_to_existing_email(client, headers):
+    first = {"first_name": "First", "last_name": "Conflict", "email": "first.conflict@example.com",
+             "birthday": "1992-05-03"}
+    second = dict(first, first_name="Second", email="second.conflict@example.com")
+    first_id = client.post("/api/contacts/", json=first, headers=headers).json()["id"]
+    second_id = client.post("/api/contacts/", json=second, headers=headers).json()["id"]
+    response = client.post("/api/contacts/", json=first, headers=headers)
+    assert response.status_code == 409, response.text
+    response = client.put(f"/api/contacts/{second_id}", json=dict(second, email=first["email"]), headers=headers)
+    assert response.status_code == 409, response.text
+    assert response.json()["detail"] == "Email is existed!"
+    for contact_id in (first_id, second_id):
+        assert client.delete(f"/api/contacts/{contact_id}", headers=headers).status_code == 204
@@ -0,0 +1,32 @@
+import pytest
+
+from src.conf.config import settings
+
+
+@pytest.fixture(scope="module", autouse=True)
+def no_rate_limit():
+    settings.rate_limit_enabled = False
+    yield
+    settings.rate_limit_enabled = True
+
+
+def test_server_timing_header(client, headers):
+    response = client.get("/api/contacts/", headers=headers)
+    assert response.status_code == 200, response.text
+    server_timing = response.headers["Server-Timing"]
+    assert server_timing.startswith("db;dur=")
+    assert "total;dur=" in server_timing
+    assert "performance" not in response.headers
+
+
+def test_metrics(client, headers):
+    client.get("/api/contacts/", headers=headers)
+    client.get("/api/contacts/999999", headers=headers)
+    response = client.get("/metrics")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/contacts/",status="200"}' in body
+    # Routes are labelled with their template, not with the requested path
+    assert 'route="/api/contacts/{contact_id}",status="404"' in body
+    assert 'http_request_dependency_calls_total{method="GET",route="/api/contacts/",dependency="db"}' in body
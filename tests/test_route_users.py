@@ -0,0 +1,96 @@
+import asyncio
+import io
+import struct
+import zlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.services.cloud_image import CloudImage, LocalStorage, MediaFiles
+from src.services.jobs import Worker, job_queue
+from tests.conftest import TestingAsyncSessionLocal
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+
+@pytest.fixture(autouse=True)
+def local_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(CloudImage, "storage", LocalStorage(str(tmp_path), "/media"))
+    return tmp_path
+
+
+def test_update_avatar(client, headers, local_storage):
+    response = client.patch("/api/users/avatar", files={"file": ("avatar.png", PNG, "image/png")}, headers=headers)
+    assert response.status_code == 200, response.text
+    avatar = response.json()["avatar"]
+    assert avatar.startswith("/media/hw13/")
+    key = avatar.removeprefix("/media/").split("?")[0]
+    assert (local_storage / key).read_bytes() == PNG
+
+
+def test_update_avatar_unsupported_type(client, headers):
+    response = client.patch("/api/users/avatar", files={"file": ("avatar.txt", b"text", "text/plain")},
+                            headers=headers)
+    assert response.status_code == 415, response.text
+
+
+def test_update_avatar_too_large(client, headers, monkeypatch):
+    monkeypatch.setattr("src.services.cloud_image.settings.avatar_max_bytes", 16)
+    response = client.patch("/api/users/avatar", files={"file": ("avatar.png", PNG, "image/png")}, headers=headers)
+    assert response.status_code == 413, response.text
+
+
+def test_update_avatar_background(client, headers):
+    response = client.patch("/api/users/avatar", params={"background": True},
+                            files={"file": ("avatar.png", PNG, "image/png")}, headers=headers)
+    assert response.status_code == 202, response.text
+    job_id = response.json()["job_id"]
+    assert response.json()["status"] == "pending"
+    assert asyncio.run(Worker(job_queue, session_factory=TestingAsyncSessionLocal).drain()) == 1
+    response = client.get(f"/api/users/avatar/jobs/{job_id}", headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["status"] == "done", data
+    response = client.get("/api/users/me/", headers=headers)
+    assert response.json()["avatar"] == data["avatar"]
+
+
+def test_update_avatar_pipeline(client, headers, local_storage, monkeypatch):
+    image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    image.new("RGB", (400, 300), "red").save(buffer, "PNG")
+    monkeypatch.setattr("src.services.avatar_pipeline.settings.avatar_pipeline", True)
+    response = client.patch("/api/users/avatar", files={"file": ("avatar.png", buffer.getvalue(), "image/png")},
+                            headers=headers)
+    assert response.status_code == 200, response.text
+    avatar = response.json()["avatar"]
+    assert avatar.startswith("/media/avatars/") and avatar.endswith("/250.webp")
+    digest_dir = local_storage / avatar.removeprefix("/media/").rsplit("/", 1)[0]
+    assert sorted(path.name for path in digest_dir.iterdir()) == ["250.jpeg", "250.webp", "64.jpeg", "64.webp"]
+    assert image.open(digest_dir / "64.jpeg").size == (64, 64)
+
+    media = FastAPI()
+    media.mount("/media", MediaFiles(directory=str(local_storage)))
+    response = TestClient(media).get(avatar)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "immutable" in response.headers["cache-control"]
+
+
+def png_header(width, height):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'')) + chunk(b'IEND', b''))
+
+
+def test_update_avatar_pipeline_too_many_pixels(client, headers, monkeypatch):
+    pytest.importorskip("PIL.Image")
+    monkeypatch.setattr("src.services.avatar_pipeline.settings.avatar_pipeline", True)
+    # A few bytes that claim 81M pixels, below the decompression bomb limit of Pillow
+    response = client.patch("/api/users/avatar", files={"file": ("avatar.png", png_header(9000, 9000), "image/png")},
+                            headers=headers)
+    assert response.status_code == 413, response.text
+    assert response.json()["detail"] == "Image is too large"
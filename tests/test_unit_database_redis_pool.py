@@ -0,0 +1,33 @@
+import unittest
+from unittest.mock import patch
+
+from src.conf.config import settings
+from src.database.redis_pool import RedisPool
+
+
+class Component:
+    def __init__(self):
+        self.redis = None
+
+    def set_redis(self, client):
+        self.redis = client
+
+
+class TestRedisPool(unittest.IsolatedAsyncioTestCase):
+    async def test_open_and_close(self):
+        pool = RedisPool()
+        before, after = Component(), Component()
+        pool.attach(before)
+        # Nothing listens on port 1: the pool still opens, Redis is reported unavailable
+        with patch.object(settings, "redis_port", 1), patch.object(settings, "redis_max_connections", 7):
+            client = await pool.open()
+        pool.attach(after)
+        self.assertIs(before.redis, client)
+        self.assertIs(after.redis, client)
+        self.assertFalse(await pool.ping())
+        status = pool.status()
+        self.assertEqual((status["open"], status["max_connections"], status["in_use"]), (True, 7, 0))
+
+        await pool.close()
+        self.assertIsNone(before.redis)
+        self.assertEqual(pool.status(), {"open": False})
@@ -2,44 +2,56 @@ import unittest
 from datetime import date
 from unittest.mock import MagicMock
 
-from sqlalchemy.orm import Session
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Contact
+from src.database.models import Contact, User
 from src.schemas import ContactModel
-from src.repository.contacts import get_contacts, get_contact_by_id, create, get_contact_by_email, update, remove, \
-    find_contact_by_firstname, find_contact_by_lastname, get_birthday
+from src.repository.contacts import get_contacts, get_contacts_after, get_contact_by_id, create, get_contact_by_email, update, remove, \
+    find_contact_by_firstname, find_contact_by_lastname, get_birthday, search_contacts, get_existing_emails, create_many, \
+    get_existing_ids, get_email_owners, apply_batch, upsert
 
 
 class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
+        self.result = MagicMock()
+        self.session.execute.return_value = self.result
+        self.user = User(id=1)
 
     async def test_get_contacts(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query(Contact).limit().offset().all.return_value = contacts
-        result = await get_contacts(10, 0, self.session)
+        self.result.scalars().all.return_value = contacts
+        result = await get_contacts(10, 0, self.user, self.session)
+        self.assertEqual(result, contacts)
+
+    async def test_get_contacts_after(self):
+        contacts = [Contact(), Contact()]
+        self.result.scalars().all.return_value = contacts
+        result = await get_contacts_after(10, 'last_name', ['Petrenko', 5], self.user, self.session)
         self.assertEqual(result, contacts)
 
     async def test_get_contact_by_id_found(self):
         contact = Contact()
-        self.session.query().filter_by().first.return_value = contact
-        result = await get_contact_by_id(contact_id=1, db=self.session)
+        self.result.scalar_one_or_none.return_value = contact
+        result = await get_contact_by_id(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_get_contact_by_id_not_found(self):
-        self.session.query().filter_by().first.return_value = None
-        result = await get_contact_by_id(contact_id=1, db=self.session)
+        self.result.scalar_one_or_none.return_value = None
+        result = await get_contact_by_id(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_get_contact_by_email_found(self):
         contact = Contact()
-        self.session.query().filter_by().first.return_value = contact
-        result = await get_contact_by_email(email='test@meta.ua', db=self.session)
+        self.result.scalar_one_or_none.return_value = contact
+        result = await get_contact_by_email(email='test@meta.ua', user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_get_contact_by_email_not_found(self):
-        self.session.query().filter_by().first.return_value = None
-        result = await get_contact_by_email(email='test@meta.ua', db=self.session)
+        self.result.scalar_one_or_none.return_value = None
+        result = await get_contact_by_email(email='test@meta.ua', user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_create_contact(self):
@@ -50,12 +62,82 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
             phone='+380123456789',
             birthday=date(1995, 2, 8)
         )
-        result = await create(body, self.session)
+        result = await create(body, self.user, self.session)
         self.assertEqual(result.first_name, body.first_name)
         self.assertEqual(result.last_name, body.last_name)
         self.assertEqual(result.email, body.email)
         self.assertEqual(result.phone, body.phone)
         self.assertEqual(result.birthday, body.birthday)
+        self.assertEqual(result.birthday_md, 208)
+        self.assertEqual(result.user_id, 1)
+
+    async def test_create_contact_on_conflict(self):
+        self.session.get_bind.return_value.dialect.name = 'sqlite'
+        body = ContactModel(first_name='Petro', last_name='Petrenko', email='petpetrenko@meta.ua',
+                            birthday=date(1995, 2, 8))
+        self.result.scalar_one_or_none.return_value = None
+        result = await create(body, self.user, self.session)
+        self.assertIsNone(result)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertIn('ON CONFLICT', str(stmt.compile(dialect=sqlite.dialect())))
+        self.session.add.assert_not_called()
+
+    async def test_upsert(self):
+        self.session.get_bind.return_value.dialect.name = 'postgresql'
+        body = ContactModel(first_name='Petro', last_name='Petrenko', email='petpetrenko@meta.ua',
+                            birthday=date(1995, 2, 8))
+        contact = Contact(id=3)
+        self.result.scalar_one.return_value = contact
+        result = await upsert(body, self.user, self.session)
+        self.assertEqual(result, contact)
+        self.session.execute.assert_awaited_once()
+        self.session.commit.assert_awaited_once()
+
+    async def test_upsert_fallback_contact_removed(self):
+        body = ContactModel(first_name='Petro', last_name='Petrenko', email='petpetrenko@meta.ua',
+                            birthday=date(1995, 2, 8))
+        # The insert conflicts, but the conflicting contact is gone when it is looked up
+        self.session.commit.side_effect = IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed'))
+        self.result.scalar_one_or_none.return_value = None
+        result = await upsert(body, self.user, self.session)
+        self.assertIsNone(result)
+        self.assertEqual(self.session.rollback.await_count, 3)
+
+    async def test_get_existing_emails(self):
+        self.result.scalars().all.return_value = ['petpetrenko@meta.ua']
+        result = await get_existing_emails(['petpetrenko@meta.ua', 'new@meta.ua'], self.user, self.session)
+        self.assertEqual(result, {'petpetrenko@meta.ua'})
+
+    async def test_create_many(self):
+        bodies = [ContactModel(first_name='Petro', last_name='Petrenko', email=f'petro{i}@meta.ua',
+                               birthday=date(1995, 2, 8)) for i in range(3)]
+        result = await create_many(bodies, self.user, self.session)
+        self.assertEqual(result, 3)
+        rows = self.session.execute.call_args.args[1]
+        self.assertEqual([row['email'] for row in rows], ['petro0@meta.ua', 'petro1@meta.ua', 'petro2@meta.ua'])
+        self.assertEqual((rows[0]['birthday_md'], rows[0]['user_id']), (208, 1))
+        self.session.commit.assert_awaited_once()
+
+    async def test_get_existing_ids(self):
+        self.result.scalars().all.return_value = [1]
+        result = await get_existing_ids([1, 2], self.user, self.session)
+        self.assertEqual(result, {1})
+
+    async def test_get_email_owners(self):
+        self.result.tuples().all.return_value = [('petpetrenko@meta.ua', 1)]
+        result = await get_email_owners(['petpetrenko@meta.ua', 'new@meta.ua'], self.user, self.session)
+        self.assertEqual(result, {'petpetrenko@meta.ua': 1})
+
+    async def test_apply_batch(self):
+        body = ContactModel(first_name='Petro', last_name='Petrenko', email='petpetrenko@meta.ua',
+                            birthday=date(1995, 2, 8))
+        self.result.scalars().all.return_value = [7]
+        result = await apply_batch([body], {2: body}, [3], self.user, self.session)
+        self.assertEqual(result, [7])
+        self.assertEqual(self.session.execute.await_count, 3)
+        updates = self.session.execute.call_args_list[1].args[1]
+        self.assertEqual((updates[0]['id'], updates[0]['birthday_md']), (2, 208))
+        self.session.commit.assert_awaited_once()
 
     async def test_update_contact_found(self):
         body = ContactModel(
@@ -66,11 +148,22 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
             birthday=date(1995, 2, 8)
         )
         contact = Contact()
-        self.session.query().filter_by().first.return_value = contact
+        self.result.scalar_one_or_none.return_value = contact
         self.session.commit.return_value = None
-        result = await update(contact_id=1, body=body, db=self.session)
+        result = await update(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
+    async def test_update_contact_without_returning(self):
+        self.session.get_bind.return_value.dialect.update_returning = False
+        body = ContactModel(first_name='Petro', last_name='Petrenko', email='petpetrenko@meta.ua',
+                            phone='+380123456789', birthday=date(1995, 2, 8))
+        contact = Contact(id=1, first_name='Old', email='old@meta.ua', user_id=1)
+        self.result.scalar_one_or_none.return_value = contact
+        result = await update(contact_id=1, body=body, user=self.user, db=self.session)
+        self.assertEqual(result, contact)
+        self.assertEqual((contact.first_name, contact.email, contact.birthday_md), ('Petro', 'petpetrenko@meta.ua', 208))
+        self.session.refresh.assert_awaited_once_with(contact)
+
     async def test_update_contact_not_found(self):
         body = ContactModel(
             first_name='Petro',
@@ -79,36 +172,44 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
             phone='+380123456789',
             birthday=date(1995, 2, 8)
         )
-        self.session.query().filter_by().first.return_value = None
+        self.result.scalar_one_or_none.return_value = None
         self.session.commit.return_value = None
-        result = await update(contact_id=1, body=body, db=self.session)
+        result = await update(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_remove_contact_found(self):
         contact = Contact()
-        self.session.query().filter_by().first.return_value = contact
-        result = await remove(contact_id=1, db=self.session)
+        self.result.scalar_one_or_none.return_value = contact
+        result = await remove(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_remove_contact_not_found(self):
-        self.session.query().filter_by().first.return_value = None
-        result = await remove(contact_id=1, db=self.session)
+        self.result.scalar_one_or_none.return_value = None
+        result = await remove(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_find_contact_by_firstname(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().all.return_value = contacts
-        result = await find_contact_by_firstname(contact_firstname='Petro', db=self.session)
+        self.result.scalars().all.return_value = contacts
+        result = await find_contact_by_firstname(contact_firstname='Petro', user=self.user, db=self.session)
         self.assertEqual(result, contacts)
 
     async def test_find_contact_by_lastname(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().all.return_value = contacts
-        result = await find_contact_by_lastname(contact_lastname='Petrenko', db=self.session)
+        self.result.scalars().all.return_value = contacts
+        result = await find_contact_by_lastname(contact_lastname='Petrenko', user=self.user, db=self.session)
+        self.assertEqual(result, contacts)
+
+    async def test_search_contacts(self):
+        contacts = [Contact(), Contact()]
+        self.session.get_bind().dialect.name = 'sqlite'
+        self.result.scalars().all.return_value = contacts
+        result = await search_contacts(query='Pet', fields=['first_name', 'email'], fuzzy=False, limit=10,
+                                       user=self.user, db=self.session)
         self.assertEqual(result, contacts)
 
     async def test_get_birthday(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().all.return_value = contacts
-        result = await get_birthday(db=self.session)
+        self.result.scalars().all.return_value = contacts
+        result = await get_birthday(days=7, user=self.user, db=self.session)
         self.assertEqual(result, contacts)
@@ -1,26 +1,28 @@
 import unittest
 from unittest.mock import MagicMock
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
 from src.schemas import UserModel
 
-from src.repository.users import get_user_by_email, create_user, update_token, confirmed_email, update_avatar
+from src.repository.users import get_user_by_email, create_user, confirmed_email, update_avatar
 
 
 class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
+        self.result = MagicMock()
+        self.session.execute.return_value = self.result
 
     async def test_get_user_by_email_found(self):
         user = User()
-        self.session.query().filter_by().first.return_value = user
+        self.result.scalar_one_or_none.return_value = user
         result = await get_user_by_email(email='test@test.ua', db=self.session)
         self.assertEqual(result, user)
 
     async def test_get_user_by_email_not_found(self):
-        self.session.query().filter_by().first.return_value = None
+        self.result.scalar_one_or_none.return_value = None
         result = await get_user_by_email(email='test@test.ua', db=self.session)
         self.assertIsNone(result)
 
@@ -35,21 +37,12 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.email, body.email)
         self.assertEqual(result.password, body.password)
 
-    async def test_update_token(self):
-        user = User()
-        user.refresh_token = None
-        refresh_token = 'test_token'
-        await update_token(user=user, refresh_token=refresh_token, db=self.session)
-        self.assertEqual(user.refresh_token, refresh_token)
-
     async def test_confirmed_email(self):
         user = User(email='test@test.ua', confirmed=False)
-        self.session.add(user)
-        self.session.commit()
-        user_id = user.id
+        self.result.scalar_one_or_none.return_value = user
         await confirmed_email(email=user.email, db=self.session)
-        result = self.session.query(User).get(user_id)
-        self.assertTrue(result.confirmed)
+        self.assertTrue(user.confirmed)
+        self.session.commit.assert_awaited_once()
 
     async def test_update_avatar(self):
         user = User()
@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.database.models import User
+from src.services.cache import CachedResponse, ContactCache, TTLCache, UserCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expired_entry_is_a_miss(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        with patch('src.services.cache.time.monotonic', return_value=0):
+            cache.set('a', 1)
+        with patch('src.services.cache.time.monotonic', return_value=61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(len(cache), 0)
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+    async def test_set_get_invalidate(self):
+        cache = UserCache(maxsize=10, ttl=60)
+        await cache.set(User(id=1, email='test@test.ua', username='testtest', password='hash', confirmed=True))
+        result = await cache.get('test@test.ua')
+        self.assertEqual(result.id, 1)
+        self.assertTrue(result.confirmed)
+        self.assertIsNone(result.password)
+        await cache.invalidate('test@test.ua')
+        self.assertIsNone(await cache.get('test@test.ua'))
+
+
+class TestContactCache(unittest.IsolatedAsyncioTestCase):
+    async def test_invalidate(self):
+        cache = ContactCache(maxsize=10, ttl=60)
+        entry = CachedResponse.from_body('{"id": 1}')
+        await cache.set(1, 'contact:1', entry)
+        await cache.set(1, 'list:1', entry, collection=True)
+        await cache.set(2, 'list:1', entry, collection=True)
+        self.assertEqual(await cache.get(1, 'contact:1'), entry)
+        await cache.invalidate(1)
+        self.assertEqual(await cache.get(1, 'contact:1'), entry)
+        self.assertIsNone(await cache.get(1, 'list:1', collection=True))
+        self.assertEqual(await cache.get(2, 'list:1', collection=True), entry)
+        await cache.invalidate(1, [1])
+        self.assertIsNone(await cache.get(1, 'contact:1'))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (3, 2))
+
+    async def test_contact_is_not_kept_locally_with_redis(self):
+        redis = MagicMock()
+        redis.get = AsyncMock(return_value=None)
+        redis.set = AsyncMock()
+        cache = ContactCache(maxsize=10, ttl=60, redis_client=redis)
+        entry = CachedResponse.from_body('{"id": 1}')
+        await cache.set(1, 'contact:1', entry)
+        self.assertEqual(len(cache.local), 0)
+        redis.set.assert_awaited_once()
+        # Another worker dropped the contact from Redis: it is not served from this worker's memory
+        self.assertIsNone(await cache.get(1, 'contact:1'))
+        redis.get.assert_awaited_with('contacts:1:contact:1')
+
+    async def test_get_or_load(self):
+        cache = ContactCache(maxsize=10, ttl=60)
+        loads = []
+
+        async def load():
+            loads.append(1)
+            return CachedResponse.from_body('[]')
+
+        request = MagicMock(headers={})
+        response = await cache.get_or_load(request, 1, 'list:1', load, collection=True)
+        self.assertEqual(response.status_code, 200)
+        request.headers = {'if-none-match': response.headers['etag']}
+        response = await cache.get_or_load(request, 1, 'list:1', load, collection=True)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(cache.stats['not_modified'], 1)
+
+    async def test_load_racing_an_invalidate_is_not_stored(self):
+        cache = ContactCache(maxsize=10, ttl=60)
+        request = MagicMock(headers={})
+
+        async def stale_load():
+            # The contact is updated and invalidated after it was read, before the load stores it
+            await cache.invalidate(1, [1])
+            return CachedResponse.from_body('{"name": "old"}')
+
+        async def load():
+            return CachedResponse.from_body('{"name": "new"}')
+
+        response = await cache.get_or_load(request, 1, 'contact:1', stale_load)
+        self.assertEqual(response.body, b'{"name": "old"}')
+        self.assertIsNone(await cache.get(1, 'contact:1'))
+        response = await cache.get_or_load(request, 1, 'contact:1', load)
+        self.assertEqual(response.body, b'{"name": "new"}')
+        self.assertEqual(await cache.get(1, 'contact:1'), CachedResponse.from_body('{"name": "new"}'))
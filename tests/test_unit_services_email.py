@@ -0,0 +1,54 @@
+import unittest
+from email.message import EmailMessage
+
+from src.services.email import MailDispatcher, build_confirmation_email
+from tests.smtp_server import SMTPStub
+
+
+class TestMailDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await SMTPStub().start()
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    def dispatcher(self, **kwargs):
+        return MailDispatcher(hostname=self.server.host, port=self.server.port, use_tls=False, pool_size=2,
+                              retry_backoff=0, **kwargs)
+
+    async def test_messages_share_pooled_connections(self):
+        dispatcher = self.dispatcher()
+        for i in range(10):
+            await dispatcher.enqueue(build_confirmation_email(f'user{i}@test.ua', 'testtest', 'http://test/'))
+        await dispatcher.stop()
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertLessEqual(self.server.connections, 2)
+        self.assertEqual(dispatcher.stats['sent'], 10)
+        self.assertIn(b'http://test/api/auth/confirmed_email/', self.server.messages[0])
+
+    async def test_retry_after_failure(self):
+        self.server.fail_first = 1
+        dispatcher = self.dispatcher(max_retries=2)
+        await dispatcher.enqueue(build_confirmation_email('user@test.ua', 'testtest', 'http://test/'))
+        await dispatcher.stop()
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(dispatcher.stats['retries'], 1)
+
+    async def test_give_up_after_max_retries(self):
+        self.server.fail_first = 3
+        dispatcher = self.dispatcher(max_retries=1)
+        await dispatcher.enqueue(build_confirmation_email('user@test.ua', 'testtest', 'http://test/'))
+        await dispatcher.stop()
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(dispatcher.stats['failed'], 1)
+
+    async def test_invalid_message_does_not_stop_the_worker(self):
+        dispatcher = self.dispatcher()
+        message = EmailMessage()
+        message['To'] = 'user@test.ua'
+        with self.assertRaises(ValueError):
+            await dispatcher.send(message)
+        await dispatcher.send(build_confirmation_email('user@test.ua', 'testtest', 'http://test/'))
+        await dispatcher.stop()
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual((dispatcher.stats['sent'], dispatcher.stats['failed']), (1, 1))
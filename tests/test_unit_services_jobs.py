@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+
+from src.services.jobs import MemoryJobQueue, TASKS, Worker, task
+
+
+class TestWorker(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.queue = MemoryJobQueue()
+        self.worker = Worker(self.queue, concurrency=4, max_retries=2, retry_backoff=0, poll_interval=0.01)
+        self.calls = []
+        self.dead = []
+
+    def tearDown(self):
+        for name in ("record", "flaky", "broken", "limited"):
+            TASKS.pop(name, None)
+
+    async def test_job_done(self):
+        @task("record")
+        async def record(value):
+            self.calls.append(value)
+
+        await self.queue.enqueue("record", value=1)
+        self.assertEqual((await self.queue.metrics())["pending"], 1)
+        self.assertEqual(await self.worker.drain(), 1)
+        self.assertEqual(self.calls, [1])
+        metrics = await self.queue.metrics()
+        self.assertEqual(metrics["pending"] + metrics["processing"], 0)
+        self.assertEqual(metrics["stats"], {"enqueued": 1, "done": 1})
+
+    async def test_job_retried(self):
+        @task("flaky")
+        async def flaky():
+            self.calls.append(None)
+            if len(self.calls) < 2:
+                raise ConnectionError("down")
+
+        await self.queue.enqueue("flaky")
+        self.worker.retry_backoff = 60
+        await self.worker.drain()
+        self.assertEqual((await self.queue.metrics())["delayed"], 1)
+        self.queue.delayed = [(0, job) for _, job in self.queue.delayed]
+        self.assertEqual(await self.worker.drain(), 1)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual((await self.queue.metrics())["stats"], {"enqueued": 1, "retried": 1, "done": 1})
+
+    async def test_job_dead_lettered(self):
+        async def on_dead(job, err):
+            self.dead.append((job["id"], str(err)))
+
+        @task("broken", on_dead=on_dead)
+        async def broken():
+            raise ValueError("boom")
+
+        job_id = await self.queue.enqueue("broken")
+        await self.worker.drain()
+        metrics = await self.queue.metrics()
+        self.assertEqual((metrics["dead"], metrics["delayed"]), (1, 0))
+        self.assertEqual(self.queue.dead[0]["attempts"], 3)
+        self.assertEqual(self.dead, [(job_id, "boom")])
+
+    async def test_unknown_task_dead_lettered(self):
+        await self.queue.enqueue("missing")
+        await self.worker.drain()
+        self.assertEqual(self.queue.dead[0]["error"], "Unknown task missing")
+
+    async def test_queue_failure_keeps_consumer(self):
+        @task("record")
+        async def record(value):
+            self.calls.append(value)
+
+        ack = self.queue.ack
+
+        async def failing_ack(job):
+            if job["kwargs"]["value"] == 1:
+                raise ConnectionError("down")
+            await ack(job)
+
+        self.queue.ack = failing_ack
+        self.worker.concurrency = 1
+        await self.queue.enqueue("record", value=1)
+        await self.queue.enqueue("record", value=2)
+        runner = asyncio.create_task(self.worker.run())
+        while (await self.queue.metrics())["stats"].get("done", 0) < 1:
+            await asyncio.sleep(0.01)
+        self.worker.stop()
+        await runner
+        self.assertEqual(self.calls, [1, 2])
+        # The job whose ack failed is left for redelivery
+        self.assertEqual((await self.queue.metrics())["processing"], 1)
+
+    async def test_task_concurrency_limit(self):
+        running = []
+
+        @task("limited", concurrency=2)
+        async def limited():
+            running.append(1)
+            self.calls.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        for _ in range(6):
+            await self.queue.enqueue("limited")
+        runner = asyncio.create_task(self.worker.run())
+        while (await self.queue.metrics())["stats"].get("done", 0) < 6:
+            await asyncio.sleep(0.01)
+        self.worker.stop()
+        await runner
+        self.assertEqual(max(self.calls), 2)
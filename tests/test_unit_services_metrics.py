@@ -0,0 +1,87 @@
+import unittest
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from src.services.metrics import Histogram, RequestMetrics, instrument_engine, record, request_timings, server_timing
+
+
+class TestMetrics(unittest.TestCase):
+    def test_record_outside_request(self):
+        record("db", 0.5)
+        self.assertIsNone(request_timings.get())
+
+    def test_record_in_request(self):
+        timings = {}
+        token = request_timings.set(timings)
+        try:
+            record("redis", 0.001)
+            record("redis", 0.002)
+        finally:
+            request_timings.reset(token)
+        self.assertEqual(timings["redis"][0], 2)
+        self.assertAlmostEqual(timings["redis"][1], 0.003)
+
+    def test_instrument_engine(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        timings = {}
+        token = request_timings.set(timings)
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
+        finally:
+            request_timings.reset(token)
+        self.assertEqual(timings["db"][0], 2)
+
+    def test_failed_statement(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        timings = {}
+        token = request_timings.set(timings)
+        try:
+            with engine.connect() as conn:
+                with self.assertRaises(OperationalError):
+                    conn.execute(text("SELECT * FROM missing"))
+                self.assertEqual(conn.info["query_started"], [])
+                conn.execute(text("SELECT 1"))
+        finally:
+            request_timings.reset(token)
+        self.assertEqual(timings["db"][0], 2)
+
+    def test_histogram(self):
+        histogram = Histogram("latency", "Latency.", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(("/a",), value)
+        self.assertEqual(histogram.render(), [
+            "# HELP latency Latency.",
+            "# TYPE latency histogram",
+            'latency_bucket{route="/a",le="0.1"} 1',
+            'latency_bucket{route="/a",le="1.0"} 2',
+            'latency_bucket{route="/a",le="+Inf"} 3',
+            'latency_sum{route="/a"} 5.55',
+            'latency_count{route="/a"} 3',
+        ])
+
+    def test_label_escaping(self):
+        histogram = Histogram("latency", "Latency.", ("route",), buckets=())
+        histogram.observe(('/a"b\\',), 1)
+        self.assertIn('latency_count{route="/a\\"b\\\\"} 1', histogram.render())
+
+    def test_request_metrics(self):
+        metrics = RequestMetrics()
+        metrics.observe("GET", "/api/contacts/", 200, 0.02, {"db": [3, 0.004], "redis": [1, 0.001]})
+        rendered = metrics.render()
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/api/contacts/",status="200"} 1',
+                      rendered)
+        self.assertIn('http_request_db_queries_bucket{method="GET",route="/api/contacts/",le="5"} 1', rendered)
+        self.assertIn('http_request_dependency_calls_total{method="GET",route="/api/contacts/",dependency="db"} 3',
+                      rendered)
+
+    def test_server_timing(self):
+        self.assertEqual(server_timing({"db": [2, 0.0031]}, 0.0054), 'db;dur=3.10;desc="2 calls", total;dur=5.40')
+
+
+if __name__ == '__main__':
+    unittest.main()
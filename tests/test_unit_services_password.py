@@ -0,0 +1,32 @@
+import unittest
+
+from fastapi import HTTPException
+
+from src.services.password import PasswordHasher
+
+
+class TestPasswordHasher(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher(rounds=4, workers=2, max_pending=4)
+
+    async def test_hash_and_verify(self):
+        hashed = await self.hasher.hash('12345678')
+        valid, new_hash = await self.hasher.verify_and_update('12345678', hashed)
+        self.assertTrue(valid)
+        self.assertIsNone(new_hash)
+        valid, new_hash = await self.hasher.verify_and_update('password', hashed)
+        self.assertFalse(valid)
+        self.assertEqual(self.hasher.stats()['completed'], 3)
+
+    async def test_rehash_on_cost_change(self):
+        hashed = await PasswordHasher(rounds=5, workers=1, max_pending=1).hash('12345678')
+        valid, new_hash = await self.hasher.verify_and_update('12345678', hashed)
+        self.assertTrue(valid)
+        self.assertTrue(new_hash.startswith('$2b$04$'))
+
+    async def test_reject_when_queue_is_full(self):
+        self.hasher.pending = self.hasher.max_pending
+        with self.assertRaises(HTTPException) as err:
+            await self.hasher.hash('12345678')
+        self.assertEqual(err.exception.status_code, 503)
+        self.assertEqual(self.hasher.stats()['rejected'], 1)
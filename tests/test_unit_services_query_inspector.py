@@ -0,0 +1,115 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from src.services.query_inspector import QueryBudgetExceeded, QueryInspector, explain_scans, statement_shape
+
+
+class TestQueryInspector(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.inspector = QueryInspector(enabled=True, slow_ms=100, repeat_threshold=3)
+        self.inspector.inspect_engine(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE notes (id INTEGER PRIMARY KEY, title TEXT, tag TEXT)"))
+            conn.execute(text("CREATE INDEX ix_notes_tag ON notes (tag)"))
+
+    def test_statement_shape(self):
+        self.assertEqual(statement_shape("SELECT *\n  FROM notes WHERE id IN (?, ?, ?)"),
+                         "SELECT * FROM notes WHERE id IN (?)")
+        self.assertEqual(statement_shape("SELECT * FROM notes WHERE id IN ($1, $2) AND tag = $3"),
+                         "SELECT * FROM notes WHERE id IN (?) AND tag = ?")
+
+    def test_nothing_recorded_without_log(self):
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(self.inspector.plans, {})
+
+    def test_repeated_statements(self):
+        with self.inspector.capture() as log, self.engine.connect() as conn:
+            for i in range(4):
+                conn.execute(text("SELECT title FROM notes WHERE id = :id"), {"id": i})
+            conn.execute(text("SELECT count(*) FROM notes"))
+        self.assertEqual(len(log), 5)
+        self.assertEqual(log.repeated(3), {"SELECT title FROM notes WHERE id = ?": 4})
+
+    def test_full_scan(self):
+        with self.inspector.capture() as log, self.engine.connect() as conn:
+            conn.execute(text("SELECT id FROM notes WHERE title = :title"), {"title": "a"})
+            conn.execute(text("SELECT id FROM notes WHERE tag = :tag"), {"tag": "a"})
+        self.assertEqual([query.scans for query in log.queries], [["notes"], []])
+        self.assertEqual(log.findings(3, 1.0), ["full scan of notes: SELECT id FROM notes WHERE title = ?"])
+
+    def test_slow(self):
+        with self.inspector.capture() as log, self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(log.slow(0.0), log.queries)
+        self.assertEqual(log.slow(60.0), [])
+
+    def test_failed_statement(self):
+        with self.inspector.capture() as log, self.engine.connect() as conn:
+            with self.assertRaises(OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+            self.assertEqual(conn.info["inspected_started"], [])
+            conn.execute(text("SELECT 1"))
+        self.assertEqual([query.shape for query in log.queries], ["SELECT 1"])
+
+    def test_failed_explain(self):
+        self.inspector.plans.clear()
+        explain = MagicMock(side_effect=OperationalError("EXPLAIN", {}, Exception("no such function")))
+        with self.assertLogs("src.services.query_inspector", "WARNING") as logs:
+            with patch("src.services.query_inspector.explain_scans", explain):
+                with self.inspector.capture() as log, self.engine.connect() as conn:
+                    conn.execute(text("SELECT id FROM notes WHERE title = :title"), {"title": "a"})
+        self.assertIn("EXPLAIN failed for SELECT id FROM notes WHERE title = ?", logs.output[0])
+        self.assertEqual(log.queries[0].scans, [])
+
+    def test_explain_under_savepoint_on_postgresql(self):
+        conn = MagicMock()
+        conn.dialect.name = "postgresql"
+        cursor = conn.connection.cursor.return_value
+
+        def execute(statement, *args):
+            if statement.startswith("EXPLAIN"):
+                raise RuntimeError("function unicode_lower(text) does not exist")
+
+        cursor.execute.side_effect = execute
+        with self.assertRaises(RuntimeError):
+            explain_scans(conn, "SELECT id FROM notes WHERE title = $1", ("a",))
+        self.assertEqual([call.args[0] for call in cursor.execute.call_args_list],
+                         ["SAVEPOINT query_inspector_explain",
+                          "EXPLAIN (FORMAT JSON) SELECT id FROM notes WHERE title = $1",
+                          "ROLLBACK TO SAVEPOINT query_inspector_explain",
+                          "RELEASE SAVEPOINT query_inspector_explain"])
+        cursor.close.assert_called_once()
+
+    def test_budget(self):
+        with self.inspector.budget(2), self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with self.inspector.budget(1), self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
+        self.assertIn("2 queries, the budget is 1", str(raised.exception))
+
+    def test_request_log(self):
+        log = self.inspector.start_request()
+        with self.engine.connect() as conn:
+            for i in range(3):
+                conn.execute(text("SELECT title FROM notes WHERE id = :id"), {"id": i})
+        with self.assertLogs("src.services.query_inspector", "WARNING") as logs:
+            self.inspector.finish_request(log, "GET /notes")
+        self.assertIn("GET /notes ran 3 queries", logs.output[0])
+        self.assertIn("3 x SELECT title FROM notes WHERE id = ?", logs.output[0])
+        self.assertIsNone(self.inspector.current.get())
+
+    def test_disabled_request_log(self):
+        self.inspector.enabled = False
+        self.assertIsNone(self.inspector.start_request())
+
+
+if __name__ == '__main__':
+    unittest.main()
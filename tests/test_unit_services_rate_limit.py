@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from redis.exceptions import ConnectionError
+
+from src.services.rate_limit import LocalBuckets, RateLimiter, parse_policy
+
+
+class TestLocalBuckets(unittest.TestCase):
+    def test_limit_and_refill(self):
+        buckets = LocalBuckets()
+        with patch("src.services.rate_limit.time.monotonic", return_value=100.0) as monotonic:
+            results = [buckets.hit(["ip:1"], [(2, 10)]) for _ in range(3)]
+            self.assertEqual([result.allowed for result in results], [True, True, False])
+            self.assertEqual(results[1].headers(), {"X-RateLimit-Limit": "2", "X-RateLimit-Remaining": "0",
+                                                    "X-RateLimit-Reset": "10"})
+            self.assertEqual(results[2].headers()["Retry-After"], "5")
+            monotonic.return_value = 105.0
+            self.assertTrue(buckets.hit(["ip:1"], [(2, 10)]).allowed)
+
+    def test_all_buckets_must_allow(self):
+        buckets = LocalBuckets()
+        with patch("src.services.rate_limit.time.monotonic", return_value=100.0):
+            self.assertTrue(buckets.hit(["route", "user"], [(5, 60), (1, 60)]).allowed)
+            result = buckets.hit(["route", "user"], [(5, 60), (1, 60)])
+            self.assertEqual((result.allowed, result.limit), (False, 1))
+            # The denied request did not take a token from the route bucket
+            self.assertEqual(buckets.hit(["route"], [(5, 60)]).remaining, 3)
+
+    def test_parse_policy(self):
+        self.assertEqual(parse_policy("2/5"), (2, 5.0))
+        with self.assertRaises(ValueError):
+            parse_policy("0/5")
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.script = AsyncMock()
+        self.redis.register_script.return_value = self.script
+        self.limiter = RateLimiter({"contacts_list": "2/5", "user": "600/60"}, redis_client=self.redis)
+
+    async def test_redis(self):
+        self.script.return_value = [1, "1.0", "599.0"]
+        result = await self.limiter.hit("user:1", ["contacts_list", "user"])
+        self.assertEqual((result.allowed, result.limit, result.remaining), (True, 2, 1))
+        self.script.assert_awaited_once_with(keys=["ratelimit:contacts_list:user:1", "ratelimit:user:user:1"],
+                                             args=[2, 5.0, 600, 60.0])
+
+    async def test_fallback_when_redis_is_down(self):
+        self.script.side_effect = ConnectionError("refused")
+        results = [await self.limiter.hit("user:1", ["contacts_list"]) for _ in range(3)]
+        self.assertEqual([result.allowed for result in results], [True, True, False])
+        self.assertEqual(self.script.await_count, 1)
+        metrics = self.limiter.metrics()
+        self.assertEqual((metrics["fallback"], metrics["redis_errors"], metrics["redis_available"]), (3, 1, False))
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import patch
+
+from src.services.refresh_tokens import MemoryRefreshTokenStore
+
+
+class TestMemoryRefreshTokenStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = MemoryRefreshTokenStore(ttl=60)
+
+    async def test_rotate(self):
+        sid, jti = await self.store.create("test@test.ua")
+        next_jti = await self.store.rotate("test@test.ua", sid, jti)
+        self.assertIsNotNone(next_jti)
+        self.assertNotEqual(next_jti, jti)
+        self.assertIsNotNone(await self.store.rotate("test@test.ua", sid, next_jti))
+
+    async def test_reuse_revokes_session(self):
+        sid, jti = await self.store.create("test@test.ua")
+        next_jti = await self.store.rotate("test@test.ua", sid, jti)
+        self.assertIsNone(await self.store.rotate("test@test.ua", sid, jti))
+        self.assertIsNone(await self.store.rotate("test@test.ua", sid, next_jti))
+
+    async def test_wrong_user(self):
+        sid, jti = await self.store.create("test@test.ua")
+        self.assertIsNone(await self.store.rotate("other@test.ua", sid, jti))
+        self.assertIsNotNone(await self.store.rotate("test@test.ua", sid, jti))
+
+    async def test_expired(self):
+        with patch("src.services.refresh_tokens.time.monotonic", return_value=100.0) as monotonic:
+            sid, jti = await self.store.create("test@test.ua")
+            monotonic.return_value = 161.0
+            self.assertIsNone(await self.store.rotate("test@test.ua", sid, jti))
+
+    async def test_revoke(self):
+        sid, jti = await self.store.create("test@test.ua")
+        other_sid, other_jti = await self.store.create("test@test.ua")
+        await self.store.revoke("test@test.ua", sid)
+        self.assertIsNone(await self.store.rotate("test@test.ua", sid, jti))
+        self.assertIsNotNone(await self.store.rotate("test@test.ua", other_sid, other_jti))
+
+    async def test_revoke_all(self):
+        sessions = [await self.store.create("test@test.ua") for _ in range(3)]
+        other_sid, other_jti = await self.store.create("other@test.ua")
+        self.assertEqual(sorted(await self.store.revoke_all("test@test.ua")), sorted(sid for sid, _ in sessions))
+        for sid, jti in sessions:
+            self.assertIsNone(await self.store.rotate("test@test.ua", sid, jti))
+        self.assertIsNotNone(await self.store.rotate("other@test.ua", other_sid, other_jti))
+        self.assertEqual(await self.store.revoke_all("test@test.ua"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
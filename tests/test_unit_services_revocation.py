@@ -0,0 +1,87 @@
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from redis.exceptions import ConnectionError
+
+from src.services.revocation import BloomFilter, RevocationList
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = [f"sid:{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        self.assertEqual(len(bloom), 1000)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"sid:{i}")
+        false_positives = sum(f"other:{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestRevocationList(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.exists = AsyncMock(return_value=0)
+        self.redis.get = AsyncMock(return_value=b"1")
+        self.redis.zrangebyscore = AsyncMock(return_value=[b"sid:remote"])
+        self.revocations = RevocationList(ttl=60, capacity=1000, redis_client=self.redis)
+
+    async def test_local(self):
+        revocations = RevocationList(ttl=60, capacity=1000)
+        await revocations.revoke(["sid:1"])
+        self.assertTrue(await revocations.is_revoked("sid:1"))
+        self.assertFalse(await revocations.is_revoked("sid:2"))
+        with patch("src.services.revocation.time.time", return_value=time.time() + 61):
+            self.assertFalse(await revocations.is_revoked("sid:1"))
+            await revocations.sync()
+        self.assertNotIn("sid:1", revocations.filter)
+
+    async def test_filter_miss_skips_redis(self):
+        self.assertFalse(await self.revocations.is_revoked("sid:1"))
+        self.redis.exists.assert_not_awaited()
+
+    async def test_sync_and_exact_check(self):
+        await self.revocations.sync()
+        self.redis.exists.return_value = 1
+        self.assertTrue(await self.revocations.is_revoked("sid:remote"))
+        self.redis.exists.assert_awaited_once_with("revoked:sid:remote")
+        # Same version, the filter is not rebuilt
+        await self.revocations.sync()
+        self.redis.zrangebyscore.assert_awaited_once()
+        self.assertEqual(self.revocations.stats["syncs"], 1)
+
+    async def test_false_positive_is_checked_in_redis(self):
+        await self.revocations.sync()
+        self.redis.exists.return_value = 0
+        self.assertFalse(await self.revocations.is_revoked("sid:remote"))
+        self.assertEqual(self.revocations.stats["redis_checks"], 1)
+
+    async def test_redis_failure_after_filter_hit_rejects(self):
+        await self.revocations.sync()
+        self.redis.exists.side_effect = ConnectionError("down")
+        self.assertTrue(await self.revocations.is_revoked("sid:remote"))
+
+    async def test_revoke_is_known_locally(self):
+        pipe = MagicMock()
+        pipe.execute = AsyncMock()
+        self.redis.pipeline.return_value.__aenter__ = AsyncMock(return_value=pipe)
+        self.redis.pipeline.return_value.__aexit__ = AsyncMock(return_value=False)
+        await self.revocations.revoke(["sid:1"])
+        pipe.set.assert_called_once_with("revoked:sid:1", 1, ex=60)
+        pipe.incr.assert_called_once_with("revoked:version")
+        self.assertTrue(await self.revocations.is_revoked("sid:1"))
+        self.redis.exists.assert_not_awaited()
+        # A rebuild from Redis keeps the entries revoked by this worker
+        await self.revocations.sync()
+        self.assertIn("sid:1", self.revocations.filter)
+        self.assertIn("sid:remote", self.revocations.filter)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from datetime import datetime
+from typing import List
+
+from pydantic import TypeAdapter
+
+from src.database.models import Contact
+from src.schemas import ContactResponse
+from src.services.serialization import orm_to_json
+
+
+class TestOrmToJson(unittest.TestCase):
+    def setUp(self):
+        self.contacts = [Contact(id=i, first_name='Petro', last_name='Petrenko', email=f'petro{i}@meta.ua',
+                                 phone='+380123456789', birthday=datetime(1995, 2, 8),
+                                 created_at=datetime(2023, 7, 1, 12, 30, 15, 250), updated_at=datetime(2023, 7, 2))
+                         for i in range(1, 4)]
+
+    def test_list_matches_response_model(self):
+        adapter = TypeAdapter(List[ContactResponse])
+        expected = adapter.dump_json(adapter.validate_python(self.contacts, from_attributes=True))
+        self.assertEqual(orm_to_json(ContactResponse, self.contacts), expected)
+
+    def test_row_matches_response_model(self):
+        expected = ContactResponse.model_validate(self.contacts[0]).model_dump_json().encode()
+        self.assertEqual(orm_to_json(ContactResponse, self.contacts[0]), expected)
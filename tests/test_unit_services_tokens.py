@@ -0,0 +1,121 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import JWTError, jwt
+
+from src.services.tokens import TokenVerifier, load_keys
+
+
+def write_key(keys_dir: str, kid: str, public_only: bool = False):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if public_only:
+        pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                            serialization.PublicFormat.SubjectPublicKeyInfo)
+    else:
+        pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    Path(keys_dir, f"{kid}.pem").write_bytes(pem)
+
+
+def claims(scope: str = "access_token", ttl: int = 60) -> dict:
+    return {"sub": "test@test.ua", "scope": scope, "exp": int(time.time()) + ttl}
+
+
+class TestTokenVerifier(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.keys_dir = tempfile.TemporaryDirectory()
+        write_key(cls.keys_dir.name, "k1")
+        write_key(cls.keys_dir.name, "k2")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.keys_dir.cleanup()
+
+    def verifier(self, active_kid=None):
+        return TokenVerifier(load_keys("secret", "HS256", self.keys_dir.name, "RS256"), active_kid=active_kid)
+
+    def test_secret_key(self):
+        verifier = self.verifier()
+        token = verifier.sign(claims())
+        self.assertNotIn("kid", jwt.get_unverified_header(token))
+        self.assertEqual(jwt.get_unverified_header(token)["alg"], "HS256")
+        self.assertEqual(verifier.verify(token, "access_token")["sub"], "test@test.ua")
+
+    def test_key_id(self):
+        verifier = self.verifier(active_kid="k1")
+        token = verifier.sign(claims())
+        self.assertEqual(jwt.get_unverified_header(token), {"alg": "RS256", "kid": "k1", "typ": "JWT"})
+        self.assertEqual(verifier.decode(token)["sub"], "test@test.ua")
+
+    def test_rotation(self):
+        old = self.verifier(active_kid="k1").sign(claims())
+        verifier = self.verifier(active_kid="k2")
+        new = verifier.sign(claims())
+        self.assertEqual(jwt.get_unverified_header(new)["kid"], "k2")
+        # Tokens signed with the previous key stay valid while its key is in the directory
+        self.assertEqual(verifier.verify(old, "access_token")["sub"], "test@test.ua")
+        with tempfile.TemporaryDirectory() as keys_dir:
+            Path(keys_dir, "k2.pem").write_bytes(Path(self.keys_dir.name, "k2.pem").read_bytes())
+            verifier.set_keys(load_keys("", "HS256", keys_dir, "RS256"), active_kid="k2")
+        with self.assertRaises(JWTError):
+            verifier.verify(old, "access_token")
+        self.assertEqual(verifier.verify(new, "access_token")["sub"], "test@test.ua")
+
+    def test_public_key_cannot_sign(self):
+        with tempfile.TemporaryDirectory() as keys_dir:
+            write_key(keys_dir, "public", public_only=True)
+            keys = load_keys("", "HS256", keys_dir, "RS256")
+        with self.assertRaises(ValueError):
+            TokenVerifier(keys, active_kid="public")
+
+    def test_algorithm_is_bound_to_key(self):
+        verifier = self.verifier(active_kid="k1")
+        # Signed with the secret key, but claiming to be a token of k1: only RS256 is accepted for k1
+        forged = jwt.encode(claims(), "secret", algorithm="HS256", headers={"kid": "k1"})
+        with self.assertRaises(JWTError):
+            verifier.decode(forged)
+
+    def test_unknown_kid_and_bad_signature(self):
+        verifier = self.verifier()
+        with self.assertRaises(JWTError):
+            verifier.decode(jwt.encode(claims(), "secret", algorithm="HS256", headers={"kid": "k9"}))
+        with self.assertRaises(JWTError):
+            verifier.decode(jwt.encode(claims(), "other", algorithm="HS256"))
+
+    def test_scope_and_expiration(self):
+        verifier = self.verifier()
+        with self.assertRaises(JWTError):
+            verifier.verify(verifier.sign(claims(scope="refresh_token")), "access_token")
+        with self.assertRaises(JWTError):
+            verifier.verify(verifier.sign(claims(ttl=-10)), "access_token")
+        with self.assertRaises(JWTError):
+            verifier.decode(verifier.sign({"sub": "test@test.ua", "scope": "access_token"}))
+
+    def test_cache_skips_signature_check(self):
+        verifier = self.verifier()
+        token = verifier.sign(claims())
+        with patch("src.services.tokens.jwt.decode", wraps=jwt.decode) as decode:
+            for _ in range(3):
+                verifier.verify(token, "access_token")
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual((verifier.cache.hits, verifier.cache.misses), (2, 1))
+        # A cached token still has to be of the requested scope
+        with self.assertRaises(JWTError):
+            verifier.verify(token, "refresh_token")
+
+    def test_cache_expires_with_token(self):
+        verifier = self.verifier()
+        token = verifier.sign(claims(ttl=30))
+        verifier.verify(token, "access_token")
+        with patch("src.services.cache.time.monotonic", return_value=time.monotonic() + 31):
+            self.assertIsNone(verifier.cache.get(token))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+"""
+Job worker: delivers confirmation emails and stores avatars queued by the API.
+
+Run one or more of these next to the API with job_queue_backend=redis:
+
+    python worker.py
+"""
+import asyncio
+import logging
+import signal
+
+from src.database.redis_pool import redis_pool
+from src.services import tasks  # noqa: F401 registers the job handlers
+from src.services.email import mail_dispatcher
+from src.services.jobs import create_worker, job_queue
+
+
+async def main():
+    await redis_pool.open()
+    worker = create_worker(job_queue)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    mail_dispatcher.start()
+    try:
+        await worker.run()
+    finally:
+        await mail_dispatcher.stop()
+        await redis_pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(main())